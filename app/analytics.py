@@ -0,0 +1,269 @@
+"""Columnar export of the analytics tables and an in-process query engine over it.
+
+export_analytics() streams facts_consultations, its procedures and the
+dim_date, dim_client and dim_location dimensions from PostgreSQL into Parquet
+files, one file per month for the facts. A month is only rewritten when its
+checksum changed since the last export. Months that disappeared from
+PostgreSQL (archived partitions) keep their files, so the offline history
+outlives the OLTP one.
+
+AnalyticsEngine answers slice-and-dice queries over those files with DuckDB,
+without touching PostgreSQL. pyarrow (export) and duckdb (queries) are
+optional dependencies, imported when first used.
+"""
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+from partitioning import add_months
+
+# Default analytics settings, overridable through FLASK_-prefixed environment variables
+ANALYTICS_DEFAULTS = {
+    "ANALYTICS_DIR": "analytics",
+    "ANALYTICS_EXPORT_BATCH": 50000,
+    "ANALYTICS_MAX_GROUPS": 10000,
+}
+
+MANIFEST = "manifest.json"
+
+# Per month: row count and checksum of the facts and procedures, to skip unchanged months
+MONTH_CHECKSUMS = """
+    SELECT month, SUM(row_count)::bigint, SUM(checksum)::text
+    FROM (
+        SELECT date_trunc('month', date)::date AS month, COUNT(*) AS row_count,
+        SUM(hashtextextended(concat_ws('|', vat_doctor, date, vat, zip, num_diagnostic_codes, num_procedures), 0))
+            AS checksum
+        FROM facts_consultations
+        GROUP BY 1
+        UNION ALL
+        SELECT date_trunc('month', date_timestamp)::date, 0,
+        SUM(hashtextextended(concat_ws('|', vat_doctor, date_timestamp, name), 1))
+        FROM procedure_in_consultation
+        GROUP BY 1
+    ) months
+    GROUP BY month
+    HAVING SUM(row_count) > 0
+    ORDER BY month;
+"""
+
+# name -> (statement, [(column, type)]); monthly datasets take a %(start)s/%(end)s range
+MONTHLY_DATASETS = {
+    "facts_consultations": ("""
+        SELECT vat_doctor::text, date, vat::text, zip::text,
+        num_diagnostic_codes::bigint, num_procedures::bigint
+        FROM facts_consultations
+        WHERE date >= %(start)s AND date < %(end)s;
+    """, [("vat_doctor", "string"), ("date", "timestamp"), ("vat", "string"), ("zip", "string"),
+          ("num_diagnostic_codes", "int"), ("num_procedures", "int")]),
+    "procedures": ("""
+        SELECT vat_doctor::text, date_timestamp, name::text
+        FROM procedure_in_consultation
+        WHERE date_timestamp >= %(start)s AND date_timestamp < %(end)s;
+    """, [("vat_doctor", "string"), ("date", "timestamp"), ("procedure", "string")]),
+    "dim_date": ("""
+        SELECT date, year::int, month::int, day::int
+        FROM dim_date
+        WHERE date >= %(start)s AND date < %(end)s;
+    """, [("date", "timestamp"), ("year", "int"), ("month", "int"), ("day", "int")]),
+}
+
+# Small dimensions, rewritten on every export (ages change with the calendar)
+DIMENSIONS = {
+    "dim_client": ("""
+        SELECT vat::text, gender::text, age::int
+        FROM dim_client;
+    """, [("vat", "string"), ("gender", "string"), ("age", "int")]),
+    "dim_location": ("""
+        SELECT zip::text, MIN(city)::text
+        FROM dim_location
+        GROUP BY zip;
+    """, [("zip", "string"), ("city", "string")]),
+}
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {"exported_at": None, "months": {}}
+
+
+def _write_parquet(conn, statement, columns, params, path, batch_size):
+    """Stream a query into a Parquet file through a server-side cursor and return its row count."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {"string": pa.string(), "timestamp": pa.timestamp("us"), "int": pa.int64()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    rows = 0
+    temporary = f"{path}.tmp"
+    with pq.ParquetWriter(temporary, schema, compression="zstd") as writer:
+        with conn.cursor(name=f"export_{os.path.basename(path).split('.')[0]}") as cur:
+            cur.itersize = batch_size
+            cur.execute(statement, params)
+            while batch := cur.fetchmany(batch_size):
+                values = list(zip(*batch))
+                writer.write_batch(pa.record_batch(
+                    [pa.array(column, type=field.type) for column, field in zip(values, schema)], schema=schema))
+                rows += len(batch)
+    # Readers never see a half written file
+    os.replace(temporary, path)
+    return rows
+
+
+def export_analytics(conn, directory, batch_size, full=False):
+    """Export the changed months and the dimensions; return {month: rows} of the months written."""
+    manifest = read_manifest(directory)
+    previous = {} if full else manifest["months"]
+    for dataset in MONTHLY_DATASETS:
+        os.makedirs(os.path.join(directory, dataset), exist_ok=True)
+
+    written = {}
+    with conn.transaction():
+        # One snapshot for the checksums and every file
+        conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY;")
+        for month, _, checksum in conn.execute(MONTH_CHECKSUMS).fetchall():
+            key = f"{month:%Y-%m}"
+            if previous.get(key, {}).get("checksum") == checksum:
+                continue
+            params = {"start": month, "end": add_months(month, 1)}
+            rows = {
+                dataset: _write_parquet(conn, statement, columns, params,
+                                        os.path.join(directory, dataset, f"{key}.parquet"), batch_size)
+                for dataset, (statement, columns) in MONTHLY_DATASETS.items()
+            }
+            manifest["months"][key] = {"checksum": checksum, "rows": rows}
+            written[key] = rows
+        for dataset, (statement, columns) in DIMENSIONS.items():
+            _write_parquet(conn, statement, columns, None, os.path.join(directory, f"{dataset}.parquet"), batch_size)
+
+    manifest["exported_at"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    temporary = os.path.join(directory, f"{MANIFEST}.tmp")
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+    return written
+
+
+# Slice-and-dice vocabulary of the analytics API
+GROUPINGS = {
+    "year": "d.year",
+    "month": "d.month",
+    "day": "d.day",
+    "zip": "f.zip",
+    "city": "l.city",
+    "doctor": "f.vat_doctor",
+    "client": "f.vat",
+    "gender": "c.gender",
+    "age": "c.age",
+    "procedure": "p.procedure",
+}
+
+# measure -> (expression over consultations, expression when grouped by procedure)
+MEASURES = {
+    "consultations": ("COUNT(*)", "COUNT(DISTINCT (f.vat_doctor, f.date))"),
+    "clients": ("COUNT(DISTINCT f.vat)", "COUNT(DISTINCT f.vat)"),
+    "diagnostic_codes": ("SUM(f.num_diagnostic_codes)", None),
+    "procedures": ("SUM(f.num_procedures)", "COUNT(*)"),
+}
+
+
+class AnalyticsUnavailable(Exception):
+    """Nothing usable has been exported yet."""
+
+
+class AnalyticsEngine:
+    """DuckDB views over the exported Parquet files, reopened when a new export lands."""
+
+    def __init__(self, directory, max_groups):
+        self.directory = directory
+        self.max_groups = max_groups
+        self._db = None
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        path = os.path.join(self.directory, MANIFEST)
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            raise AnalyticsUnavailable("no analytics export yet, run `flask export-analytics`") from None
+        with self._lock:
+            if self._loaded != modified:
+                import duckdb
+
+                db = duckdb.connect()
+                try:
+                    for dataset in MONTHLY_DATASETS:
+                        files = os.path.join(self.directory, dataset, "*.parquet").replace("'", "''")
+                        db.execute(f"CREATE VIEW {dataset} AS SELECT * FROM read_parquet('{files}');")
+                    for dataset in DIMENSIONS:
+                        file = os.path.join(self.directory, f"{dataset}.parquet").replace("'", "''")
+                        db.execute(f"CREATE VIEW {dataset} AS SELECT * FROM read_parquet('{file}');")
+                except duckdb.IOException as error:
+                    # A manifest without Parquet files, e.g. an export of an empty database
+                    db.close()
+                    raise AnalyticsUnavailable(f"incomplete analytics export: {error}") from None
+                self._db, self._loaded = db, modified
+            # One cursor per query: DuckDB connections are not shared between threads
+            return self._db.cursor()
+
+    def query(self, group_by, measures, filters=None, start=None, end=None, rollup=False):
+        """Aggregate the measures over the group_by dimensions.
+
+        filters maps dimensions to accepted values, start/end bound the consultation date.
+        Raises ValueError for unknown names, AnalyticsUnavailable when nothing usable was exported yet.
+        """
+        filters = filters or {}
+        unknown = [name for name in [*group_by, *filters] if name not in GROUPINGS]
+        unknown += [name for name in measures if name not in MEASURES]
+        if unknown:
+            raise ValueError(f"unknown dimensions or measures: {', '.join(unknown)}")
+        if not measures:
+            raise ValueError("at least one measure is required")
+        by_procedure = "procedure" in group_by or "procedure" in filters
+        expressions = []
+        for name in measures:
+            expression = MEASURES[name][1 if by_procedure else 0]
+            if expression is None:
+                raise ValueError(f"{name} cannot be split by procedure")
+            expressions.append(f"{expression} AS {name}")
+
+        conditions, params = [], []
+        for name, values in filters.items():
+            conditions.append(f"CAST({GROUPINGS[name]} AS VARCHAR) IN ({', '.join('?' * len(values))})")
+            params.extend(str(value) for value in values)
+        if start is not None:
+            conditions.append("f.date >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("f.date < ?")
+            params.append(end)
+
+        columns = [f"{GROUPINGS[name]} AS {name}" for name in group_by]
+        keys = ", ".join(GROUPINGS[name] for name in group_by)
+        grouping = ""
+        if group_by:
+            grouping = f"GROUP BY ROLLUP ({keys})" if rollup else f"GROUP BY {keys}"
+        statement = f"""
+            SELECT {", ".join(columns + expressions)}
+            FROM facts_consultations f
+            JOIN dim_date d ON d.date = f.date
+            LEFT JOIN dim_client c ON c.vat = f.vat
+            LEFT JOIN dim_location l ON l.zip = f.zip
+            {"JOIN procedures p ON p.vat_doctor = f.vat_doctor AND p.date = f.date" if by_procedure else ""}
+            {"WHERE " + " AND ".join(conditions) if conditions else ""}
+            {grouping}
+            {"ORDER BY " + ", ".join(f"{name} NULLS FIRST" for name in group_by) if group_by else ""}
+            LIMIT {self.max_groups + 1};
+        """
+        cur = self._connection()
+        rows = cur.execute(statement, params).fetchall()
+        names = [*group_by, *measures]
+        return {
+            "columns": names,
+            "rows": [dict(zip(names, row)) for row in rows[:self.max_groups]],
+            "truncated": len(rows) > self.max_groups,
+        }
@@ -1,12 +1,55 @@
+import io
 import os
+from contextlib import contextmanager
 from logging.config import dictConfig
+import click
 import psycopg
-from datetime import datetime, time
-from flask import Flask, flash, jsonify, redirect, render_template, request, url_for
+from datetime import date, datetime, time
+from time import perf_counter
+from flask import Flask, flash, g, jsonify, make_response, redirect, render_template, request, stream_template, url_for
+from markupsafe import Markup
 from psycopg.rows import namedtuple_row
-
-# Database connection URL
-DATABASE_URL = "postgres://db:db@postgres/db"
+from analytics import (
+    ANALYTICS_DEFAULTS,
+    GROUPINGS,
+    AnalyticsEngine,
+    AnalyticsUnavailable,
+    export_analytics,
+    read_manifest,
+)
+from assets import ASSET_DEFAULTS, StaticFingerprints
+from availability import AVAILABILITY_DEFAULTS, FREE_SLOTS_STATEMENT, create_availability
+from bulk_import import IMPORT_DEFAULTS, IMPORTS, bulk_import
+from cache import CACHE_DEFAULTS, create_cache
+from compression import COMPRESSION_DEFAULTS, apply_encoding, choose_encoding, compressible
+from db import POOL_DEFAULTS, ReplicaRouter, configure_prepared, create_pool, pool_stats
+from metrics import METRICS_DEFAULTS, create_metrics, instrumented_cursors
+from partitioning import (
+    PARTITION_DEFAULTS,
+    add_months,
+    archive_before,
+    ensure_month_partitions,
+    ensure_partitions,
+    migrate,
+    missing_partition,
+    month_start,
+    scanned_partitions,
+)
+from queries import (
+    CONSULTATION_STATEMENTS,
+    SOAP_FIELDS,
+    STATEMENTS,
+    ConsultationConflict,
+    client_history,
+    client_page_statement,
+    client_timeline_statement,
+    consultation_bundle,
+    dashboard_aggregates,
+    edit_consultation,
+    partition_dashboard,
+    register,
+)
+from reference import REFERENCE_DEFAULTS, ReferenceCache
 
 # Logging configuration
 dictConfig({
@@ -28,120 +71,474 @@ dictConfig({
 
 # Flask app initialization
 app = Flask(__name__)
+app.config.from_mapping(POOL_DEFAULTS)
+app.config.from_mapping(CACHE_DEFAULTS)
+app.config.from_mapping(AVAILABILITY_DEFAULTS)
+app.config.from_mapping(IMPORT_DEFAULTS)
+app.config.from_mapping(METRICS_DEFAULTS)
+app.config.from_mapping(REFERENCE_DEFAULTS)
+app.config.from_mapping(COMPRESSION_DEFAULTS)
+app.config.from_mapping(ASSET_DEFAULTS)
+app.config.from_mapping(PARTITION_DEFAULTS)
+app.config.from_mapping(ANALYTICS_DEFAULTS)
+app.config.from_mapping(
+    CLIENT_PAGE_SIZE=50,
+    CLIENT_PAGE_SIZE_MAX=500,
+    CLIENT_LIST_STREAM=True,
+    CLIENT_TIMELINE_PAGE_SIZE=20,
+    CLIENT_TIMELINE_PAGE_SIZE_MAX=200,
+    CLIENT_SEARCH_LIMIT=100,
+    CLIENT_SEARCH_LIMIT_MAX=1000,
+    CLIENT_AUTOCOMPLETE_LIMIT=10,
+    CLIENT_AUTOCOMPLETE_MIN_LENGTH=3,
+)
 app.config.from_prefixed_env()
 log = app.logger
 
+# Request and query instrumentation
+metrics = create_metrics(app.config)
+cursor_classes = instrumented_cursors(metrics)
+
+def configure_connection(conn):
+    """Time every statement run on a pooled connection and apply the prepared statement settings."""
+    configure_prepared(conn, app.config)
+    if app.config["METRICS_ENABLED"]:
+        conn.cursor_factory, conn.server_cursor_factory = cursor_classes
+
+@app.before_request
+def start_request_timer():
+    g.request_started = perf_counter()
+
+@app.after_request
+def record_request_timing(response):
+    started = g.pop("request_started", None)
+    if app.config["METRICS_ENABLED"] and started is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.observe_request(request.method, route, response.status_code, perf_counter() - started)
+    return response
+
+# Shared database connection pool
+pool = create_pool(app.config, configure=configure_connection)
+
+# Streaming replica for the reads of GET handlers, with the primary as fallback
+replica = None
+if app.config["DATABASE_REPLICA_URL"]:
+    replica = create_pool(
+        app.config, name="dental-clinic-replica", configure=configure_connection,
+        conninfo=app.config["DATABASE_REPLICA_URL"],
+    )
+router = ReplicaRouter(pool, replica, app.config["DB_REPLICA_MAX_LAG"], app.config["DB_REPLICA_CHECK_SECONDS"])
+
+# Write position of the browser's last write, so its next pages read from a replica that replayed it
+READ_AFTER_COOKIE = "read_after_lsn"
+
+def read_pool(fresh=False):
+    """Pool for the reads of a GET handler; fresh reads fill caches shared by every browser."""
+    return router.pool(request.cookies.get(READ_AFTER_COOKIE), fresh)
+
+@contextmanager
+def write_connection():
+    """Primary connection for the writes of a handler, committed with the write position its browser must read."""
+    with pool.connection() as conn:
+        yield conn
+        if replica is not None:
+            g.write_lsn = router.commit(conn)
+
+@app.after_request
+def remember_write_position(response):
+    lsn = g.get("write_lsn")
+    if lsn is None or response.status_code >= 400:
+        return response
+    response.set_cookie(
+        READ_AFTER_COOKIE, lsn,
+        max_age=app.config["DB_READ_YOUR_WRITES_SECONDS"], httponly=True, samesite="Lax",
+    )
+    return response
+
+# Result cache for read-mostly queries
+cache = create_cache(app.config)
+
+# Doctor availability by slot, cached per day
+availability = create_availability(app.config)
+
+# Nurse, diagnostic code and medication catalogs, shared by every request
+reference = ReferenceCache(app.config["REFERENCE_CHECK_SECONDS"])
+
+# Offline analytics over the Parquet export, queried in-process with DuckDB
+analytics = AnalyticsEngine(app.config["ANALYTICS_DIR"], app.config["ANALYTICS_MAX_GROUPS"])
+
+# Rendered template fragments, cached under the same tags as the data they show
+@app.template_global()
+def cached_fragment(tag, key, caller):
+    """Render the body of a {% call %} block once per version of tag."""
+    return Markup(cache.get_or_load(tag, f"fragment:{key}", caller))
+
+# Content-hashed static URLs, cached by browsers until the file changes
+fingerprints = StaticFingerprints(app.static_folder)
+if app.config["STATIC_FINGERPRINT"]:
+    app.url_defaults(fingerprints.add_url_version)
+
+@app.after_request
+def cache_static_assets(response):
+    if (request.endpoint == "static" and response.status_code == 200
+            and fingerprints.is_current(request.view_args["filename"], request.args.get("v"))):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["STATIC_MAX_AGE"]
+        response.cache_control.immutable = True
+    return response
+
+# gzip/brotli compression of buffered text responses
+@app.after_request
+def compress_response(response):
+    if not compressible(response, app.config):
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        response.vary.add("Accept-Encoding")
+        return response
+    # Static files are sent as file wrappers; read them so they can be compressed too
+    response.direct_passthrough = False
+    return apply_encoding(response, response.get_data(), encoding, app.config)
+
+# Route to expose connection pool statistics
+@app.route("/pool/stats", methods=("GET",))
+def pool_statistics():
+    """Return the connection pool counters as JSON, with the replica's when one is configured."""
+    stats = pool_stats(pool)
+    if replica is not None:
+        stats["replica"] = router.stats()
+    return jsonify(stats)
+
+@app.cli.command("replica-status")
+def replica_status_command():
+    """Report the replica lag and the pool GET handlers currently read from."""
+    if replica is None:
+        raise click.ClickException("No replica configured, set FLASK_DATABASE_REPLICA_URL")
+    try:
+        replica.wait(timeout=app.config["DB_POOL_TIMEOUT"])
+    except psycopg.Error as e:
+        raise click.ClickException(f"Replica unreachable: {e}")
+    chosen = router.pool()
+    stats = router.stats()
+    click.echo(f"Replica lag: {stats['lag_seconds']} s (max {stats['max_lag_seconds']} s)")
+    click.echo(f"GET handlers read from {chosen.name}")
+
+# Route to expose request and query metrics to Prometheus
+@app.route("/metrics", methods=("GET",))
+def prometheus_metrics():
+    """Return request latencies, query timings and pool gauges in the Prometheus text format."""
+    return app.response_class(metrics.render(pool_stats(pool)), mimetype="text/plain; version=0.0.4")
+
+# Keyset pagination over the (name, vat) index for the client list
+def client_page_args(args):
+    """Read the page size and the (name, vat) position of the last client shown."""
+    page_size = args.get("page_size", app.config["CLIENT_PAGE_SIZE"], type=int)
+    page_size = max(1, min(page_size, app.config["CLIENT_PAGE_SIZE_MAX"]))
+    after_name = args.get("after_name")
+    after_vat = args.get("after_vat")
+    if after_name is None or after_vat is None:
+        after_name = after_vat = None
+    return page_size, after_name, after_vat
+
+def iter_clients(page_size, after_name=None, after_vat=None):
+    """Yield one page of clients from a server-side cursor."""
+    with read_pool(fresh=True).connection() as conn:
+        # Server-side cursors cannot use prepared statements; the rows still come back in binary
+        with conn.cursor(name="client_index", row_factory=namedtuple_row, binary=True) as cur:
+            cur.itersize = page_size
+            cur.execute(
+                client_page_statement(after_name is not None),
+                {"after_name": after_name, "after_vat": after_vat, "page_size": page_size},
+            )
+            yield from cur
+
 # Route to display all clients alphabetically
 @app.route("/", methods=("GET",))
 @app.route("/clients", methods=("GET",))
 def client_index():
-    """Show all clients in alphabetical order."""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            clients = cur.execute("""
-                SELECT vat, name, birth_date, street, city, zip, gender
-                FROM client
-                ORDER BY name ASC;
-            """).fetchall()
-    return render_template("clients/clients.html", clients=clients)
+    """Show one page of clients in alphabetical order."""
+    page_size, after_name, after_vat = client_page_args(request.args)
+    # The generator only takes a connection if the cached page fragment is missing
+    clients = iter_clients(page_size, after_name, after_vat)
+    page_key = f"{page_size}:{after_name}:{after_vat}"
+    if app.config["CLIENT_LIST_STREAM"]:
+        # Streamed rows skip the fragment cache, which would buffer the whole list
+        return stream_template(
+            "clients/clients.html", clients=clients, page_size=page_size, page_key=page_key, fragment_cache=False
+        )
+    return render_template(
+        "clients/clients.html", clients=clients, page_size=page_size, page_key=page_key, fragment_cache=True
+    )
+
+@app.route("/api/clients", methods=("GET",))
+def client_index_json():
+    """Return one page of clients in alphabetical order as JSON."""
+    page_size, after_name, after_vat = client_page_args(request.args)
+    clients = [client._asdict() for client in iter_clients(page_size, after_name, after_vat)]
+    next_page = None
+    if len(clients) == page_size:
+        next_page = {"after_name": clients[-1]["name"], "after_vat": clients[-1]["vat"], "page_size": page_size}
+    return jsonify(clients=clients, next=next_page)
+
+# Answer revalidation requests for cached pages without rendering them again
+def browser_copy_current(req, etag, last_modified):
+    """Tell whether the request's validators still match a cached page."""
+    # Compressed responses carry the weak form of the ETag, so compare weakly as RFC 9110 requires for If-None-Match
+    return req.if_none_match.contains_weak(etag) or (
+        not req.if_none_match
+        and req.if_modified_since is not None
+        and req.if_modified_since >= last_modified
+    )
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+def conditional_page(tag, render):
+    """Render a page tagged in the query cache, or reply 304 if the browser copy is current."""
+    etag = cache.etag(tag)
+    last_modified = cache.last_modified(tag)
+    if browser_copy_current(request, etag, last_modified):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render())
+    return set_validators(response, etag, last_modified)
+
+def load_dashboard():
+    """Run the dashboard ROLLUP and CUBE aggregates, split by grouping level."""
+    with read_pool(fresh=True).connection() as conn:
+        return partition_dashboard(dashboard_aggregates(conn))
 
 # Route for dashboard statistics
 @app.route("/dashboard", methods=("GET",))
 def facts_consultations():
     """Display consultation statistics on the dashboard."""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            consultation_per_grouped_time = cur.execute("""
-                SELECT dd.year, dd.month, dd.day, COUNT(*) AS total_consultation
-                FROM facts_consultations fc
-                JOIN dim_date dd ON fc.date = dd.date
-                GROUP BY ROLLUP(dd.year, dd.month, dd.day)
-                ORDER BY dd.year, dd.month, dd.day;
-            """).fetchall()
-
-            diagnostic_per_age_and_sex = cur.execute("""
-                SELECT dc.age, dc.gender, SUM(fc.num_diagnostic_codes) AS total_diagnostic_codes
-                FROM facts_consultations fc
-                JOIN dim_client dc ON fc.vat = dc.vat
-                GROUP BY CUBE(dc.age, dc.gender)
-                ORDER BY dc.age, dc.gender;
-            """).fetchall()
-
-    return render_template(
+    return conditional_page("dashboard", lambda: render_template(
         "dashboard.html",
-        consultation_per_grouped_time=consultation_per_grouped_time,
-        diagnostic_per_age_and_sex=diagnostic_per_age_and_sex
-    )
+        **cache.get_or_load("dashboard", "aggregates", load_dashboard)
+    ))
+
+# Route to expose query cache statistics
+@app.route("/cache/stats", methods=("GET",))
+def cache_statistics():
+    """Return the query cache counters as JSON."""
+    return jsonify(cache.stats())
+
+# Rebuild the analytics tables behind the dashboard
+REFRESH_ANALYTICS_STATEMENT = register("analytics.refresh", "SELECT refresh_analytics();")
+
+def refresh_analytics():
+    """Recompute every fact and aggregate table from the consultation history."""
+    with write_connection() as conn:
+        conn.execute(REFRESH_ANALYTICS_STATEMENT, prepare=True)
+        conn.commit()
+    cache.invalidate("dashboard")
+
+@app.cli.command("refresh-analytics")
+def refresh_analytics_command():
+    """Rebuild the dashboard analytics tables."""
+    refresh_analytics()
+    log.info("Analytics tables refreshed")
+
+@app.route("/dashboard/refresh", methods=("POST",))
+def refresh_dashboard():
+    """Force a full refresh of the dashboard analytics tables."""
+    refresh_analytics()
+    return redirect(url_for("facts_consultations"))
+
+# Columnar export and slice-and-dice queries over it
+@app.cli.command("export-analytics")
+@click.option("--full", is_flag=True, help="Rewrite every month, not only the changed ones.")
+def export_analytics_command(full):
+    """Export the facts and dimensions to Parquet files in ANALYTICS_DIR."""
+    with pool.connection() as conn:
+        written = export_analytics(conn, app.config["ANALYTICS_DIR"], app.config["ANALYTICS_EXPORT_BATCH"], full)
+    for month, rows in written.items():
+        click.echo(f"{month}: " + ", ".join(f"{dataset} {count}" for dataset, count in rows.items()))
+    click.echo(f"{len(written)} months exported to {app.config['ANALYTICS_DIR']}")
+
+def comma_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+@app.route("/api/analytics", methods=("GET",))
+def analytics_query():
+    """Aggregate exported consultations by any dimensions, e.g. ?by=city,year&measures=consultations&gender=F."""
+    try:
+        start = request.args.get("from")
+        end = request.args.get("to")
+        result = analytics.query(
+            group_by=comma_list(request.args.get("by", "")),
+            measures=comma_list(request.args.get("measures", "consultations")),
+            filters={name: request.args.getlist(name) for name in GROUPINGS if name in request.args},
+            start=datetime.strptime(start, "%Y-%m-%d") if start else None,
+            end=datetime.strptime(end, "%Y-%m-%d") if end else None,
+            rollup=request.args.get("rollup", "false").lower() in ("1", "true", "yes"),
+        )
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    except (AnalyticsUnavailable, ImportError) as error:
+        return jsonify(error=str(error)), 503
+    return jsonify(exported_at=read_manifest(app.config["ANALYTICS_DIR"])["exported_at"], **result)
 
 # Route to show client information
+def timeline_page_args(args):
+    """Read the page size and the (date_timestamp, vat_doctor) position of the last visit shown."""
+    page_size = args.get("page_size", app.config["CLIENT_TIMELINE_PAGE_SIZE"], type=int)
+    page_size = max(1, min(page_size, app.config["CLIENT_TIMELINE_PAGE_SIZE_MAX"]))
+    before_date = args.get("before_date")
+    before_doctor = args.get("before_doctor")
+    if before_date is None or before_doctor is None:
+        before_date = before_doctor = None
+    return page_size, before_date, before_doctor
+
 @app.route("/clients/<vat>", methods=("GET",))
 def client_info(vat):
-    """Display information and appointments for a specific client."""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            client_appointments = cur.execute("""
-                SELECT vat_doctor, date_timestamp, description
-                FROM appointment
-                WHERE vat_client = %(vat)s
-                ORDER BY date_timestamp ASC;
-            """, {"vat": vat}).fetchall()
-
-            client_consultations = cur.execute("""
-                SELECT c.vat_doctor, c.date_timestamp
-                FROM consultation c
-                JOIN appointment a ON c.vat_doctor = a.vat_doctor AND c.date_timestamp = a.date_timestamp
-                WHERE a.vat_client = %(vat)s
-                ORDER BY c.date_timestamp ASC;
-            """, {"vat": vat}).fetchall()
-
-    return render_template(
-        "clients/informations.html",
-        vat=vat,
-        client_consultations=client_consultations,
-        client_appointments=client_appointments
-    )
+    """Display the summary and one page of the visit timeline of a client."""
+    page_size, before_date, before_doctor = timeline_page_args(request.args)
+    with read_pool().connection() as conn:
+        history = client_history(conn, vat, page_size, before_date, before_doctor)
+    if history["summary"] is None:
+        return "Client not found", 404
+    return render_template("clients/informations.html", vat=vat, page_size=page_size, **history)
+
+@app.route("/api/clients/<vat>", methods=("GET",))
+def client_info_json(vat):
+    """Return the summary and one page of the visit timeline of a client as JSON."""
+    page_size, before_date, before_doctor = timeline_page_args(request.args)
+    with read_pool().connection() as conn:
+        history = client_history(conn, vat, page_size, before_date, before_doctor)
+    if history["summary"] is None:
+        return jsonify(error="client not found"), 404
+    timeline = history["timeline"]
+    next_page = None
+    if len(timeline) == page_size:
+        next_page = {
+            "before_date": timeline[-1]["date_timestamp"].isoformat(sep=" "),
+            "before_doctor": timeline[-1]["vat_doctor"],
+            "page_size": page_size,
+        }
+    return jsonify(vat=vat, summary=history["summary"], timeline=timeline, next=next_page)
 
 # Route for consultation details
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>", methods=("GET",))
 def consultation_information(vat, vat_doctor, date_timestamp):
     """Retrieve and display detailed information about a consultation."""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            soap_notes = cur.execute("""
-                SELECT soap_s, soap_o, soap_a, soap_p
-                FROM consultation
-                WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s;
-            """, {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}).fetchone()
-
-            diagnostics = cur.execute("""
-                SELECT cd.id
-                FROM consultation_diagnostic cd
-                WHERE cd.vat_doctor = %(vat_doctor)s AND cd.date_timestamp = %(date_timestamp)s;
-            """, {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}).fetchall()
-
-            prescriptions = cur.execute("""
-                SELECT p.name, p.lab, p.dosage, p.description
-                FROM prescription p
-                WHERE p.vat_doctor = %(vat_doctor)s AND p.date_timestamp = %(date_timestamp)s;
-            """, {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}).fetchall()
-
-            assisting_nurse = cur.execute("""
-                SELECT vat_nurse
-                FROM consultation_assistant ca
-                WHERE ca.vat_doctor = %(vat_doctor)s AND ca.date_timestamp = %(date_timestamp)s;
-            """, {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}).fetchone()
-
+    with read_pool().connection() as conn:
+        bundle = consultation_bundle(conn, vat_doctor, date_timestamp)
     return render_template(
         "clients/consultation_informations.html",
-        soap_notes=soap_notes,
-        diagnostics=diagnostics,
-        prescriptions=prescriptions,
-        assisting_nurse=assisting_nurse,
         vat=vat,
         date_timestamp=date_timestamp,
-        vat_doctor=vat_doctor
+        vat_doctor=vat_doctor,
+        **bundle
     )
 
+@app.route("/api/consultations/<vat_doctor>/<date_timestamp>", methods=("GET",))
+def consultation_information_json(vat_doctor, date_timestamp):
+    """Return the SOAP notes, diagnostics, prescriptions and nurse of a consultation as JSON."""
+    with read_pool().connection() as conn:
+        bundle = consultation_bundle(conn, vat_doctor, date_timestamp)
+    if bundle["soap_notes"] is None:
+        return jsonify(error="consultation not found"), 404
+    return jsonify(vat_doctor=vat_doctor, date_timestamp=date_timestamp, **bundle)
+
+# Batched consultation edits
+PRESCRIPTION_FIELDS = ("id", "name", "lab", "dosage", "description")
+
+def is_key(value):
+    """Whether a JSON value can stand for a database key: an integer or a string."""
+    return isinstance(value, (int, str)) and not isinstance(value, bool)
+
+def consultation_edits(body):
+    """Validate a JSON edit body into edit_consultation keyword arguments, or return an error message."""
+    if not isinstance(body, dict):
+        return None, "expected a JSON object"
+    unknown = set(body) - set(SOAP_FIELDS) - {"nurse", "add_diagnostics", "remove_diagnostics", "prescriptions", "version"}
+    if unknown:
+        return None, f"unknown fields: {', '.join(sorted(unknown))}"
+    for field in SOAP_FIELDS:
+        if field in body and not isinstance(body[field], str):
+            return None, f"{field} must be a string"
+    if body.get("nurse") is not None and not is_key(body["nurse"]):
+        return None, "nurse must be an integer or a string"
+    for field in ("add_diagnostics", "remove_diagnostics", "prescriptions"):
+        if not isinstance(body.get(field, []), list):
+            return None, f"{field} must be a list"
+    for field in ("add_diagnostics", "remove_diagnostics"):
+        if not all(is_key(diagnostic) for diagnostic in body.get(field, [])):
+            return None, f"{field} must hold integers or strings"
+    prescriptions = body.get("prescriptions", [])
+    if not all(isinstance(p, dict) and set(p) == set(PRESCRIPTION_FIELDS) for p in prescriptions):
+        return None, f"each prescription needs exactly: {', '.join(PRESCRIPTION_FIELDS)}"
+    if not all(is_key(p["id"]) and all(isinstance(p[field], str) for field in PRESCRIPTION_FIELDS[1:])
+               for p in prescriptions):
+        return None, "prescription id must be an integer or a string and its other fields strings"
+    version = body.get("version")
+    if version is not None and (isinstance(version, bool) or not isinstance(version, int)):
+        return None, "version must be an integer"
+    return {
+        "soap": {field: body[field] for field in SOAP_FIELDS if field in body},
+        "nurse": body.get("nurse"),
+        "add_diagnostics": body.get("add_diagnostics", []),
+        "remove_diagnostics": body.get("remove_diagnostics", []),
+        "prescriptions": prescriptions,
+        "version": version,
+    }, None
+
+@app.errorhandler(ConsultationConflict)
+def consultation_conflict(error):
+    """Reject an edit made against a stale or missing consultation."""
+    if request.path.startswith("/api/"):
+        return jsonify(error=str(error)), 409
+    return "The consultation was modified by someone else, reload it and try again.", 409
+
+@app.errorhandler(psycopg.DataError)
+def invalid_data(error):
+    """Reject a value the database cannot store, e.g. a malformed timestamp or an oversized note."""
+    message = error.diag.message_primary or str(error)
+    if request.path.startswith("/api/"):
+        return jsonify(error=message), 400
+    return f"Invalid data: {message}", 400
+
+@app.route("/api/consultations/<vat_doctor>/<date_timestamp>", methods=("PATCH",))
+def edit_consultation_api(vat_doctor, date_timestamp):
+    """Apply SOAP, nurse, diagnostic and prescription edits atomically and return the new version."""
+    edits, error = consultation_edits(request.get_json(silent=True))
+    if error:
+        return jsonify(error=error), 400
+    try:
+        with write_connection() as conn:
+            version = edit_consultation(conn, vat_doctor, date_timestamp, **edits)
+    except psycopg.IntegrityError as e:
+        return jsonify(error=e.diag.message_primary or str(e)), 409
+    if edits["add_diagnostics"] or edits["remove_diagnostics"] or edits["prescriptions"]:
+        cache.invalidate("dashboard")
+    return jsonify(vat_doctor=vat_doctor, date_timestamp=date_timestamp, version=version)
+
+@app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/soap", methods=("GET",))
+def modify_soap_view(vat, vat_doctor, date_timestamp):
+    """Display the four SOAP notes of a consultation in one form."""
+    with read_pool().connection() as conn:
+        soap_notes = conn.cursor(row_factory=namedtuple_row).execute(
+            CONSULTATION_STATEMENTS["soap_notes"][0], {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp},
+            prepare=True,
+        ).fetchone()
+    if soap_notes is None:
+        return "Consultation not found", 404
+    return render_template("/clients/modify_soap.html", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp, soap_notes=soap_notes)
+
+@app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/soap", methods=("POST",))
+def modify_soap(vat, vat_doctor, date_timestamp):
+    """Save the four SOAP notes at once, unless the consultation changed since the form was loaded."""
+    soap = {field: request.form.get(field) for field in SOAP_FIELDS}
+    version = request.form.get("version", type=int)
+    with write_connection() as conn:
+        edit_consultation(conn, vat_doctor, date_timestamp, soap=soap, version=version)
+    return redirect(url_for("consultation_information", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp))
+
 # SOAP_S
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/soapS", methods=("GET",))
 def modify_soap_s_view(vat, vat_doctor, date_timestamp):
@@ -155,30 +552,10 @@ def modify_soap_s_view(vat, vat_doctor, date_timestamp):
 
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/soapS", methods=("POST",))
 def modify_soap_s(vat, vat_doctor, date_timestamp):
-    new_soap_s = request.form.get('soap_s', None)
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                UPDATE consultation
-                SET soap_s = %(new_soap_s)s
-                WHERE vat_doctor = %(vat_doctor)s
-                AND date_timestamp = %(date_timestamp)s;
-                """,
-                {
-                    "new_soap_s": new_soap_s,
-                    "vat_doctor": vat_doctor,
-                    "date_timestamp": date_timestamp,
-                }
-            )
-            conn.commit()
-
-    return redirect(url_for(
-        "consultation_information",
-        vat=vat,
-        vat_doctor=vat_doctor,
-        date_timestamp=date_timestamp
-    ))
+    """Replace the SOAP S note of a consultation."""
+    with write_connection() as conn:
+        edit_consultation(conn, vat_doctor, date_timestamp, soap={"soap_s": request.form.get('soap_s')})
+    return redirect(url_for("consultation_information", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp))
 
 # SOAP_O
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/soapO", methods=("GET",))
@@ -193,30 +570,10 @@ def modify_soap_o_view(vat, vat_doctor, date_timestamp):
 
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/soapO", methods=("POST",))
 def modify_soap_o(vat, vat_doctor, date_timestamp):
-    new_soap_o = request.form.get('soap_o', None)
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                UPDATE consultation
-                SET soap_o = %(new_soap_o)s
-                WHERE vat_doctor = %(vat_doctor)s
-                AND date_timestamp = %(date_timestamp)s;
-                """,
-                {
-                    "new_soap_o": new_soap_o,
-                    "vat_doctor": vat_doctor,
-                    "date_timestamp": date_timestamp,
-                }
-            )
-            conn.commit()
-
-    return redirect(url_for(
-        "consultation_information",
-        vat=vat,
-        vat_doctor=vat_doctor,
-        date_timestamp=date_timestamp
-    ))
+    """Replace the SOAP O note of a consultation."""
+    with write_connection() as conn:
+        edit_consultation(conn, vat_doctor, date_timestamp, soap={"soap_o": request.form.get('soap_o')})
+    return redirect(url_for("consultation_information", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp))
 
 # SOAP_A
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/soapA", methods=("GET",))
@@ -231,30 +588,10 @@ def modify_soap_a_view(vat, vat_doctor, date_timestamp):
 
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/soapA", methods=("POST",))
 def modify_soap_a(vat, vat_doctor, date_timestamp):
-    new_soap_a = request.form.get('soap_a', None)
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                UPDATE consultation
-                SET soap_a = %(new_soap_a)s
-                WHERE vat_doctor = %(vat_doctor)s
-                AND date_timestamp = %(date_timestamp)s;
-                """,
-                {
-                    "new_soap_a": new_soap_a,
-                    "vat_doctor": vat_doctor,
-                    "date_timestamp": date_timestamp,
-                }
-            )
-            conn.commit()
-
-    return redirect(url_for(
-        "consultation_information",
-        vat=vat,
-        vat_doctor=vat_doctor,
-        date_timestamp=date_timestamp
-    ))
+    """Replace the SOAP A note of a consultation."""
+    with write_connection() as conn:
+        edit_consultation(conn, vat_doctor, date_timestamp, soap={"soap_a": request.form.get('soap_a')})
+    return redirect(url_for("consultation_information", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp))
 
 # SOAP_P
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/soapP", methods=("GET",))
@@ -269,118 +606,98 @@ def modify_soap_p_view(vat, vat_doctor, date_timestamp):
 
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/soapP", methods=("POST",))
 def modify_soap_p(vat, vat_doctor, date_timestamp):
-    new_soap_p = request.form.get('soap_p', None)
-
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute(
-                """
-                UPDATE consultation
-                SET soap_p = %(new_soap_p)s
-                WHERE vat_doctor = %(vat_doctor)s
-                AND date_timestamp = %(date_timestamp)s;
-                """,
-                {
-                    "new_soap_p": new_soap_p,
-                    "vat_doctor": vat_doctor,
-                    "date_timestamp": date_timestamp,
-                }
-            )
-            conn.commit()
-
-    return redirect(url_for(
-        "consultation_information",
-        vat=vat,
-        vat_doctor=vat_doctor,
-        date_timestamp=date_timestamp
-    ))
+    """Replace the SOAP P note of a consultation."""
+    with write_connection() as conn:
+        edit_consultation(conn, vat_doctor, date_timestamp, soap={"soap_p": request.form.get('soap_p')})
+    return redirect(url_for("consultation_information", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp))
 
 # Assisting nurse
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/nurse", methods=("GET",))
 def modify_nurse_view(vat, vat_doctor, date_timestamp):
     """Display available nurses to assign to the consultation."""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            nurses = cur.execute("""
-                SELECT vat FROM nurse;
-            """).fetchall()
+    nurses = reference.get(pool).nurses
     return render_template("/clients/modify_nurse.html", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp, nurses=nurses)
 
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/modify/nurse", methods=("POST",))
 def modify_nurse(vat, vat_doctor, date_timestamp):
     """Update the assisting nurse for a consultation."""
-    new_nurse = request.form.get('nurse')
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                UPDATE consultation_assistant
-                SET vat_nurse = %(new_nurse)s
-                WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s;
-            """, {"new_nurse": new_nurse, "vat_doctor": vat_doctor, "date_timestamp": date_timestamp})
-            conn.commit()
+    with write_connection() as conn:
+        edit_consultation(conn, vat_doctor, date_timestamp, nurse=request.form.get('nurse'))
     return redirect(url_for("consultation_information", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp))
 
 # Add diagnostic code
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/add/diagnostic", methods=("GET",))
 def add_diagnostic_view(vat, vat_doctor, date_timestamp):
     """Display available diagnostics to add."""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            diagnostics = cur.execute("""
-                SELECT id FROM diagnostic_code;
-            """).fetchall()
+    diagnostics = reference.get(pool).diagnostic_codes
     return render_template("/clients/add_diagnostic.html", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp, diagnostics=diagnostics)
 
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/add/diagnostic", methods=("POST",))
 def add_diagnostic(vat, vat_doctor, date_timestamp):
     """Add a diagnostic code to the consultation."""
-    new_diagnostic = request.form.get('diagnostic')
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                INSERT INTO consultation_diagnostic (vat_doctor, date_timestamp, id)
-                VALUES (%(vat_doctor)s, %(date_timestamp)s, %(new_diagnostic)s);
-            """, {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp, "new_diagnostic": new_diagnostic})
-            conn.commit()
+    with write_connection() as conn:
+        edit_consultation(conn, vat_doctor, date_timestamp, add_diagnostics=[request.form.get('diagnostic')])
+    cache.invalidate("dashboard")
     return redirect(url_for("consultation_information", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp))
 
+# Medication picker served from the reference data cache
+def medication_page_args(args):
+    """Read the search text, page size and the (name, lab) of the last medication shown."""
+    page_size = args.get("page_size", app.config["MEDICATION_PAGE_SIZE"], type=int)
+    page_size = max(1, min(page_size, app.config["MEDICATION_PAGE_SIZE_MAX"]))
+    after = None
+    if args.get("after_name") is not None and args.get("after_lab") is not None:
+        after = (args["after_name"], args["after_lab"])
+    return args.get("q", "").strip(), after, page_size
+
+@app.route("/api/medications", methods=("GET",))
+def medication_picker():
+    """Return one page of medications whose name contains the search text as JSON."""
+    q, after, page_size = medication_page_args(request.args)
+    medications = reference.get(pool).search_medications(q, after, page_size)
+    next_page = None
+    if len(medications) == page_size:
+        next_page = {"q": q, "after_name": medications[-1].name, "after_lab": medications[-1].lab, "page_size": page_size}
+    return jsonify(medications=[medication._asdict() for medication in medications], next=next_page)
+
 # Add prescription
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/add/prescription", methods=("GET",))
 def add_prescription_view(vat, vat_doctor, date_timestamp):
-    """Display form to add a prescription."""
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    """Display form to add a prescription, listing one page of matching medications."""
+    q, after, page_size = medication_page_args(request.args)
+    medications = reference.get(pool).search_medications(q, after, page_size)
+    with read_pool().connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            medications = cur.execute("""
-                SELECT name, lab FROM medication;
-            """).fetchall()
-            diagnostics = cur.execute("""
-                SELECT id FROM consultation_diagnostic
-                WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s;
-            """, {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}).fetchall()
-    return render_template("/clients/add_prescription.html", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp, medications=medications, diagnostics=diagnostics)
+            diagnostics = cur.execute(
+                STATEMENTS["consultation.diagnostic_ids"],
+                {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp},
+                prepare=True,
+            ).fetchall()
+    return render_template("/clients/add_prescription.html", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp, medications=medications, diagnostics=diagnostics, q=q, page_size=page_size)
 
 @app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>/add/prescription", methods=("POST",))
 def add_prescription(vat, vat_doctor, date_timestamp):
     """Insert a prescription for a consultation."""
-    prescription_data = {
-        "vat_doctor": vat_doctor,
-        "date_timestamp": date_timestamp,
+    prescription = {
         "id": request.form.get('id'),
         "name": request.form.get('name'),
         "lab": request.form.get('brand'),
         "dosage": request.form.get('dosage'),
         "description": request.form.get('description'),
     }
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                INSERT INTO prescription (vat_doctor, date_timestamp, id, name, lab, dosage, description)
-                VALUES (%(vat_doctor)s, %(date_timestamp)s, %(id)s, %(name)s, %(lab)s, %(dosage)s, %(description)s);
-            """, prescription_data)
-            conn.commit()
+    with write_connection() as conn:
+        edit_consultation(conn, vat_doctor, date_timestamp, prescriptions=[prescription])
+    cache.invalidate("dashboard")
     return redirect(url_for("consultation_information", vat=vat, vat_doctor=vat_doctor, date_timestamp=date_timestamp))
 
 # Add schedule appointments
+def parse_timestamp(value):
+    """Parse a 'YYYY-MM-DD HH:MM:SS' form timestamp, or return None when malformed."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
 @app.route("/clients/<vat>/schedule", methods=("GET",))
 def schedule_appointment_view(vat):
     """Display the form for scheduling an appointment."""
@@ -392,19 +709,34 @@ def search_doctors(vat):
     date = request.args.get('date')
     time = request.args.get('time')
     date_timestamp = f"{date} {time}:00"
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    slot = parse_timestamp(date_timestamp)
+    if slot is not None and availability.slot_index(slot) is not None:
+        with pool.connection() as conn:
+            available_doctors = availability.free_doctors(conn, slot)
+        return render_template("clients/schedule_appointment.html", vat=vat, available_doctors=available_doctors)
+
+    with pool.connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            available_doctors = cur.execute("""
-                SELECT e.name, e.vat
-                FROM employee e
-                JOIN doctor d ON e.vat = d.vat
-                WHERE NOT EXISTS (
-                    SELECT vat_doctor FROM appointment
-                    WHERE date_timestamp = %(date_timestamp)s AND vat_doctor = e.vat
-                );
-            """, {"date_timestamp": date_timestamp}).fetchall()
+            available_doctors = cur.execute(
+                STATEMENTS["appointment.free_doctors"], {"date_timestamp": date_timestamp}, prepare=True
+            ).fetchall()
     return render_template("clients/schedule_appointment.html", vat=vat, available_doctors=available_doctors)
 
+def insert_appointment(conn, appointment, slot):
+    """Insert an appointment, creating the partitions of its month first if they are missing."""
+    try:
+        with conn.transaction():
+            conn.execute(STATEMENTS["appointment.insert"], appointment, prepare=True)
+    except psycopg.errors.CheckViolation as error:
+        if slot is None or not missing_partition(error):
+            raise
+        with conn.transaction():
+            covered = ensure_month_partitions(conn, [slot], app.config["PARTITION_MONTHS_AHEAD"])
+        if not covered:
+            raise
+        with conn.transaction():
+            conn.execute(STATEMENTS["appointment.insert"], appointment, prepare=True)
+
 @app.route("/client/<vat>/schedule", methods=("POST",))
 def add_appointment(vat):
     """Add a new appointment to the database."""
@@ -414,45 +746,98 @@ def add_appointment(vat):
         "vat_client": vat,
         "description": request.form.get('description', ''),
     }
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
-        with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                INSERT INTO appointment (vat_doctor, date_timestamp, vat_client, description)
-                VALUES (%(vat_doctor)s, %(date_timestamp)s, %(vat_client)s, %(description)s);
-            """, appointment_data)
-            conn.commit()
+    slot = parse_timestamp(appointment_data["date_timestamp"])
+    try:
+        with write_connection() as conn:
+            insert_appointment(conn, appointment_data, slot)
+    except psycopg.errors.CheckViolation as error:
+        # A CHECK constraint, or a month outside the partitioned horizon
+        return f"Cannot book this appointment: {error.diag.message_primary or error}", 400
+    cache.invalidate("dashboard")
+    if slot is not None:
+        availability.book(appointment_data["vat_doctor"], slot)
     return redirect(url_for("client_index"))
 
+@app.route("/api/availability", methods=("GET",))
+def availability_range():
+    """Return every free (doctor, slot) pair for a range of days as JSON."""
+    try:
+        start = datetime.strptime(request.args.get("start", ""), "%Y-%m-%d").date()
+    except ValueError:
+        return jsonify(error="start must be a YYYY-MM-DD date"), 400
+    days = request.args.get("days", 7, type=int)
+    days = max(1, min(days, app.config["AVAILABILITY_MAX_DAYS"]))
+    with pool.connection() as conn:
+        free = availability.free_slots(conn, start, days)
+    return jsonify(slots=[
+        {"slot": slot.isoformat(), "doctors": [{"vat": doctor.vat, "name": doctor.name} for doctor in doctors]}
+        for slot, doctors in free
+    ])
+
+# Client search backed by the pg_trgm GIN indexes in sql/create_indexes.sql
+CLIENT_SEARCH_COLUMNS = {
+    "vat": "CAST(vat AS TEXT)",
+    "name": "name",
+    "street": "street",
+    "city": "city",
+    "zip": "zip",
+}
+
+def like_pattern(value):
+    """Escape LIKE wildcards so user input only ever matches as a substring."""
+    escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def search_clients(filters, limit):
+    """Return clients matching every non-empty filter, best matches first."""
+    predicates, ranks, params = [], [], {"limit": limit}
+    for field, column in CLIENT_SEARCH_COLUMNS.items():
+        value = (filters.get(field) or "").strip()
+        if not value:
+            continue
+        predicates.append(f"{column} ILIKE %({field}_pattern)s")
+        ranks.append(f"similarity({column}, %({field})s)")
+        params[field] = value
+        params[f"{field}_pattern"] = like_pattern(value)
+    where = "WHERE " + " AND ".join(predicates) if predicates else ""
+    rank = " + ".join(ranks) if ranks else "0"
+    # One registered statement per combination of filled-in fields
+    name = f"client.search[{','.join(field for field in CLIENT_SEARCH_COLUMNS if field in params)}]"
+    statement = STATEMENTS.get(name) or register(name, f"""
+        SELECT vat, name, birth_date, street, city, zip, gender, {rank} AS rank
+        FROM client
+        {where}
+        ORDER BY rank DESC, name ASC, vat ASC
+        LIMIT %(limit)s;
+    """)
+
+    with read_pool().connection() as conn:
+        with conn.cursor(row_factory=namedtuple_row) as cur:
+            return cur.execute(statement, params, prepare=True).fetchall()
+
 # Route to filter clients
 @app.route("/clients/filter", methods=("GET",))
 def client_filter():
     """Filter clients based on multiple criteria."""
-    vat_filter = request.args.get('vat', None)
-    name_filter = request.args.get('name', None)
-    street_filter = request.args.get('street', None)
-    city_filter = request.args.get('city', None)
-    zip_filter = request.args.get('zip', None)
+    limit = request.args.get("limit", app.config["CLIENT_SEARCH_LIMIT"], type=int)
+    limit = max(1, min(limit, app.config["CLIENT_SEARCH_LIMIT_MAX"]))
+    client_filter = search_clients(request.args, limit)
+    return render_template("clients/filter.html", client_filter=client_filter)
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+@app.route("/api/clients/autocomplete", methods=("GET",))
+def client_autocomplete():
+    """Suggest clients whose name contains the typed text."""
+    query = request.args.get("q", "").strip()
+    if len(query) < app.config["CLIENT_AUTOCOMPLETE_MIN_LENGTH"]:
+        return jsonify(clients=[])
+    with read_pool().connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            client_filter = cur.execute("""
-                SELECT vat, name, street, city, zip, gender
-                FROM client
-                WHERE CAST(vat AS TEXT) LIKE %(vat)s
-                AND name ILIKE %(name)s
-                AND street ILIKE %(street)s
-                AND city ILIKE %(city)s
-                AND zip ILIKE %(zip)s
-                ORDER BY name ASC;
-            """, {
-                "vat": "%" + vat_filter + "%" if vat_filter else "%",
-                "name": "%" + name_filter + "%" if name_filter else "%",
-                "street": "%" + street_filter + "%" if street_filter else "%",
-                "city": "%" + city_filter + "%" if city_filter else "%",
-                "zip": "%" + zip_filter + "%" if zip_filter else "%"
-            }).fetchall()
-
-    return render_template("clients/filter.html", client_filter=client_filter)
+            suggestions = cur.execute(STATEMENTS["client.autocomplete"], {
+                "q": query,
+                "pattern": like_pattern(query),
+                "limit": app.config["CLIENT_AUTOCOMPLETE_LIMIT"],
+            }, prepare=True).fetchall()
+    return jsonify(clients=[suggestion._asdict() for suggestion in suggestions])
 
 # Route to add a new client
 @app.route("/clients/add", methods=("GET",))
@@ -471,19 +856,134 @@ def add_client_db():
     zip = request.form.get('zip')
     gender = request.form.get('gender')
 
-    with psycopg.connect(conninfo=DATABASE_URL) as conn:
+    with write_connection() as conn:
         with conn.cursor(row_factory=namedtuple_row) as cur:
-            cur.execute("""
-                INSERT INTO client (vat, name, birth_date, street, city, zip, gender)
-                VALUES (%(vat)s, %(name)s, %(birthdate)s, %(street)s, %(city)s, %(zip)s, %(gender)s);
-            """, {
+            cur.execute(STATEMENTS["client.insert"], {
                 "vat": vat, "name": name, "birthdate": birthdate,
                 "street": street, "city": city, "zip": zip, "gender": gender
-            })
+            }, prepare=True)
             conn.commit()
 
+    cache.invalidate("dashboard", "clients")
     return redirect(url_for("client_index"))
 
+# Bulk import of clients and appointments
+def import_records(kind, stream, fmt):
+    """Import a CSV or JSON Lines stream, then rebuild the analytics and drop the caches it makes stale."""
+    with write_connection() as conn:
+        report = bulk_import(
+            conn, kind, stream, fmt,
+            app.config["IMPORT_BATCH_SIZE"],
+            app.config["IMPORT_MAX_REPORTED_REJECTS"],
+            app.config["PARTITION_MONTHS_AHEAD"],
+        )
+    # The import skipped the per-row analytics triggers
+    if report.upserted:
+        refresh_analytics()
+    cache.invalidate("dashboard")
+    if kind == "clients":
+        cache.invalidate("clients")
+    availability.invalidate()
+    return report
+
+@app.cli.command("import-data")
+@click.argument("kind", type=click.Choice(sorted(IMPORTS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None,
+              help="Input format, guessed from the file extension by default.")
+def import_data_command(kind, path, fmt):
+    """Bulk import clients or appointments from a CSV or JSON Lines file."""
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".json")) else "csv")
+    with open(path, newline="", encoding="utf-8") as stream:
+        report = import_records(kind, stream, fmt)
+    for reject in report.rejects:
+        click.echo(f"line {reject['line']}: {reject['reason']}", err=True)
+    click.echo(f"{report.read} read, {report.upserted} upserted, {report.rejected} rejected")
+
+@app.route("/import/<kind>", methods=("POST",))
+def import_upload(kind):
+    """Bulk import an uploaded CSV or JSON Lines file and report rejected lines."""
+    if kind not in IMPORTS:
+        return jsonify(error=f"unknown import {kind!r}"), 404
+    upload = request.files.get("file")
+    if upload is None:
+        return jsonify(error="missing file"), 400
+    fmt = request.form.get("format") or ("jsonl" if upload.filename.endswith((".jsonl", ".json")) else "csv")
+    if fmt not in ("csv", "jsonl"):
+        return jsonify(error=f"unsupported format {fmt!r}"), 400
+    stream = io.TextIOWrapper(upload.stream, encoding="utf-8", newline="")
+    return jsonify(import_records(kind, stream, fmt).as_dict())
+
+# Monthly partitions of the history tables and archival of old months
+@app.cli.command("partition-tables")
+def partition_tables_command():
+    """Convert appointment, consultation, consultation_diagnostic and prescription to monthly partitions."""
+    with pool.connection() as conn:
+        migrated = migrate(conn, app.config["PARTITION_MONTHS_AHEAD"])
+    click.echo(f"Partitioned {', '.join(migrated)}" if migrated else "Tables already partitioned")
+
+@app.cli.command("create-partitions")
+@click.option("--months-ahead", type=int, default=None, help="Months to cover from the current one.")
+def create_partitions_command(months_ahead):
+    """Create the monthly partitions of the coming months; run it periodically."""
+    months_ahead = app.config["PARTITION_MONTHS_AHEAD"] if months_ahead is None else months_ahead
+    this_month = month_start(date.today())
+    with pool.connection() as conn:
+        created = ensure_partitions(conn, this_month, add_months(this_month, months_ahead))
+    click.echo(f"{created} partitions created")
+
+@app.cli.command("archive-partitions")
+@click.option("--before", "before", default=None, metavar="YYYY-MM",
+              help="Archive the months before this one (default: older than ARCHIVE_AFTER_MONTHS).")
+def archive_partitions_command(before):
+    """Write old months to compressed CSV files in ARCHIVE_DIR and drop their partitions."""
+    if before:
+        cutoff = datetime.strptime(before, "%Y-%m").date()
+    else:
+        cutoff = add_months(month_start(date.today()), -app.config["ARCHIVE_AFTER_MONTHS"])
+    with pool.connection() as conn:
+        archived = archive_before(conn, cutoff, app.config["ARCHIVE_DIR"])
+    for month, rows in archived.items():
+        click.echo(f"{month:%Y-%m}: " + ", ".join(f"{table} {count}" for table, count in rows.items()))
+    click.echo(f"{len(archived)} months archived to {app.config['ARCHIVE_DIR']}")
+
+@app.cli.command("check-partition-pruning")
+def check_partition_pruning_command():
+    """Run the app's history reads under EXPLAIN ANALYZE and report the partitions they touch."""
+    with pool.connection() as conn:
+        sample = conn.execute("""
+            SELECT a.vat_client, c.vat_doctor, c.date_timestamp
+            FROM consultation c
+            JOIN appointment a ON a.vat_doctor = c.vat_doctor AND a.date_timestamp = c.date_timestamp
+            ORDER BY c.date_timestamp DESC
+            LIMIT 1;
+        """).fetchone()
+        if sample is None:
+            raise click.ClickException("No consultation to sample")
+        vat, vat_doctor, date_timestamp = sample
+        key = {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}
+        # name -> (statement, parameters, whether a single partition per table is expected)
+        checks = {
+            f"consultation {name}": (statement, key, True)
+            for name, (statement, _) in CONSULTATION_STATEMENTS.items()
+        }
+        checks["availability day"] = (FREE_SLOTS_STATEMENT, {
+            "first": date_timestamp.date(), "last": date_timestamp.date(),
+            "slots_per_day": availability.slots_per_day, "day_start": availability.day_start, "slot": availability.slot,
+        }, True)
+        # Newest first across every month: all partitions are opened, LIMIT stops the scans early
+        checks["client timeline"] = (client_timeline_statement(False), {"vat": vat, "page_size": 20}, False)
+
+        failed = False
+        for name, (statement, params, pruned) in checks.items():
+            scanned = scanned_partitions(conn, statement, params)
+            ok = not pruned or all(count <= 1 for count, _ in scanned.values())
+            failed = failed or not ok
+            tables = ", ".join(f"{table} {count}/{total}" for table, (count, total) in scanned.items()) or "-"
+            click.echo(f"{'ok' if ok else 'NOT PRUNED':<11} {name:<28} {tables}")
+    if failed:
+        raise click.ClickException("Some reads scan more partitions than expected")
+
 # Main application runner
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,249 @@
+"""ASGI serving mode.
+
+The read-heavy pages run as async Quart views on a psycopg AsyncConnectionPool,
+with the independent queries of a page pipelined on one connection. They read
+through the Flask app's replica router (honouring its read_after_lsn cookie)
+and feed the same metrics. Every other route, including every write, is
+forwarded to the Flask app, so both modes serve the same URLs.
+
+Run with: hypercorn asgi:application --bind 0.0.0.0:8000
+"""
+import asyncio
+import contextlib
+from time import perf_counter
+from hypercorn.middleware import AsyncioWSGIMiddleware
+from psycopg.rows import namedtuple_row
+from psycopg_pool import AsyncConnectionPool
+from markupsafe import Markup
+from quart import Quart, g, render_template, request
+from werkzeug.exceptions import HTTPException
+from app import app as flask_app
+from app import (
+    READ_AFTER_COOKIE,
+    browser_copy_current,
+    cache,
+    client_page_args,
+    fingerprints,
+    metrics,
+    router,
+    set_validators,
+    timeline_page_args,
+)
+from compression import apply_encoding, choose_encoding, compressible
+from db import configure_prepared
+from metrics import instrumented_cursors
+from queries import (
+    CONSULTATION_STATEMENTS,
+    DASHBOARD_STATEMENTS,
+    client_history_statements,
+    client_page_statement,
+    partition_dashboard,
+    run_concurrently,
+    run_pipelined_async,
+)
+
+quart_app = Quart(
+    __name__,
+    root_path=flask_app.root_path,
+    template_folder=flask_app.template_folder,
+    static_folder=flask_app.static_folder,
+)
+
+cursor_classes = instrumented_cursors(metrics, asynchronous=True)
+
+
+async def configure_connection(conn):
+    """Time every statement run on an async pooled connection and apply the prepared statement settings."""
+    configure_prepared(conn, flask_app.config)
+    if flask_app.config["METRICS_ENABLED"]:
+        conn.cursor_factory, conn.server_cursor_factory = cursor_classes
+
+
+def create_async_pool(name, conninfo):
+    config = flask_app.config
+    return AsyncConnectionPool(
+        conninfo=conninfo,
+        min_size=config["DB_POOL_MIN_SIZE"],
+        max_size=config["DB_POOL_MAX_SIZE"],
+        timeout=config["DB_POOL_TIMEOUT"],
+        max_idle=config["DB_POOL_MAX_IDLE"],
+        max_lifetime=config["DB_POOL_MAX_LIFETIME"],
+        check=AsyncConnectionPool.check_connection if config["DB_POOL_HEALTH_CHECK"] else None,
+        configure=configure_connection,
+        name=name,
+        open=False,
+    )
+
+
+async_pool = create_async_pool("dental-clinic-async", flask_app.config["DATABASE_URL"])
+async_replica = None
+if router.replica is not None:
+    async_replica = create_async_pool("dental-clinic-async-replica", flask_app.config["DATABASE_REPLICA_URL"])
+pools = [pool for pool in (async_pool, async_replica) if pool is not None]
+background = []
+
+if flask_app.config["STATIC_FINGERPRINT"]:
+    quart_app.url_defaults(fingerprints.add_url_version)
+
+
+async def sample_replica():
+    # The router samples the replica with the Flask app's blocking pool: keep that off the event loop
+    while True:
+        await asyncio.to_thread(router.refresh)
+        await asyncio.sleep(router.check_seconds)
+
+
+@quart_app.before_serving
+async def open_pool():
+    for pool in pools:
+        await pool.open()
+    if async_replica is not None:
+        background.append(asyncio.create_task(sample_replica()))
+
+
+@quart_app.after_serving
+async def close_pool():
+    for task in background:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+    for pool in pools:
+        await pool.close()
+
+
+def read_pool(fresh=False):
+    """Async pool for the reads of a view, chosen by the same rules as the Flask app's read_pool()."""
+    if router.use_replica(request.cookies.get(READ_AFTER_COOKIE), fresh, refresh=False):
+        return async_replica
+    return async_pool
+
+
+@quart_app.before_request
+async def start_request_timer():
+    g.request_started = perf_counter()
+
+
+@quart_app.after_request
+async def record_request_timing(response):
+    started = g.pop("request_started", None)
+    if flask_app.config["METRICS_ENABLED"] and started is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.observe_request(request.method, route, response.status_code, perf_counter() - started)
+    return response
+
+
+@quart_app.template_global()
+async def cached_fragment(tag, key, caller):
+    """Render the body of a {% call %} block once per version of tag."""
+    # In Quart's async Jinja environment caller() returns a coroutine
+    return Markup(await cache.get_or_load_async(tag, f"fragment:{key}", caller))
+
+
+@quart_app.after_request
+async def compress_response(response):
+    if not compressible(response, flask_app.config):
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        response.vary.add("Accept-Encoding")
+        return response
+    return apply_encoding(response, await response.get_data(), encoding, flask_app.config)
+
+
+async def iter_clients(page_size, after_name=None, after_vat=None):
+    """Yield one page of clients; nothing is queried unless the template iterates it."""
+    async with read_pool(fresh=True).connection() as conn:
+        async with conn.cursor(row_factory=namedtuple_row, binary=True) as cur:
+            await cur.execute(
+                client_page_statement(after_name is not None),
+                {"after_name": after_name, "after_vat": after_vat, "page_size": page_size},
+                prepare=True,
+            )
+            async for client in cur:
+                yield client
+
+
+@quart_app.route("/", methods=("GET",))
+@quart_app.route("/clients", methods=("GET",))
+async def client_index():
+    """Show one page of clients in alphabetical order."""
+    page_size, after_name, after_vat = client_page_args(request.args)
+    page_key = f"{page_size}:{after_name}:{after_vat}"
+    return await render_template(
+        "clients/clients.html", clients=iter_clients(page_size, after_name, after_vat), page_size=page_size,
+        page_key=page_key, fragment_cache=True,
+    )
+
+
+@quart_app.route("/clients/<vat>", methods=("GET",))
+async def client_info(vat):
+    """Display the summary and one page of the visit timeline of a client."""
+    page_size, before_date, before_doctor = timeline_page_args(request.args)
+    history = await run_pipelined_async(
+        read_pool(),
+        client_history_statements(before_date is not None),
+        {"vat": vat, "page_size": page_size, "before_date": before_date, "before_doctor": before_doctor},
+    )
+    if history["summary"] is None:
+        return "Client not found", 404
+    return await render_template("clients/informations.html", vat=vat, page_size=page_size, **history)
+
+
+@quart_app.route("/clients/<vat>/consultation/<vat_doctor>/<date_timestamp>", methods=("GET",))
+async def consultation_information(vat, vat_doctor, date_timestamp):
+    """Retrieve and display detailed information about a consultation."""
+    bundle = await run_pipelined_async(
+        read_pool(), CONSULTATION_STATEMENTS, {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}
+    )
+    return await render_template(
+        "clients/consultation_informations.html",
+        vat=vat,
+        date_timestamp=date_timestamp,
+        vat_doctor=vat_doctor,
+        **bundle
+    )
+
+
+async def load_dashboard():
+    return partition_dashboard(await run_concurrently(read_pool(fresh=True), DASHBOARD_STATEMENTS, binary=True))
+
+
+@quart_app.route("/dashboard", methods=("GET",))
+async def facts_consultations():
+    """Display consultation statistics on the dashboard."""
+    etag = cache.etag("dashboard")
+    last_modified = cache.last_modified("dashboard")
+    if browser_copy_current(request, etag, last_modified):
+        response = quart_app.response_class("", status=304)
+    else:
+        aggregates = await cache.get_or_load_async("dashboard", "aggregates", load_dashboard)
+        response = quart_app.response_class(await render_template("dashboard.html", **aggregates))
+    return set_validators(response, etag, last_modified)
+
+
+ASYNC_ENDPOINTS = frozenset(quart_app.view_functions) - {"static"}
+
+# Register the Flask-only routes too, without views, so url_for() in templates can build them
+for rule in flask_app.url_map.iter_rules():
+    if rule.endpoint not in quart_app.view_functions:
+        quart_app.add_url_rule(rule.rule, rule.endpoint, methods=rule.methods)
+
+# Hypercorn's default 64 KiB body limit would turn larger uploads (bulk imports) into bare 400s
+wsgi_application = AsyncioWSGIMiddleware(flask_app, max_body_size=flask_app.config["MAX_CONTENT_LENGTH"])
+url_adapter = quart_app.url_map.bind("localhost")
+
+
+def served_async(scope):
+    try:
+        endpoint, _ = url_adapter.match(scope["path"], method=scope["method"])
+    except HTTPException:
+        return False
+    return endpoint in ASYNC_ENDPOINTS
+
+
+async def application(scope, receive, send):
+    """Dispatch to the async views when one matches, otherwise to the Flask app."""
+    if scope["type"] == "http" and not served_async(scope):
+        await wsgi_application(scope, receive, send)
+    else:
+        await quart_app(scope, receive, send)
@@ -0,0 +1,51 @@
+import hashlib
+import os
+import threading
+from werkzeug.security import safe_join
+
+# Default static asset settings, overridable through FLASK_-prefixed environment variables
+ASSET_DEFAULTS = {
+    "STATIC_FINGERPRINT": True,
+    "STATIC_MAX_AGE": 31536000,
+}
+
+
+class StaticFingerprints:
+    """Content hashes of the static files, used to version their URLs.
+
+    url_for("static", filename=...) gains a ?v=<hash> argument, so a changed file
+    gets a new URL and the old one can be cached by browsers for a year.
+    Hashes are recomputed when a file's modification time changes.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = safe_join(self.folder, filename)
+        if path is None:
+            return None
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        entry = self._hashes.get(filename)
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+        with open(path, "rb") as file:
+            digest = hashlib.sha256(file.read()).hexdigest()[:12]
+        with self._lock:
+            self._hashes[filename] = (mtime, digest)
+        return digest
+
+    def add_url_version(self, endpoint, values):
+        """url_defaults hook adding the content hash to static URLs."""
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            digest = self.get(values["filename"])
+            if digest is not None:
+                values["v"] = digest
+
+    def is_current(self, filename, version):
+        return version is not None and version == self.get(filename)
@@ -0,0 +1,163 @@
+import threading
+import time
+from datetime import date, datetime, timedelta
+from datetime import time as day_time
+from psycopg.rows import namedtuple_row
+from queries import register
+
+# Default working hours and slot grid, overridable through FLASK_-prefixed environment variables
+AVAILABILITY_DEFAULTS = {
+    "AVAILABILITY_DAY_START": "09:00",
+    "AVAILABILITY_DAY_END": "17:00",
+    "AVAILABILITY_SLOT_MINUTES": 60,
+    "AVAILABILITY_CACHE_TTL": 60.0,
+    "AVAILABILITY_MAX_DAYS": 31,
+}
+
+# Anti-join of the slot grid against idx_appointment_vat_doctor_date_timestamp
+FREE_SLOTS_STATEMENT = register("availability.free_slots", """
+        SELECT doc.vat, s.slot
+        FROM generate_series(%(first)s::date, %(last)s::date, interval '1 day') AS d(day)
+        CROSS JOIN generate_series(0, %(slots_per_day)s - 1) AS i(n)
+        CROSS JOIN LATERAL (SELECT d.day::date + %(day_start)s + i.n * %(slot)s AS slot) AS s
+        CROSS JOIN doctor doc
+        WHERE NOT EXISTS (
+            SELECT 1 FROM appointment a
+            WHERE a.vat_doctor = doc.vat
+            AND a.date_timestamp >= s.slot
+            AND a.date_timestamp < s.slot + %(slot)s
+        );
+""")
+
+DOCTORS_STATEMENT = register("availability.doctors", """
+        SELECT e.vat, e.name
+        FROM employee e
+        JOIN doctor d ON e.vat = d.vat
+        ORDER BY e.name;
+""")
+
+
+class AvailabilityEngine:
+    """Free (doctor, slot) pairs per day, cached as one bitmap per doctor.
+
+    Bit n of a doctor's mask is set when the n-th slot of the day is free. Days
+    are loaded with a single query and kept for a TTL; appointments booked
+    through this process clear their bit immediately. Every book() or
+    invalidate() bumps a generation number, and a load that started before the
+    bump is served to its caller but not cached, so it cannot bring back a
+    booked slot.
+    """
+
+    def __init__(self, day_start, day_end, slot_minutes, ttl):
+        self.day_start = day_time.fromisoformat(day_start)
+        self.slot = timedelta(minutes=slot_minutes)
+        working_day = (datetime.combine(date.min, day_time.fromisoformat(day_end))
+                       - datetime.combine(date.min, self.day_start))
+        self.slots_per_day = working_day // self.slot
+        self.ttl = ttl
+        self._days = {}
+        self._doctors = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def slot_index(self, timestamp):
+        """Return the slot number of a timestamp, or None when it is off the grid."""
+        offset = timestamp - datetime.combine(timestamp.date(), self.day_start)
+        if offset < timedelta(0) or offset % self.slot:
+            return None
+        index = offset // self.slot
+        return index if index < self.slots_per_day else None
+
+    def slot_time(self, day, index):
+        return datetime.combine(day, self.day_start) + index * self.slot
+
+    def free_slots(self, conn, start, days):
+        """Return [(slot, [doctor, ...]), ...] for every slot with a free doctor."""
+        wanted = [start + timedelta(days=offset) for offset in range(days)]
+        now = time.monotonic()
+        with self._lock:
+            generation = self._generation
+            doctors = self._doctors
+            cached = {day: dict(self._days[day][1]) for day in wanted
+                      if day in self._days and self._days[day][0] >= now}
+        missing = [day for day in wanted if day not in cached]
+        if missing:
+            doctors, loaded = self._load(conn, min(missing), max(missing), generation)
+            cached.update(loaded)
+
+        free = []
+        for day in wanted:
+            masks = cached[day]
+            for index in range(self.slots_per_day):
+                free_doctors = [doctors[vat] for vat, mask in masks.items() if mask >> index & 1]
+                if free_doctors:
+                    free.append((self.slot_time(day, index), free_doctors))
+        return free
+
+    def free_doctors(self, conn, timestamp):
+        """Return the doctors free at a slot of the grid."""
+        for slot, doctors in self.free_slots(conn, timestamp.date(), 1):
+            if slot == timestamp:
+                return doctors
+        return []
+
+    def book(self, vat_doctor, timestamp):
+        """Mark a doctor's slot as taken in the cached bitmaps."""
+        index = self.slot_index(timestamp)
+        if index is None:
+            return
+        with self._lock:
+            entry = self._days.get(timestamp.date())
+            self._generation += 1
+            if entry is not None and vat_doctor in entry[1]:
+                entry[1][vat_doctor] &= ~(1 << index)
+
+    def invalidate(self):
+        """Forget every cached day, e.g. after appointments were imported in bulk."""
+        with self._lock:
+            self._generation += 1
+            self._days.clear()
+
+    def _load(self, conn, first, last, generation):
+        """Load the doctors and day masks of [first, last], caching them unless
+        the engine moved past `generation` while the query ran."""
+        with conn.pipeline():
+            doctors = conn.cursor(row_factory=namedtuple_row).execute(DOCTORS_STATEMENT, prepare=True)
+
+            free_pairs = conn.cursor().execute(FREE_SLOTS_STATEMENT, {
+                "first": first,
+                "last": last,
+                "slots_per_day": self.slots_per_day,
+                "day_start": self.day_start,
+                "slot": self.slot,
+            }, prepare=True)
+
+        doctors = doctors.fetchall()
+        days = {}
+        for offset in range((last - first).days + 1):
+            days[first + timedelta(days=offset)] = {doctor.vat: 0 for doctor in doctors}
+        for vat, slot in free_pairs.fetchall():
+            days[slot.date()][vat] |= 1 << self.slot_index(slot)
+
+        doctors = {doctor.vat: doctor for doctor in doctors}
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if self._generation != generation:
+                return doctors, days
+            self._doctors = doctors
+            now = time.monotonic()
+            for day in [day for day, entry in self._days.items() if entry[0] < now]:
+                del self._days[day]
+            for day, masks in days.items():
+                self._days[day] = (expires, dict(masks))
+        return doctors, days
+
+
+def create_availability(config):
+    """Create the availability engine from the Flask app configuration."""
+    return AvailabilityEngine(
+        config["AVAILABILITY_DAY_START"],
+        config["AVAILABILITY_DAY_END"],
+        config["AVAILABILITY_SLOT_MINUTES"],
+        config["AVAILABILITY_CACHE_TTL"],
+    )
@@ -0,0 +1,216 @@
+import csv
+import json
+from datetime import date, datetime
+import psycopg
+from partitioning import PARTITION_KEY, PARTITIONED_TABLES, ensure_month_partitions
+
+# Default import settings, overridable through FLASK_-prefixed environment variables
+IMPORT_DEFAULTS = {
+    "IMPORT_BATCH_SIZE": 10000,
+    "IMPORT_MAX_REPORTED_REJECTS": 1000,
+    # Largest request body, uploads included; also applied to the Flask routes served under ASGI
+    "MAX_CONTENT_LENGTH": 256 * 1024 * 1024,
+}
+
+
+def read_records(stream, fmt):
+    """Yield (line, record) pairs from a CSV or JSON Lines text stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "jsonl":
+        for line, text in enumerate(stream, start=1):
+            if text.strip():
+                try:
+                    yield line, json.loads(text)
+                except ValueError:
+                    yield line, None
+    else:
+        raise ValueError(f"unsupported import format: {fmt}")
+
+
+def _required(record, fields):
+    missing = [field for field in fields if not _text(record, field)]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+
+def _text(record, field):
+    return str(record.get(field) or "").strip()
+
+
+def validate_client(record):
+    _required(record, ("vat", "name", "birth_date", "street", "city", "zip", "gender"))
+    gender = _text(record, "gender").upper()
+    if gender not in ("M", "F"):
+        raise ValueError(f"invalid gender {record['gender']!r}")
+    return (
+        _text(record, "vat"),
+        _text(record, "name"),
+        date.fromisoformat(_text(record, "birth_date")),
+        _text(record, "street"),
+        _text(record, "city"),
+        _text(record, "zip"),
+        gender,
+    )
+
+
+def validate_appointment(record):
+    _required(record, ("vat_doctor", "date_timestamp", "vat_client"))
+    return (
+        _text(record, "vat_doctor"),
+        datetime.fromisoformat(_text(record, "date_timestamp")),
+        _text(record, "vat_client"),
+        _text(record, "description"),
+    )
+
+
+# Per table: staging columns, Python validation, SQL rejects and the upsert from staging.
+# DISTINCT ON keeps the last occurrence of a key so one batch never updates a row twice.
+IMPORTS = {
+    "clients": {
+        "table": "client",
+        "columns": ("vat", "name", "birth_date", "street", "city", "zip", "gender"),
+        "validate": validate_client,
+        "rejects": None,
+        "upsert": """
+            INSERT INTO client (vat, name, birth_date, street, city, zip, gender)
+            SELECT DISTINCT ON (vat) vat, name, birth_date, street, city, zip, gender
+            FROM staging_client
+            ORDER BY vat, line DESC
+            ON CONFLICT (vat) DO UPDATE
+            SET name = EXCLUDED.name, birth_date = EXCLUDED.birth_date, street = EXCLUDED.street,
+                city = EXCLUDED.city, zip = EXCLUDED.zip, gender = EXCLUDED.gender;
+        """,
+    },
+    "appointments": {
+        "table": "appointment",
+        "columns": ("vat_doctor", "date_timestamp", "vat_client", "description"),
+        "validate": validate_appointment,
+        "rejects": """
+            SELECT s.line, CASE WHEN d.vat IS NULL THEN 'unknown doctor' ELSE 'unknown client' END
+            FROM staging_appointment s
+            LEFT JOIN doctor d ON d.vat = s.vat_doctor
+            LEFT JOIN client c ON c.vat = s.vat_client
+            WHERE d.vat IS NULL OR c.vat IS NULL
+            ORDER BY s.line;
+        """,
+        "upsert": """
+            INSERT INTO appointment (vat_doctor, date_timestamp, vat_client, description)
+            SELECT DISTINCT ON (s.vat_doctor, s.date_timestamp) s.vat_doctor, s.date_timestamp, s.vat_client, s.description
+            FROM staging_appointment s
+            JOIN doctor d ON d.vat = s.vat_doctor
+            JOIN client c ON c.vat = s.vat_client
+            ORDER BY s.vat_doctor, s.date_timestamp, s.line DESC
+            ON CONFLICT (vat_doctor, date_timestamp) DO UPDATE
+            SET vat_client = EXCLUDED.vat_client, description = EXCLUDED.description;
+        """,
+    },
+}
+
+
+class ImportReport:
+    """Counts of an import plus the first rejected lines."""
+
+    def __init__(self, max_rejects):
+        self.max_rejects = max_rejects
+        self.read = 0
+        self.upserted = 0
+        self.rejected = 0
+        self.rejects = []
+
+    def reject(self, line, reason):
+        self.rejected += 1
+        if len(self.rejects) < self.max_rejects:
+            self.rejects.append({"line": line, "reason": reason})
+
+    def as_dict(self):
+        return {
+            "read": self.read,
+            "upserted": self.upserted,
+            "rejected": self.rejected,
+            "rejects": self.rejects,
+        }
+
+
+def bulk_import(conn, kind, stream, fmt, batch_size, max_rejects, months_ahead=0):
+    """Validate records from a stream and upsert them in COPY-loaded batches.
+
+    Rows of a partitioned table get the partitions of their months created first,
+    up to months_ahead months ahead.
+    """
+    spec = IMPORTS[kind]
+    staging = f"staging_{spec['table']}"
+    columns = ", ".join(("line",) + spec["columns"])
+    report = ImportReport(max_rejects)
+
+    # Rows are only kept until each batch commits
+    conn.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {staging} ON COMMIT DELETE ROWS
+        AS SELECT 0::bigint AS line, {", ".join(spec["columns"])} FROM {spec["table"]} WITH NO DATA;
+    """)
+    conn.commit()
+
+    batch = []
+    for line, record in read_records(stream, fmt):
+        report.read += 1
+        if not isinstance(record, dict):
+            report.reject(line, "malformed record")
+            continue
+        try:
+            batch.append((line,) + spec["validate"](record))
+        except (TypeError, ValueError) as error:
+            report.reject(line, str(error))
+            continue
+        if len(batch) >= batch_size:
+            _prepare_partitions(conn, spec, batch, months_ahead)
+            _load_batch(conn, spec, staging, columns, batch, report)
+            batch = []
+    if batch:
+        _prepare_partitions(conn, spec, batch, months_ahead)
+        _load_batch(conn, spec, staging, columns, batch, report)
+    return report
+
+
+def _prepare_partitions(conn, spec, batch, months_ahead):
+    if spec["table"] not in PARTITIONED_TABLES:
+        return
+    # Staged rows start with their line number
+    key = spec["columns"].index(PARTITION_KEY) + 1
+    with conn.transaction():
+        ensure_month_partitions(conn, [row[key] for row in batch], months_ahead)
+
+
+def _load_batch(conn, spec, staging, columns, batch, report):
+    """Load one batch in its own transaction; if the database refuses it, load each half on its own.
+
+    Halving down to the offending rows costs a few transactions per bad row rather
+    than one per row of the batch. A row the database refuses on its own (type or
+    CHECK violation, no partition for its date...) is reported as rejected and the
+    import carries on.
+    """
+    try:
+        with conn.transaction():
+            # The analytics triggers skip the rows; the caller refreshes the analytics once at the end
+            conn.execute("SET LOCAL clinic.skip_analytics = on;")
+            with conn.cursor() as cur:
+                with cur.copy(f"COPY {staging} ({columns}) FROM STDIN") as copy:
+                    for row in batch:
+                        copy.write_row(row)
+                rejects = cur.execute(spec["rejects"]).fetchall() if spec["rejects"] else []
+                cur.execute(spec["upsert"])
+                upserted = cur.rowcount
+    except psycopg.Error as error:
+        if conn.broken:
+            raise
+        if len(batch) == 1:
+            report.reject(batch[0][0], error.diag.message_primary or str(error))
+        else:
+            middle = len(batch) // 2
+            _load_batch(conn, spec, staging, columns, batch[:middle], report)
+            _load_batch(conn, spec, staging, columns, batch[middle:], report)
+        return
+    for line, reason in rejects:
+        report.reject(line, reason)
+    report.upserted += upserted
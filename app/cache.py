@@ -0,0 +1,183 @@
+import pickle
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+# Default cache settings, overridable through FLASK_-prefixed environment variables
+CACHE_DEFAULTS = {
+    "CACHE_BACKEND": "memory",
+    "CACHE_MAX_ENTRIES": 256,
+    "CACHE_TTL": 300.0,
+    "CACHE_REDIS_URL": "redis://localhost:6379/0",
+}
+
+
+class MemoryBackend:
+    """In-process LRU store whose entries expire after a TTL."""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def set_counter(self, key, value):
+        with self._lock:
+            self._counters[key] = value
+
+    def setdefault_counter(self, key, value):
+        with self._lock:
+            return self._counters.setdefault(key, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """Redis-backed store, shared by every worker process that points at it."""
+
+    def __init__(self, url, ttl):
+        import redis
+
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key):
+        value = self._redis.get(key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        self._redis.set(key, pickle.dumps(value), ex=int(self.ttl))
+
+    def counter(self, key):
+        value = self._redis.get(key)
+        return None if value is None else int(value)
+
+    def incr(self, key):
+        return self._redis.incr(key)
+
+    def set_counter(self, key, value):
+        self._redis.set(key, value)
+
+    def setdefault_counter(self, key, value):
+        # NX: the first worker to get here picks the value for all of them
+        self._redis.set(key, value, nx=True)
+        return int(self._redis.get(key))
+
+    def __len__(self):
+        return self._redis.dbsize()
+
+
+class QueryCache:
+    """Cache query results under tags that writes invalidate.
+
+    Every tag carries a version counter; cached keys embed it, so bumping the
+    version makes all earlier entries of that tag unreachable at once.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.started = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def version(self, tag):
+        return self.backend.counter(f"{tag}:version") or 0
+
+    def generation(self, tag):
+        """Random token of the tag's version counter, drawn again whenever the counter starts over.
+
+        Versions restart at 0 in a new process (memory backend) or after Redis lost
+        its keys, so the same version number can stand for different data.
+        """
+        return self.backend.setdefault_counter(f"{tag}:generation", secrets.randbits(32))
+
+    def etag(self, tag):
+        """Entity tag of pages showing the tag's data, unique across processes and restarts."""
+        return f"{tag}-{self.generation(tag):08x}-{self.version(tag)}"
+
+    def last_modified(self, tag):
+        """Return when the tag was last invalidated (or when the cache started)."""
+        modified = self.backend.counter(f"{tag}:modified")
+        if modified is None:
+            return self.started
+        return datetime.fromtimestamp(modified, timezone.utc)
+
+    def get_or_load(self, tag, key, loader):
+        cache_key = f"{tag}:{self.version(tag)}:{key}"
+        value = self.backend.get(cache_key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = loader()
+        self.backend.set(cache_key, value)
+        return value
+
+    async def get_or_load_async(self, tag, key, loader):
+        """Like get_or_load, awaiting the loader on a miss."""
+        cache_key = f"{tag}:{self.version(tag)}:{key}"
+        value = self.backend.get(cache_key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = await loader()
+        self.backend.set(cache_key, value)
+        return value
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.incr(f"{tag}:version")
+            # Last-Modified has a one second resolution
+            self.backend.set_counter(f"{tag}:modified", int(time.time()))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+def create_cache(config):
+    """Create the query cache selected by the Flask app configuration."""
+    if config["CACHE_BACKEND"] == "redis":
+        backend = RedisBackend(config["CACHE_REDIS_URL"], config["CACHE_TTL"])
+    else:
+        backend = MemoryBackend(config["CACHE_MAX_ENTRIES"], config["CACHE_TTL"])
+    return QueryCache(backend)
@@ -0,0 +1,59 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Default response compression settings, overridable through FLASK_-prefixed environment variables
+COMPRESSION_DEFAULTS = {
+    "COMPRESS_ENABLED": True,
+    "COMPRESS_MIN_SIZE": 500,
+    "COMPRESS_GZIP_LEVEL": 6,
+    "COMPRESS_BROTLI_QUALITY": 5,
+    "COMPRESS_MIMETYPES": "text/html,text/css,text/plain,application/json,application/javascript,image/svg+xml",
+}
+
+
+def choose_encoding(accept_encodings):
+    """Pick the best content coding the client accepts: br when available, then gzip."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compressible(response, config):
+    """Tell whether a buffered response is worth compressing."""
+    return (
+        config["COMPRESS_ENABLED"]
+        and response.status_code == 200
+        # Generated streams are left alone, but files sent with direct passthrough are read whole.
+        # Quart responses have no is_streamed; the async views only return buffered bodies
+        and (not getattr(response, "is_streamed", False) or getattr(response, "direct_passthrough", False))
+        and "Content-Encoding" not in response.headers
+        and response.mimetype in config["COMPRESS_MIMETYPES"].split(",")
+        and (response.content_length is None or response.content_length >= config["COMPRESS_MIN_SIZE"])
+    )
+
+
+def compress(data, encoding, config):
+    if encoding == "br":
+        return brotli.compress(data, quality=config["COMPRESS_BROTLI_QUALITY"])
+    return gzip.compress(data, compresslevel=config["COMPRESS_GZIP_LEVEL"], mtime=0)
+
+
+def apply_encoding(response, data, encoding, config):
+    """Replace the body of a response with its compressed form and fix up the headers."""
+    response.vary.add("Accept-Encoding")
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+    response.set_data(compress(data, encoding, config))
+    response.headers["Content-Encoding"] = encoding
+    response.headers.pop("Accept-Ranges", None)
+    # The compressed bytes are a different representation of the same content
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
@@ -0,0 +1,177 @@
+import atexit
+import logging
+import threading
+import time
+import psycopg
+from psycopg_pool import ConnectionPool
+from queries import register
+
+# Default pool settings, overridable through FLASK_-prefixed environment variables
+# (e.g. FLASK_DB_POOL_MAX_SIZE=20) since app.config.from_prefixed_env() runs after these.
+POOL_DEFAULTS = {
+    "DATABASE_URL": "postgres://db:db@postgres/db",
+    "DB_POOL_MIN_SIZE": 2,
+    "DB_POOL_MAX_SIZE": 10,
+    "DB_POOL_TIMEOUT": 30.0,
+    "DB_POOL_MAX_IDLE": 600.0,
+    "DB_POOL_MAX_LIFETIME": 3600.0,
+    "DB_POOL_HEALTH_CHECK": True,
+    # Server-side prepared statements per pooled connection; disable behind poolers that share sessions
+    "DB_PREPARED_STATEMENTS": True,
+    "DB_PREPARED_MAX": 100,
+    # Streaming replica for the reads of GET handlers; empty to read from the primary only
+    "DATABASE_REPLICA_URL": "",
+    "DB_REPLICA_MAX_LAG": 5.0,
+    "DB_REPLICA_CHECK_SECONDS": 1.0,
+    "DB_READ_YOUR_WRITES_SECONDS": 60,
+}
+
+# Replay position and lag of a standby; a server that is not in recovery reports its own write position.
+# A standby that replayed everything it received is up to date however old its last replayed transaction is.
+REPLICA_STATUS = register("replica.status", """
+    SELECT
+    (CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn() ELSE pg_current_wal_lsn() END)::text,
+    CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8, 'Infinity')
+    END;
+""")
+
+# Position of the primary's WAL after a commit, read in the same round trip as the COMMIT
+WRITE_POSITION = register("replica.write_position", "SELECT pg_current_wal_lsn()::text;")
+
+log = logging.getLogger(__name__)
+
+
+def create_pool(config, name="dental-clinic", configure=None, conninfo=None):
+    """Create and open a connection pool from the Flask app configuration."""
+    pool = ConnectionPool(
+        conninfo=conninfo or config["DATABASE_URL"],
+        min_size=config["DB_POOL_MIN_SIZE"],
+        max_size=config["DB_POOL_MAX_SIZE"],
+        timeout=config["DB_POOL_TIMEOUT"],
+        max_idle=config["DB_POOL_MAX_IDLE"],
+        max_lifetime=config["DB_POOL_MAX_LIFETIME"],
+        check=ConnectionPool.check_connection if config["DB_POOL_HEALTH_CHECK"] else None,
+        configure=configure,
+        name=name,
+        open=False,
+    )
+    pool.open()
+    atexit.register(pool.close)
+    return pool
+
+
+def configure_prepared(conn, config):
+    """Apply the prepared statement settings to a new pooled connection."""
+    conn.prepared_max = config["DB_PREPARED_MAX"]
+    if not config["DB_PREPARED_STATEMENTS"]:
+        # Also turns prepare=True into a plain execution
+        conn.prepare_threshold = None
+
+
+def pool_stats(pool):
+    """Return the pool counters merged with its current sizing."""
+    stats = pool.get_stats()
+    stats.update({
+        "name": pool.name,
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+    })
+    return stats
+
+
+def lsn_value(lsn):
+    """Turn a textual pg_lsn ('16/B374D848') into a comparable integer, or None."""
+    try:
+        high, low = lsn.split("/")
+        return (int(high, 16) << 32) | int(low, 16)
+    except (AttributeError, ValueError):
+        return None
+
+
+class ReplicaRouter:
+    """Pick the pool a read runs on: the replica while it keeps up, the primary otherwise.
+
+    The replica's replay position and lag are sampled at most every check_seconds,
+    by one request at a time. Reads fall back to the primary when no replica is
+    configured, when it is unreachable or lags more than max_lag seconds, and when
+    it has not replayed a write position the reader must see.
+    """
+
+    def __init__(self, primary, replica, max_lag, check_seconds):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_seconds = check_seconds
+        self._checked = float("-inf")
+        self._replayed = None
+        self._lag = None
+        # Newest write position committed through this process
+        self._written = 0
+        self._routed = {"replica": 0, "primary": 0}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Sample the replica's replay position and lag, unless done less than check_seconds ago."""
+        if time.monotonic() - self._checked < self.check_seconds or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._checked = time.monotonic()
+            try:
+                with self.replica.connection(timeout=self.check_seconds) as conn:
+                    replayed, lag = conn.execute(REPLICA_STATUS, prepare=True).fetchone()
+                self._replayed, self._lag = lsn_value(replayed), lag
+            except psycopg.Error as error:
+                if self._lag is not None:
+                    log.warning("Replica unavailable, reading from the primary: %s", error)
+                self._replayed = self._lag = None
+        finally:
+            self._lock.release()
+
+    def use_replica(self, min_lsn=None, fresh=False, refresh=True):
+        """Tell whether a read can run on the replica.
+
+        min_lsn is a textual write position the read must see (the reader's own last
+        write); fresh reads, whose results are cached for everyone, must also see
+        every write made through this process. Without refresh, the last sample is
+        used as is, for callers that sample the replica in the background.
+        """
+        if self.replica is None:
+            return False
+        if refresh:
+            self.refresh()
+        needed = max(lsn_value(min_lsn) or 0, self._written if fresh else 0)
+        usable = (
+            self._lag is not None and self._lag <= self.max_lag
+            and self._replayed is not None and self._replayed >= needed
+        )
+        self._routed["replica" if usable else "primary"] += 1
+        return usable
+
+    def pool(self, min_lsn=None, fresh=False):
+        """Return the pool to read from, see use_replica()."""
+        return self.replica if self.use_replica(min_lsn, fresh) else self.primary
+
+    def commit(self, conn):
+        """Commit the writes of a primary connection, record the write position reached and return it as text.
+
+        The COMMIT and the position read are pipelined, so this takes a single round trip.
+        """
+        with conn.pipeline():
+            # A transaction control statement, which the server cannot prepare
+            conn.execute("COMMIT;")
+            position = conn.execute(WRITE_POSITION, prepare=True)
+        lsn = position.fetchone()[0]
+        self._written = max(self._written, lsn_value(lsn) or 0)
+        return lsn
+
+    def stats(self):
+        """Return the replica pool counters with its last sampled lag and the reads routed to each pool."""
+        stats = pool_stats(self.replica) if self.replica is not None else {}
+        stats.update({
+            "lag_seconds": self._lag,
+            "max_lag_seconds": self.max_lag,
+            "routed": dict(self._routed),
+        })
+        return stats
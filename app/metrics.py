@@ -0,0 +1,262 @@
+import logging
+import re
+import threading
+import time
+from collections import deque
+import psycopg
+from psycopg import sql
+from queries import statement_name
+
+# Default instrumentation settings, overridable through FLASK_-prefixed environment variables
+METRICS_DEFAULTS = {
+    "METRICS_ENABLED": True,
+    "SLOW_QUERY_MS": 200.0,
+    "SLOW_QUERY_EXPLAIN": False,
+}
+
+# Latency buckets in seconds, as Prometheus expects
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger(__name__)
+
+
+class Histogram:
+    """Cumulative latency histogram with a running sum and count."""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def one_line(query):
+    """Collapse a SQL statement to one line short enough to use as a metric label."""
+    if not isinstance(query, str):
+        query = query.as_string(None) if hasattr(query, "as_string") else str(query)
+    text = re.sub(r"\s+", " ", query).strip()
+    return text if len(text) <= 120 else text[:117] + "..."
+
+
+def statement_label(query):
+    """Label a statement by its name in the query registry, or by its collapsed SQL."""
+    return statement_name(query) or one_line(query)
+
+
+class Metrics:
+    """Request and query timings, rendered in the Prometheus text format."""
+
+    def __init__(self, slow_query_ms, explain):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.explain = explain
+        self.requests = {}
+        self.queries = {}
+        self.query_rows = {}
+        self.slow_queries = 0
+        self._lock = threading.Lock()
+
+    def observe_request(self, method, route, status, seconds):
+        with self._lock:
+            self.requests.setdefault((method, route, status), Histogram()).observe(seconds)
+
+    def observe_query(self, statement, rows, seconds):
+        with self._lock:
+            self.queries.setdefault(statement, Histogram()).observe(seconds)
+            if rows > 0:
+                self.query_rows[statement] = self.query_rows.get(statement, 0) + rows
+            if seconds >= self.slow_query_seconds:
+                self.slow_queries += 1
+
+    def render(self, pool_stats=None):
+        lines = []
+        with self._lock:
+            self._render_histograms(
+                lines, "http_request_duration_seconds", "Latency of HTTP requests by route.",
+                {("method", "route", "status"): self.requests},
+            )
+            self._render_histograms(
+                lines, "db_query_duration_seconds", "Latency of SQL statements.",
+                {("statement",): {(statement,): hist for statement, hist in self.queries.items()}},
+            )
+            lines.append("# HELP db_query_rows_total Rows returned or affected by SQL statements.")
+            lines.append("# TYPE db_query_rows_total counter")
+            for statement, rows in self.query_rows.items():
+                lines.append(f'db_query_rows_total{{statement="{_label(statement)}"}} {rows}')
+            lines.append("# HELP db_slow_queries_total SQL statements slower than the slow query threshold.")
+            lines.append("# TYPE db_slow_queries_total counter")
+            lines.append(f"db_slow_queries_total {self.slow_queries}")
+        for name, value in (pool_stats or {}).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE db_pool_{name} gauge")
+                lines.append(f"db_pool_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_histograms(lines, name, help_text, series):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for label_names, histograms in series.items():
+            for label_values, hist in histograms.items():
+                labels = ",".join(f'{key}="{_label(value)}"' for key, value in zip(label_names, label_values))
+                cumulative = 0
+                for bound, count in zip(BUCKETS, hist.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{name}_sum{{{labels}}} {hist.sum}")
+                lines.append(f"{name}_count{{{labels}}} {hist.count}")
+
+
+def instrumented_cursors(metrics, asynchronous=False):
+    """Return cursor classes that time every execute() and executemany() into the given metrics.
+
+    In pipeline mode execute() only queues the statement: it is timed from the
+    call until its results reach the cursor, at the pipeline sync, and its rows
+    are counted then. With asynchronous, the classes are for async connections;
+    their slow queries are logged without EXPLAIN.
+    """
+
+    class TimingMixin:
+        # Statements queued in pipeline mode: [results still expected, query, params, start]
+        _pending = None
+
+        def _enqueue(self, results, query, params):
+            if self._pending is None:
+                self._pending = deque()
+            entry = [results, query, params, time.perf_counter()]
+            self._pending.append(entry)
+            return entry
+
+        def _unqueue(self, entry):
+            # The statement failed before it was sent, its results will never arrive
+            if self._pending and self._pending[-1] is entry:
+                self._pending.pop()
+
+        def _set_results(self, results):
+            # Called as each queued statement's results arrive, at the pipeline sync at the latest
+            super()._set_results(results)
+            if self._pending:
+                self._pending[0][0] -= 1
+                if not self._pending[0][0]:
+                    _, query, params, start = self._pending.popleft()
+                    self._observe(query, params, start)
+
+        def _observe(self, query, params, start):
+            seconds = time.perf_counter() - start
+            statement = statement_label(query)
+            metrics.observe_query(statement, self.rowcount, seconds)
+            if seconds >= metrics.slow_query_seconds:
+                self._log_slow_query(query, params, statement, seconds)
+
+        def _log_slow_query(self, query, params, statement, seconds):
+            plan = ""
+            text = one_line(query)
+            conn = self.connection
+            # EXPLAIN re-plans the statement, so only do it for reads outside pipeline mode
+            if (metrics.explain and isinstance(conn, psycopg.Connection) and not conn.pgconn.pipeline_status
+                    and text.upper().startswith(("SELECT", "WITH"))):
+                try:
+                    explain = sql.SQL("EXPLAIN ") + (query if isinstance(query, sql.Composable) else sql.SQL(query))
+                    with conn.transaction():
+                        rows = psycopg.Cursor(conn).execute(explain, params).fetchall()
+                    plan = "\n" + "\n".join(row[0] for row in rows)
+                except psycopg.Error as error:
+                    plan = f"\n(EXPLAIN failed: {error})"
+            label = text if statement == text else f"{statement}: {text}"
+            log.warning("Slow query (%.1f ms): %s%s", seconds * 1000, label, plan)
+
+    class InstrumentedMixin(TimingMixin):
+        def execute(self, query, params=None, *args, **kwargs):
+            if self.connection.pgconn.pipeline_status:
+                return self._queue(1, query, params, super().execute, query, params, *args, **kwargs)
+            return self._timed(query, params, super().execute, query, params, *args, **kwargs)
+
+        def executemany(self, query, params_seq, *args, **kwargs):
+            params_seq = list(params_seq)
+            if self.connection.pgconn.pipeline_status:
+                return self._queue(len(params_seq), query, None, super().executemany, query, params_seq,
+                                   *args, **kwargs)
+            return self._timed(query, None, super().executemany, query, params_seq, *args, **kwargs)
+
+        def _timed(self, query, params, method, *args, **kwargs):
+            # Results still expected from an aborted pipeline never arrive
+            self._pending = None
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._observe(query, params, start)
+
+        def _queue(self, results, query, params, method, *args, **kwargs):
+            if not results:
+                return method(*args, **kwargs)
+            entry = self._enqueue(results, query, params)
+            try:
+                return method(*args, **kwargs)
+            except BaseException:
+                self._unqueue(entry)
+                raise
+
+    class AsyncInstrumentedMixin(TimingMixin):
+        async def execute(self, query, params=None, *args, **kwargs):
+            if self.connection.pgconn.pipeline_status:
+                return await self._queue(1, query, params, super().execute, query, params, *args, **kwargs)
+            return await self._timed(query, params, super().execute, query, params, *args, **kwargs)
+
+        async def executemany(self, query, params_seq, *args, **kwargs):
+            params_seq = list(params_seq)
+            if self.connection.pgconn.pipeline_status:
+                return await self._queue(len(params_seq), query, None, super().executemany, query, params_seq,
+                                         *args, **kwargs)
+            return await self._timed(query, None, super().executemany, query, params_seq, *args, **kwargs)
+
+        async def _timed(self, query, params, method, *args, **kwargs):
+            self._pending = None
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                self._observe(query, params, start)
+
+        async def _queue(self, results, query, params, method, *args, **kwargs):
+            if not results:
+                return await method(*args, **kwargs)
+            entry = self._enqueue(results, query, params)
+            try:
+                return await method(*args, **kwargs)
+            except BaseException:
+                self._unqueue(entry)
+                raise
+
+    if asynchronous:
+        class AsyncInstrumentedCursor(AsyncInstrumentedMixin, psycopg.AsyncCursor):
+            pass
+
+        class AsyncInstrumentedServerCursor(AsyncInstrumentedMixin, psycopg.AsyncServerCursor):
+            pass
+
+        return AsyncInstrumentedCursor, AsyncInstrumentedServerCursor
+
+    class InstrumentedCursor(InstrumentedMixin, psycopg.Cursor):
+        pass
+
+    class InstrumentedServerCursor(InstrumentedMixin, psycopg.ServerCursor):
+        pass
+
+    return InstrumentedCursor, InstrumentedServerCursor
+
+
+def create_metrics(config):
+    """Create the metrics registry from the Flask app configuration."""
+    return Metrics(config["SLOW_QUERY_MS"], config["SLOW_QUERY_EXPLAIN"])
@@ -0,0 +1,308 @@
+"""Monthly range partitioning of the clinic history tables, and archival of old months.
+
+appointment, consultation, consultation_diagnostic and prescription are
+partitioned by date_timestamp into one partition per month, named like
+appointment_y2024m01. Old months can be archived: their rows are written to
+gzip-compressed CSV files, the partitions are detached and dropped, and the
+dashboard keeps their totals through the *_archived analytics tables
+(sql/create_views.sql).
+"""
+import gzip
+import json
+import os
+import re
+from datetime import date
+
+from psycopg import errors, sql
+
+# Default partitioning settings, overridable through FLASK_-prefixed environment variables
+PARTITION_DEFAULTS = {
+    "PARTITION_MONTHS_AHEAD": 24,
+    "ARCHIVE_DIR": "archive",
+    "ARCHIVE_AFTER_MONTHS": 36,
+}
+
+# In foreign key order: every table references the one before it
+PARTITIONED_TABLES = ("appointment", "consultation", "consultation_diagnostic", "prescription")
+PARTITION_KEY = "date_timestamp"
+PARTITION_NAME = re.compile(r"^(?P<table>\w+)_y(?P<year>\d{4})m(?P<month>\d{2})$")
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(first, last):
+    """Yield the first day of every month from first to last, inclusive."""
+    month = month_start(first)
+    while month <= last:
+        yield month
+        month = add_months(month, 1)
+
+
+def partition_name(table, month):
+    return f"{table}_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(conn, table):
+    row = conn.execute(
+        "SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);", (table,)
+    ).fetchone()
+    return row is not None and row[0] == "p"
+
+
+def partitions(conn, table):
+    """Return {month: partition name} for the monthly partitions of a table."""
+    rows = conn.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s);
+    """, (table,)).fetchall()
+    found = {}
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if match and match["table"] == table:
+            found[date(int(match["year"]), int(match["month"]), 1)] = name
+    return found
+
+
+def ensure_partitions(conn, first, last):
+    """Create the missing monthly partitions from first to last on every partitioned table."""
+    # Serialize with concurrent on-demand creations until the transaction ends
+    conn.execute("SELECT pg_advisory_xact_lock(hashtext('ensure_partitions'));")
+    created = 0
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(conn, table):
+            continue
+        existing = partitions(conn, table)
+        for month in months_between(first, last):
+            if month in existing:
+                continue
+            conn.execute(sql.SQL("""
+                CREATE TABLE {partition} PARTITION OF {table}
+                FOR VALUES FROM ({start}) TO ({end});
+            """).format(
+                partition=sql.Identifier(partition_name(table, month)),
+                table=sql.Identifier(table),
+                start=sql.Literal(month),
+                end=sql.Literal(add_months(month, 1)),
+            ))
+            created += 1
+    return created
+
+
+def missing_partition(error):
+    """Tell whether a database error is a row dated in a month that has no partition."""
+    return isinstance(error, errors.CheckViolation) and (error.diag.message_primary or "").startswith(
+        "no partition of relation")
+
+
+def ensure_month_partitions(conn, days, months_ahead):
+    """Create on demand the partitions of the months of days, from the current month to months_ahead ahead.
+
+    Returns the months within that horizon, whose partitions now exist; rows dated
+    elsewhere (archived or far-future months) are left to fail.
+    """
+    this_month = month_start(date.today())
+    horizon = add_months(this_month, months_ahead)
+    months = sorted({month_start(day) for day in days if this_month <= month_start(day) <= horizon})
+    if months:
+        ensure_partitions(conn, months[0], months[-1])
+    return months
+
+
+def migrate(conn, months_ahead):
+    """Convert the history tables to monthly partitioned tables, keeping their rows.
+
+    Runs in one transaction. Foreign keys touching the tables, their primary and
+    unique keys, indexes and triggers are read from the catalog, dropped and
+    recreated on the partitioned tables, so the migration follows the schema
+    actually deployed. Tables that are already partitioned are skipped.
+    """
+    tables = [table for table in PARTITIONED_TABLES if not is_partitioned(conn, table)]
+    if not tables:
+        return []
+
+    with conn.transaction():
+        foreign_keys = conn.execute("""
+            SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE contype = 'f'
+            AND (conrelid = ANY(%(tables)s::regclass[]) OR confrelid = ANY(%(tables)s::regclass[]));
+        """, {"tables": tables}).fetchall()
+        keys = conn.execute("""
+            SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE contype IN ('p', 'u') AND conrelid = ANY(%(tables)s::regclass[]);
+        """, {"tables": tables}).fetchall()
+        indexes = conn.execute("""
+            SELECT pg_get_indexdef(i.indexrelid)
+            FROM pg_index i
+            WHERE i.indrelid = ANY(%(tables)s::regclass[])
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid);
+        """, {"tables": tables}).fetchall()
+        triggers = conn.execute("""
+            SELECT pg_get_triggerdef(oid)
+            FROM pg_trigger
+            WHERE NOT tgisinternal AND tgrelid = ANY(%(tables)s::regclass[]);
+        """, {"tables": tables}).fetchall()
+        bounds = conn.execute(sql.SQL(" UNION ALL ").join(
+            sql.SQL("SELECT MIN({key}), MAX({key}) FROM {table}").format(
+                key=sql.Identifier(PARTITION_KEY), table=sql.Identifier(table))
+            for table in tables
+        )).fetchall()
+
+        for table, name, _ in foreign_keys:
+            conn.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT {};").format(
+                sql.SQL(table), sql.Identifier(name)))
+
+        for table in tables:
+            old = f"{table}_unpartitioned"
+            conn.execute(sql.SQL("ALTER TABLE {} RENAME TO {};").format(sql.Identifier(table), sql.Identifier(old)))
+            conn.execute(sql.SQL("""
+                CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+                INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS)
+                PARTITION BY RANGE ({key});
+            """).format(table=sql.Identifier(table), old=sql.Identifier(old), key=sql.Identifier(PARTITION_KEY)))
+
+        # Cover the existing rows, and new appointments for months_ahead months
+        horizon = add_months(month_start(date.today()), months_ahead)
+        lows = [low.date() for low, _ in bounds if low is not None]
+        highs = [high.date() for _, high in bounds if high is not None]
+        ensure_partitions(conn, min(lows + [date.today()]), max(highs + [horizon]))
+
+        # Copy before the indexes and triggers exist, so rows are not re-processed one by one
+        for table in tables:
+            old = f"{table}_unpartitioned"
+            conn.execute(sql.SQL("INSERT INTO {} SELECT * FROM {};").format(sql.Identifier(table), sql.Identifier(old)))
+            conn.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(old)))
+
+        for table, name, definition in keys:
+            conn.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {};").format(
+                sql.SQL(table), sql.Identifier(name), sql.SQL(definition)))
+        for (definition,) in indexes + triggers:
+            conn.execute(definition)
+        for table, name, definition in foreign_keys:
+            conn.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {};").format(
+                sql.SQL(table), sql.Identifier(name), sql.SQL(definition)))
+
+    for table in tables:
+        conn.execute(sql.SQL("ANALYZE {};").format(sql.Identifier(table)))
+    return tables
+
+
+def _copy_to_file(conn, query, path):
+    """Write the rows of a query to a gzip-compressed CSV file and return how many there were."""
+    with gzip.open(path, "wb") as archive:
+        with conn.cursor() as cur:
+            with cur.copy(sql.SQL("COPY ({}) TO STDOUT (FORMAT csv, HEADER)").format(query)) as copy:
+                for data in copy:
+                    archive.write(data)
+            return cur.rowcount
+
+
+def _external_references(conn):
+    """Foreign keys from unpartitioned tables into the history tables, with the column matching date_timestamp."""
+    return conn.execute("""
+        SELECT DISTINCT c.conrelid::regclass::text, a.attname
+        FROM pg_constraint c
+        CROSS JOIN LATERAL unnest(c.conkey, c.confkey) AS k(referencing, referenced)
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = k.referencing
+        JOIN pg_attribute r ON r.attrelid = c.confrelid AND r.attnum = k.referenced
+        WHERE c.contype = 'f'
+        AND c.confrelid = ANY(%(tables)s::regclass[])
+        AND NOT c.conrelid = ANY(%(tables)s::regclass[])
+        AND r.attname = %(key)s;
+    """, {"tables": list(PARTITIONED_TABLES), "key": PARTITION_KEY}).fetchall()
+
+
+def archive_month(conn, month, directory):
+    """Archive one month of history to gzip CSV files and drop its partitions.
+
+    Rows of other tables referencing the month (assisting nurses, procedures...)
+    are archived and deleted first; the dashboard totals of the month are folded
+    into the archived analytics tables before the facts rows go away.
+    Returns {table: archived rows}.
+    """
+    end = add_months(month, 1)
+    suffix = f"y{month.year:04d}m{month.month:02d}"
+    os.makedirs(directory, exist_ok=True)
+    archived, written = {}, []
+    try:
+        with conn.transaction():
+            for table, column in _external_references(conn):
+                condition = sql.SQL("{column} >= {start} AND {column} < {end}").format(
+                    column=sql.Identifier(column), start=sql.Literal(month), end=sql.Literal(end))
+                path = os.path.join(directory, f"{table}_{suffix}.csv.gz")
+                written.append(path)
+                archived[table] = _copy_to_file(
+                    conn, sql.SQL("SELECT * FROM {} WHERE {}").format(sql.SQL(table), condition), path)
+                conn.execute(sql.SQL("DELETE FROM {} WHERE {};").format(sql.SQL(table), condition))
+
+            conn.execute("SELECT archive_analytics(%s, %s);", (month, end))
+
+            for table in reversed(PARTITIONED_TABLES):
+                partition = partitions(conn, table).get(month)
+                if partition is None:
+                    continue
+                conn.execute(sql.SQL("ALTER TABLE {} DETACH PARTITION {};").format(
+                    sql.Identifier(table), sql.Identifier(partition)))
+                path = os.path.join(directory, f"{partition}.csv.gz")
+                written.append(path)
+                archived[table] = _copy_to_file(
+                    conn, sql.SQL("SELECT * FROM {}").format(sql.Identifier(partition)), path)
+                conn.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(partition)))
+
+            path = os.path.join(directory, f"manifest_{suffix}.json")
+            written.append(path)
+            with open(path, "w", encoding="utf-8") as manifest:
+                json.dump({"month": month.isoformat(), "rows": archived}, manifest, indent=2)
+    except BaseException:
+        # Nothing was archived if the transaction rolled back; do not leave partial files behind
+        for path in written:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return archived
+
+
+def archive_before(conn, cutoff, directory):
+    """Archive every month that ends on or before cutoff, oldest first."""
+    months = sorted({
+        month
+        for table in PARTITIONED_TABLES if is_partitioned(conn, table)
+        for month in partitions(conn, table)
+        if add_months(month, 1) <= cutoff
+    })
+    return {month: archive_month(conn, month, directory) for month in months}
+
+
+def scanned_partitions(conn, statement, params):
+    """Return {table: (partitions scanned, total partitions)} for a read-only statement.
+
+    The statement runs under EXPLAIN ANALYZE so partitions pruned at execution
+    time (parameterized joins, generic plans) are told apart from those scanned.
+    """
+    with conn.transaction(force_rollback=True):
+        plan = conn.execute(sql.SQL("EXPLAIN (ANALYZE, FORMAT JSON) ") + sql.SQL(statement), params).fetchone()[0]
+    relations = set()
+
+    def walk(node):
+        if "Relation Name" in node and node.get("Actual Loops", 0) > 0:
+            relations.add(node["Relation Name"])
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    scanned = {}
+    for table in PARTITIONED_TABLES:
+        names = set(partitions(conn, table).values())
+        if names and relations & names:
+            scanned[table] = (len(relations & names), len(names))
+    return scanned
@@ -0,0 +1,335 @@
+import asyncio
+from psycopg.rows import dict_row
+
+# Data access shared by the page routes and the JSON API. Each loader is a set of
+# independent statements, sent through psycopg pipeline mode on one connection (one
+# network round trip). The async dashboard runs its two heavy aggregates concurrently
+# on two async connections instead, so the server computes them in parallel.
+
+# Registry of every statement run while serving a request, by name. Request paths execute
+# them with prepare=True, so a pooled connection parses and plans each one once and then
+# only binds and executes it. Statements assembled from fragments register each variant.
+STATEMENTS = {}
+_NAMES = {}
+
+
+def register(name, statement):
+    """Add a statement to the registry and return it."""
+    STATEMENTS[name] = statement
+    _NAMES[statement] = name
+    return statement
+
+
+def statement_name(statement):
+    """Return the registry name of a statement, or None for unregistered SQL."""
+    return _NAMES.get(statement) if isinstance(statement, str) else None
+
+
+# name -> (statement, fetch a single row)
+CONSULTATION_STATEMENTS = {
+    "soap_notes": (register("consultation.soap_notes", """
+        SELECT soap_s, soap_o, soap_a, soap_p, version
+        FROM consultation
+        WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s;
+    """), True),
+    "diagnostics": (register("consultation.diagnostics", """
+        SELECT cd.id
+        FROM consultation_diagnostic cd
+        WHERE cd.vat_doctor = %(vat_doctor)s AND cd.date_timestamp = %(date_timestamp)s;
+    """), False),
+    "prescriptions": (register("consultation.prescriptions", """
+        SELECT p.name, p.lab, p.dosage, p.description
+        FROM prescription p
+        WHERE p.vat_doctor = %(vat_doctor)s AND p.date_timestamp = %(date_timestamp)s;
+    """), False),
+    "assisting_nurse": (register("consultation.assisting_nurse", """
+        SELECT vat_nurse
+        FROM consultation_assistant ca
+        WHERE ca.vat_doctor = %(vat_doctor)s AND ca.date_timestamp = %(date_timestamp)s;
+    """), True),
+}
+
+# Header of the client page, one primary key lookup into the trigger-maintained client_summary
+CLIENT_SUMMARY_STATEMENT = register("client.summary", """
+    SELECT cl.vat, cl.name,
+    COALESCE(cs.total_appointments, 0) AS total_appointments,
+    COALESCE(cs.total_consultations, 0) AS total_consultations,
+    COALESCE(cs.open_appointments, 0) AS open_appointments,
+    cs.first_visit, cs.last_visit
+    FROM client cl
+    LEFT OUTER JOIN client_summary cs ON cs.vat = cl.vat
+    WHERE cl.vat = %(vat)s;
+""")
+
+DASHBOARD_STATEMENTS = {
+    "consultation_per_grouped_time": (register("dashboard.consultation_per_grouped_time", """
+        SELECT fcd.year, fcd.month, fcd.day, SUM(fcd.total_consultation) AS total_consultation
+        FROM facts_consultations_daily fcd
+        GROUP BY ROLLUP(fcd.year, fcd.month, fcd.day)
+        ORDER BY fcd.year, fcd.month, fcd.day;
+    """), False),
+    "diagnostic_per_age_and_sex": (register("dashboard.diagnostic_per_age_and_sex", """
+        SELECT dc.age, dc.gender, SUM(fdc.total_diagnostic_codes) AS total_diagnostic_codes
+        FROM facts_diagnostics_client fdc
+        JOIN dim_client dc ON fdc.vat = dc.vat
+        GROUP BY CUBE(dc.age, dc.gender)
+        ORDER BY dc.age, dc.gender;
+    """), False),
+}
+
+# Single statements of the form and API handlers
+register("client.autocomplete", """
+    SELECT vat, name, city
+    FROM client
+    WHERE name ILIKE %(pattern)s
+    ORDER BY word_similarity(%(q)s, name) DESC, name ASC
+    LIMIT %(limit)s;
+""")
+register("client.insert", """
+    INSERT INTO client (vat, name, birth_date, street, city, zip, gender)
+    VALUES (%(vat)s, %(name)s, %(birthdate)s, %(street)s, %(city)s, %(zip)s, %(gender)s);
+""")
+register("consultation.diagnostic_ids", """
+    SELECT id FROM consultation_diagnostic
+    WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s;
+""")
+register("appointment.free_doctors", """
+    SELECT e.name, e.vat
+    FROM employee e
+    JOIN doctor d ON e.vat = d.vat
+    WHERE NOT EXISTS (
+        SELECT vat_doctor FROM appointment
+        WHERE date_timestamp = %(date_timestamp)s AND vat_doctor = e.vat
+    );
+""")
+register("appointment.insert", """
+    INSERT INTO appointment (vat_doctor, date_timestamp, vat_client, description)
+    VALUES (%(vat_doctor)s, %(date_timestamp)s, %(vat_client)s, %(description)s);
+""")
+
+
+def _client_page_statement(after):
+    # Only the row comparison lets the planner seek into idx_client_name_vat
+    keyset = "WHERE (name, vat) > (%(after_name)s, %(after_vat)s)" if after else ""
+    return f"""
+        SELECT vat, name, birth_date, street, city, zip, gender
+        FROM client
+        {keyset}
+        ORDER BY name ASC, vat ASC
+        LIMIT %(page_size)s;
+    """
+
+
+def _client_timeline_statement(before):
+    # Walks idx_appointment_client_timeline backwards; the subqueries only run for the rows of the page
+    keyset = "AND (a.date_timestamp, a.vat_doctor) < (%(before_date)s, %(before_doctor)s)" if before else ""
+    return f"""
+        SELECT a.date_timestamp, a.vat_doctor, a.description,
+        c.vat_doctor IS NOT NULL AS consulted,
+        ARRAY(
+            SELECT cd.id
+            FROM consultation_diagnostic cd
+            WHERE cd.vat_doctor = a.vat_doctor AND cd.date_timestamp = a.date_timestamp
+            ORDER BY cd.id
+        ) AS diagnostics,
+        (
+            SELECT COALESCE(json_agg(json_build_object(
+                'id', p.id, 'name', p.name, 'lab', p.lab, 'dosage', p.dosage, 'description', p.description
+            ) ORDER BY p.name, p.lab), '[]')
+            FROM prescription p
+            WHERE p.vat_doctor = a.vat_doctor AND p.date_timestamp = a.date_timestamp
+        ) AS prescriptions
+        FROM appointment a
+        LEFT OUTER JOIN consultation c ON c.vat_doctor = a.vat_doctor AND c.date_timestamp = a.date_timestamp
+        WHERE a.vat_client = %(vat)s
+        {keyset}
+        ORDER BY a.date_timestamp DESC, a.vat_doctor DESC
+        LIMIT %(page_size)s;
+    """
+
+
+register("client.page", _client_page_statement(False))
+register("client.page_after", _client_page_statement(True))
+register("client.timeline", _client_timeline_statement(False))
+register("client.timeline_before", _client_timeline_statement(True))
+
+
+def client_page_statement(after):
+    """Return the keyset-paginated client list statement."""
+    return STATEMENTS["client.page_after" if after else "client.page"]
+
+
+def client_timeline_statement(before):
+    """Return the keyset-paginated client timeline statement, newest visit first."""
+    return STATEMENTS["client.timeline_before" if before else "client.timeline"]
+
+
+def client_history_statements(before):
+    """Return the statements of one client page: its summary and a page of its timeline."""
+    return {
+        "summary": (CLIENT_SUMMARY_STATEMENT, True),
+        "timeline": (client_timeline_statement(before), False),
+    }
+
+
+def run_pipelined(conn, statements, params=None, binary=False):
+    """Run independent statements in one round trip and return their rows by name."""
+    with conn.pipeline():
+        cursors = {
+            name: conn.cursor(row_factory=dict_row, binary=binary).execute(statement, params, prepare=True)
+            for name, (statement, _) in statements.items()
+        }
+    return {
+        name: cursors[name].fetchone() if single else cursors[name].fetchall()
+        for name, (_, single) in statements.items()
+    }
+
+
+async def run_pipelined_async(pool, statements, params=None, binary=False):
+    """Run independent statements in one round trip on one async pooled connection."""
+    async with pool.connection() as conn:
+        async with conn.pipeline():
+            cursors = {
+                name: await conn.cursor(row_factory=dict_row, binary=binary).execute(statement, params, prepare=True)
+                for name, (statement, _) in statements.items()
+            }
+        return {
+            name: await (cursors[name].fetchone() if single else cursors[name].fetchall())
+            for name, (_, single) in statements.items()
+        }
+
+
+async def run_concurrently(pool, statements, params=None, binary=False):
+    """Run independent statements concurrently, one async pooled connection each."""
+    async def fetch(statement, single):
+        async with pool.connection() as conn:
+            async with conn.cursor(row_factory=dict_row, binary=binary) as cur:
+                await cur.execute(statement, params, prepare=True)
+                return await (cur.fetchone() if single else cur.fetchall())
+
+    results = await asyncio.gather(*(fetch(statement, single) for statement, single in statements.values()))
+    return dict(zip(statements, results))
+
+
+def consultation_bundle(conn, vat_doctor, date_timestamp):
+    """Fetch SOAP notes, diagnostics, prescriptions and assisting nurse of a consultation."""
+    return run_pipelined(conn, CONSULTATION_STATEMENTS, {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp})
+
+
+def client_history(conn, vat, page_size, before_date=None, before_doctor=None):
+    """Fetch the summary of a client and one page of its timeline, newest first."""
+    return run_pipelined(
+        conn,
+        client_history_statements(before_date is not None),
+        {"vat": vat, "page_size": page_size, "before_date": before_date, "before_doctor": before_doctor},
+    )
+
+
+def dashboard_aggregates(conn):
+    """Run the dashboard ROLLUP and CUBE aggregates, transferring the rows in binary."""
+    return run_pipelined(conn, DASHBOARD_STATEMENTS, binary=True)
+
+
+def partition_dashboard(aggregates):
+    """Split the ROLLUP and CUBE rows by grouping level, so the template reads each row once."""
+    sections = {
+        "yearly": [], "monthly": [], "daily": [],
+        "per_age_and_gender": [], "per_age": [], "per_gender": [],
+    }
+    for row in aggregates["consultation_per_grouped_time"]:
+        if row["year"] is None:
+            continue  # grand total
+        if row["month"] is None:
+            sections["yearly"].append(row)
+        elif row["day"] is None:
+            sections["monthly"].append(row)
+        else:
+            sections["daily"].append(row)
+    for row in aggregates["diagnostic_per_age_and_sex"]:
+        if row["age"] is not None and row["gender"] is not None:
+            sections["per_age_and_gender"].append(row)
+        elif row["age"] is not None:
+            sections["per_age"].append(row)
+        elif row["gender"] is not None:
+            sections["per_gender"].append(row)
+    return sections
+
+
+# Consultation edits. Every edit bumps consultation.version (sql/create_consultation_version.sql),
+# so a client that sends the version it read cannot overwrite a change made since.
+SOAP_FIELDS = ("soap_s", "soap_o", "soap_a", "soap_p")
+
+
+class ConsultationConflict(Exception):
+    """The consultation does not exist or changed since the given version was read."""
+
+
+register("consultation.update_nurse", """
+    UPDATE consultation_assistant
+    SET vat_nurse = %(vat_nurse)s
+    WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s;
+""")
+register("consultation.remove_diagnostic", """
+    DELETE FROM consultation_diagnostic
+    WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s AND id = %(id)s;
+""")
+register("consultation.add_diagnostic", """
+    INSERT INTO consultation_diagnostic (vat_doctor, date_timestamp, id)
+    VALUES (%(vat_doctor)s, %(date_timestamp)s, %(id)s);
+""")
+register("consultation.add_prescription", """
+    INSERT INTO prescription (vat_doctor, date_timestamp, id, name, lab, dosage, description)
+    VALUES (%(vat_doctor)s, %(date_timestamp)s, %(id)s, %(name)s, %(lab)s, %(dosage)s, %(description)s);
+""")
+
+
+def consultation_update_statement(fields, guarded):
+    """Return the version-bumping consultation UPDATE setting the given SOAP fields, registered per variant."""
+    name = f"consultation.update[{','.join(fields)}{';guarded' if guarded else ''}]"
+    statement = STATEMENTS.get(name)
+    if statement is None:
+        assignments = [f"{field} = %({field})s" for field in fields] + ["version = version + 1"]
+        guard = "AND version = %(version)s" if guarded else ""
+        statement = register(name, f"""
+            UPDATE consultation
+            SET {", ".join(assignments)}
+            WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s
+            {guard}
+            RETURNING version;
+        """)
+    return statement
+
+
+def edit_consultation(conn, vat_doctor, date_timestamp, soap=None, nurse=None,
+                      add_diagnostics=(), remove_diagnostics=(), prescriptions=(), version=None):
+    """Apply any subset of edits to a consultation in one transaction and return its new version."""
+    key = {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}
+    soap = {field: value for field, value in (soap or {}).items() if field in SOAP_FIELDS}
+    with conn.transaction():
+        with conn.pipeline():
+            consultation = conn.cursor()
+            consultation.execute(
+                consultation_update_statement(tuple(soap), version is not None),
+                {**key, **soap, "version": version},
+                prepare=True,
+            )
+
+            with conn.cursor() as cur:
+                # executemany() always prepares its statement
+                if nurse is not None:
+                    cur.execute(STATEMENTS["consultation.update_nurse"], {**key, "vat_nurse": nurse}, prepare=True)
+                if remove_diagnostics:
+                    cur.executemany(STATEMENTS["consultation.remove_diagnostic"],
+                                    [{**key, "id": diagnostic} for diagnostic in remove_diagnostics])
+                if add_diagnostics:
+                    cur.executemany(STATEMENTS["consultation.add_diagnostic"],
+                                    [{**key, "id": diagnostic} for diagnostic in add_diagnostics])
+                if prescriptions:
+                    cur.executemany(STATEMENTS["consultation.add_prescription"],
+                                    [{**key, **prescription} for prescription in prescriptions])
+
+        row = consultation.fetchone()
+        if row is None:
+            # Leaving the transaction block with an exception rolls every edit back
+            raise ConsultationConflict(f"consultation {vat_doctor} {date_timestamp} is missing or was modified")
+    return row[0]
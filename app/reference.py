@@ -0,0 +1,96 @@
+import bisect
+import logging
+import threading
+import time
+from collections import namedtuple
+import psycopg
+from psycopg.rows import namedtuple_row
+from queries import register
+
+# Default reference data settings, overridable through FLASK_-prefixed environment variables
+REFERENCE_DEFAULTS = {
+    "REFERENCE_CHECK_SECONDS": 5.0,
+    "MEDICATION_PAGE_SIZE": 50,
+    "MEDICATION_PAGE_SIZE_MAX": 500,
+}
+
+log = logging.getLogger(__name__)
+
+Medication = namedtuple("Medication", ("name", "lab"))
+
+VERSION_STATEMENT = register("reference.version", "SELECT version FROM reference_version;")
+NURSES_STATEMENT = register("reference.nurses", "SELECT vat FROM nurse ORDER BY vat;")
+DIAGNOSTIC_CODES_STATEMENT = register("reference.diagnostic_codes", "SELECT id FROM diagnostic_code ORDER BY id;")
+MEDICATIONS_STATEMENT = register("reference.medications", "SELECT name, lab FROM medication;")
+
+
+class ReferenceData:
+    """Immutable snapshot of the nurse, diagnostic code and medication catalogs."""
+
+    def __init__(self, version, nurses, diagnostic_codes, medications):
+        self.version = version
+        self.nurses = tuple(nurses)
+        self.diagnostic_codes = tuple(diagnostic_codes)
+        self.medications = tuple(sorted(Medication(row.name, row.lab) for row in medications))
+        self._lowered = tuple(medication.name.lower() for medication in self.medications)
+
+    def search_medications(self, query="", after=None, limit=50):
+        """Return up to limit medications containing query, ordered by (name, lab) after a cursor."""
+        start = bisect.bisect_right(self.medications, tuple(after)) if after else 0
+        query = query.lower()
+        found = []
+        for index in range(start, len(self.medications)):
+            if query in self._lowered[index]:
+                found.append(self.medications[index])
+                if len(found) == limit:
+                    break
+        return found
+
+
+class ReferenceCache:
+    """Process-wide reference data, reloaded when the database version changes.
+
+    The version lives in the reference_version table (sql/create_reference_version.sql)
+    and is bumped by statement triggers on nurse, diagnostic_code and medication.
+    The catalogs load on first use and the version is checked at most once every
+    check_seconds.
+    """
+
+    def __init__(self, check_seconds):
+        self.check_seconds = check_seconds
+        self._data = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, pool):
+        """Return the current snapshot, loading it on first use.
+
+        A failed version check is logged and the previous snapshot served until the
+        next check; it raises only when there is no snapshot yet.
+        """
+        data = self._data
+        if data is not None and time.monotonic() - self._checked < self.check_seconds:
+            return data
+        with self._lock:
+            if self._data is None or time.monotonic() - self._checked >= self.check_seconds:
+                try:
+                    self._data = self._refresh(pool, self._data)
+                except psycopg.Error as error:
+                    if self._data is None:
+                        raise
+                    log.warning("Reference data version check failed, serving version %s: %s",
+                                self._data.version, error)
+                self._checked = time.monotonic()
+            return self._data
+
+    def _refresh(self, pool, current):
+        with pool.connection() as conn:
+            version = conn.execute(VERSION_STATEMENT, prepare=True).fetchone()[0]
+            if current is not None and current.version == version:
+                return current
+            with conn.pipeline():
+                nurses = conn.cursor(row_factory=namedtuple_row).execute(NURSES_STATEMENT, prepare=True)
+                diagnostic_codes = conn.cursor(row_factory=namedtuple_row).execute(
+                    DIAGNOSTIC_CODES_STATEMENT, prepare=True)
+                medications = conn.cursor(row_factory=namedtuple_row).execute(MEDICATIONS_STATEMENT, prepare=True)
+            return ReferenceData(version, nurses.fetchall(), diagnostic_codes.fetchall(), medications.fetchall())
@@ -0,0 +1,38 @@
+"""Diff two bench/load_test.py reports route by route.
+
+Usage: python bench/compare_reports.py before.json after.json
+"""
+import argparse
+import json
+
+METRICS = ("rps", "p50_ms", "p95_ms", "p99_ms")
+
+
+def change(old, new):
+    if not old:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    print(f"{'route':<22}" + "".join(f"{metric:>24}" for metric in METRICS))
+    for route in sorted(set(before["routes"]) | set(after["routes"])):
+        old, new = before["routes"].get(route, {}), after["routes"].get(route, {})
+        cells = []
+        for metric in METRICS:
+            old_value, new_value = old.get(metric, 0.0), new.get(metric, 0.0)
+            cells.append(f"{old_value:8.1f} {new_value:8.1f} {change(old_value, new_value):>6}")
+        print(f"{route:<22}" + "".join(f"{cell:>24}" for cell in cells))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Measure how throughput of one server process scales with concurrent clients.
+
+Run it once against the WSGI server and once against the ASGI server, e.g.
+    python bench/concurrency_bench.py --base-url http://localhost:5000 --path /clients/123
+    python bench/concurrency_bench.py --base-url http://localhost:8000 --path /clients/123
+"""
+import argparse
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def hammer(url, concurrency, duration):
+    deadline = time.monotonic() + duration
+
+    def worker(_):
+        latencies, errors = [], 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+            except (urllib.error.URLError, OSError):
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, range(concurrency)))
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    errors = sum(worker_errors for _, worker_errors in results)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0
+    return len(latencies) / duration, p95, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/dashboard")
+    parser.add_argument("--levels", default="1,8,32,128", help="Comma separated concurrency levels.")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    url = args.base_url.rstrip("/") + args.path
+    print(f"{url}")
+    print(f"{'clients':>8}{'req/s':>10}{'p95 ms':>10}{'errors':>8}")
+    for level in (int(value) for value in args.levels.split(",")):
+        rps, p95, errors = hammer(url, level, args.duration)
+        print(f"{level:>8}{rps:>10.1f}{p95:>10.1f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
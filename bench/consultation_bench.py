@@ -0,0 +1,64 @@
+"""Compare sequential consultation lookups against the pipelined consultation bundle.
+
+Usage: python bench/consultation_bench.py [--url URL] [--samples N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg
+from psycopg.rows import dict_row
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+from queries import consultation_bundle  # noqa: E402
+
+SEQUENTIAL_QUERIES = (
+    "SELECT soap_s, soap_o, soap_a, soap_p FROM consultation"
+    " WHERE vat_doctor = %(vat_doctor)s AND date_timestamp = %(date_timestamp)s;",
+    "SELECT cd.id FROM consultation_diagnostic cd"
+    " WHERE cd.vat_doctor = %(vat_doctor)s AND cd.date_timestamp = %(date_timestamp)s;",
+    "SELECT p.name, p.lab, p.dosage, p.description FROM prescription p"
+    " WHERE p.vat_doctor = %(vat_doctor)s AND p.date_timestamp = %(date_timestamp)s;",
+    "SELECT vat_nurse FROM consultation_assistant ca"
+    " WHERE ca.vat_doctor = %(vat_doctor)s AND ca.date_timestamp = %(date_timestamp)s;",
+)
+
+
+def sequential(conn, vat_doctor, date_timestamp):
+    key = {"vat_doctor": vat_doctor, "date_timestamp": date_timestamp}
+    with conn.cursor(row_factory=dict_row) as cur:
+        return [cur.execute(query, key).fetchall() for query in SEQUENTIAL_QUERIES]
+
+
+def measure(label, loader, conn, keys, round_trips):
+    timings = []
+    for vat_doctor, date_timestamp in keys:
+        start = time.perf_counter()
+        loader(conn, vat_doctor, date_timestamp)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+    print(f"{label:<12} round trips {round_trips}  p50 {statistics.median(timings):7.3f} ms  p95 {p95:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default=os.environ.get("FLASK_DATABASE_URL", "postgres://db:db@postgres/db"))
+    parser.add_argument("--samples", type=int, default=1000)
+    args = parser.parse_args()
+
+    with psycopg.connect(conninfo=args.url) as conn:
+        keys = conn.execute(
+            "SELECT vat_doctor, date_timestamp FROM consultation ORDER BY random() LIMIT %s;",
+            (args.samples,),
+        ).fetchall()
+        if not keys:
+            sys.exit("No consultations to benchmark")
+        measure("sequential", sequential, conn, keys, len(SEQUENTIAL_QUERIES))
+        measure("pipelined", consultation_bundle, conn, keys, 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Load reproducible synthetic clinic data into PostgreSQL.
+
+The same --seed and --scale always produce the same rows. Scale 1 is a small
+clinic (1000 clients, 10 doctors, two years of appointments up to the end of 2024); volumes
+grow linearly with the scale.
+
+Usage: python bench/generate_data.py [--url URL] [--scale N] [--seed S] [--truncate]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import psycopg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+from partitioning import ensure_partitions  # noqa: E402
+
+FIRST_NAMES = ("Ana", "Joao", "Maria", "Pedro", "Ines", "Rui", "Sofia", "Tiago", "Marta", "Miguel",
+               "Beatriz", "Diogo", "Carolina", "Andre", "Rita", "Bruno", "Catarina", "Nuno")
+LAST_NAMES = ("Silva", "Santos", "Ferreira", "Pereira", "Oliveira", "Costa", "Rodrigues", "Martins",
+              "Jesus", "Sousa", "Fernandes", "Goncalves", "Gomes", "Lopes", "Marques", "Alves")
+CITIES = ("Lisboa", "Porto", "Coimbra", "Braga", "Faro", "Aveiro", "Setubal", "Evora", "Leiria", "Viseu")
+STREETS = ("Rua Augusta", "Avenida da Liberdade", "Rua do Carmo", "Rua de Santa Catarina",
+           "Avenida dos Aliados", "Rua Direita", "Largo do Rossio", "Rua Nova")
+LABS = ("Bayer", "Pfizer", "Novartis", "Sanofi", "Roche", "Bial", "Hovione")
+SOAP_WORDS = ("pain", "swelling", "caries", "molar", "gingivitis", "sensitivity", "filling", "x-ray",
+              "cleaning", "extraction", "follow-up", "antibiotic", "normal", "bleeding")
+
+# Rows per unit of --scale
+VOLUMES = {
+    "clients": 1000,
+    "doctors": 10,
+    "nurses": 5,
+    "diagnostic_codes": 50,
+    "medications": 200,
+    "appointments": 5000,
+}
+CONSULTATION_RATE = 0.8
+DIAGNOSTICS_PER_CONSULTATION = (0, 3)
+PRESCRIPTION_RATE = 0.5
+HISTORY_DAYS = 730
+# Fixed so the generated history does not depend on the day the generator runs
+HISTORY_END = date(2024, 12, 31)
+TRIGGERED_TABLES = ("consultation", "consultation_diagnostic", "appointment", "client")
+
+
+def person_name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def soap_note(rng):
+    return " ".join(rng.choice(SOAP_WORDS) for _ in range(rng.randint(3, 8)))
+
+
+def copy_rows(conn, table, columns, rows):
+    with conn.cursor().copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        count = 0
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    print(f"  {table:<26} {count:>10} rows")
+
+
+def generate(conn, scale, seed):
+    rng = random.Random(seed)
+    volumes = {name: max(1, int(count * scale)) for name, count in VOLUMES.items()}
+
+    client_vats = [f"C{index:09d}" for index in range(volumes["clients"])]
+    doctor_vats = [f"D{index:09d}" for index in range(volumes["doctors"])]
+    nurse_vats = [f"N{index:09d}" for index in range(volumes["nurses"])]
+    diagnostic_ids = [f"K{index:03d}.{rng.randint(0, 9)}" for index in range(volumes["diagnostic_codes"])]
+    medications = [(f"Medication {index}", rng.choice(LABS)) for index in range(volumes["medications"])]
+
+    copy_rows(conn, "client", ("vat", "name", "birth_date", "street", "city", "zip", "gender"), (
+        (vat, person_name(rng), date(1940, 1, 1) + timedelta(days=rng.randint(0, 30000)),
+         f"{rng.choice(STREETS)} {rng.randint(1, 300)}", rng.choice(CITIES),
+         f"{rng.randint(1000, 9999)}-{rng.randint(100, 999)}", rng.choice("MF"))
+        for vat in client_vats
+    ))
+    copy_rows(conn, "employee", ("vat", "name"), ((vat, person_name(rng)) for vat in doctor_vats + nurse_vats))
+    copy_rows(conn, "doctor", ("vat",), ((vat,) for vat in doctor_vats))
+    copy_rows(conn, "nurse", ("vat",), ((vat,) for vat in nurse_vats))
+    copy_rows(conn, "diagnostic_code", ("id",), ((code,) for code in diagnostic_ids))
+    copy_rows(conn, "medication", ("name", "lab"), medications)
+
+    # One appointment per (doctor, hour); slots are drawn without replacement
+    first_day = HISTORY_END - timedelta(days=HISTORY_DAYS)
+    slots_per_doctor = HISTORY_DAYS * 8
+    picks = rng.sample(range(len(doctor_vats) * slots_per_doctor),
+                       min(volumes["appointments"], len(doctor_vats) * slots_per_doctor))
+    appointments = []
+    for pick in sorted(picks):
+        doctor, slot = divmod(pick, slots_per_doctor)
+        day, hour = divmod(slot, 8)
+        timestamp = datetime.combine(first_day + timedelta(days=day), datetime.min.time()) + timedelta(hours=9 + hour)
+        appointments.append((doctor_vats[doctor], timestamp, rng.choice(client_vats), soap_note(rng)))
+    copy_rows(conn, "appointment", ("vat_doctor", "date_timestamp", "vat_client", "description"), appointments)
+
+    consultations = [(vat_doctor, timestamp) for vat_doctor, timestamp, _, _ in appointments
+                     if rng.random() < CONSULTATION_RATE]
+    copy_rows(conn, "consultation", ("vat_doctor", "date_timestamp", "soap_s", "soap_o", "soap_a", "soap_p"), (
+        (vat_doctor, timestamp, soap_note(rng), soap_note(rng), soap_note(rng), soap_note(rng))
+        for vat_doctor, timestamp in consultations
+    ))
+    copy_rows(conn, "consultation_assistant", ("vat_doctor", "date_timestamp", "vat_nurse"), (
+        (vat_doctor, timestamp, rng.choice(nurse_vats)) for vat_doctor, timestamp in consultations
+    ))
+
+    diagnostics = []
+    for vat_doctor, timestamp in consultations:
+        count = rng.randint(*DIAGNOSTICS_PER_CONSULTATION)
+        for code in rng.sample(diagnostic_ids, min(count, len(diagnostic_ids))):
+            diagnostics.append((vat_doctor, timestamp, code))
+    copy_rows(conn, "consultation_diagnostic", ("vat_doctor", "date_timestamp", "id"), diagnostics)
+
+    copy_rows(conn, "prescription", ("vat_doctor", "date_timestamp", "id", "name", "lab", "dosage", "description"), (
+        (vat_doctor, timestamp, code) + rng.choice(medications) + (f"{rng.choice((1, 2, 3))}x day", soap_note(rng))
+        for vat_doctor, timestamp, code in diagnostics if rng.random() < PRESCRIPTION_RATE
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("FLASK_DATABASE_URL", "postgres://db:db@postgres/db"))
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="Empty the clinic tables before loading.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    with psycopg.connect(conninfo=args.url) as conn:
+        if args.truncate:
+            conn.execute("""
+                TRUNCATE prescription, consultation_diagnostic, consultation_assistant, consultation,
+                appointment, medication, diagnostic_code, nurse, doctor, employee, client CASCADE;
+            """)
+        print(f"Generating scale {args.scale} with seed {args.seed}")
+        # No-op unless the history tables were converted with `flask partition-tables`
+        ensure_partitions(conn, HISTORY_END - timedelta(days=HISTORY_DAYS), HISTORY_END)
+        # The analytics triggers would refresh facts row by row; rebuild them once at the end instead
+        for table in TRIGGERED_TABLES:
+            conn.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER;")
+        generate(conn, args.scale, args.seed)
+        for table in TRIGGERED_TABLES:
+            conn.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER;")
+        conn.execute("SELECT refresh_analytics();")
+        conn.execute("ANALYZE;")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Replay a weighted mix of the app's routes and report latency percentiles per route.
+
+Start the app against a database loaded by bench/generate_data.py, then run e.g.
+    python bench/load_test.py --base-url http://localhost:5000 --duration 60 --output before.json
+and compare two reports with bench/compare_reports.py.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+import psycopg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+from partitioning import PARTITION_DEFAULTS, add_months, month_start  # noqa: E402
+
+# Route name -> weight in the request mix
+MIX = {
+    "clients_list": 15,
+    "client_filter": 10,
+    "client_autocomplete": 5,
+    "client_info": 20,
+    "consultation": 20,
+    "dashboard": 10,
+    "availability": 5,
+    "write_appointment": 5,
+    "write_soap": 10,
+}
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Measure the POST itself rather than the page it redirects to."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def appointment_days(months_ahead):
+    """Return the first day and number of days new appointments are booked in.
+
+    They stay within the months `flask create-partitions --months-ahead` covers,
+    since an appointment in a month without a partition is rejected.
+    """
+    first = date.today() + timedelta(days=1)
+    return first, (add_months(month_start(date.today()), months_ahead + 1) - first).days
+
+
+def load_samples(url, size):
+    """Pick the clients, consultations and search terms the driver will request."""
+    with psycopg.connect(conninfo=url) as conn:
+        clients = conn.execute(
+            "SELECT vat, name FROM client ORDER BY random() LIMIT %s;", (size,)
+        ).fetchall()
+        consultations = conn.execute("""
+            SELECT a.vat_client, c.vat_doctor, c.date_timestamp
+            FROM consultation c
+            JOIN appointment a ON c.vat_doctor = a.vat_doctor AND c.date_timestamp = a.date_timestamp
+            ORDER BY random() LIMIT %s;
+        """, (size,)).fetchall()
+        doctors = [row[0] for row in conn.execute("SELECT vat FROM doctor;").fetchall()]
+    if not clients or not consultations or not doctors:
+        raise SystemExit("The database has no clients, consultations or doctors; run bench/generate_data.py first")
+    return {"clients": clients, "consultations": consultations, "doctors": doctors}
+
+
+def build_request(route, samples, rng):
+    """Return (path, form data or None) for one request of the given route."""
+    vat, name = rng.choice(samples["clients"])
+    if route == "clients_list":
+        return "/clients", None
+    if route == "client_filter":
+        word = rng.choice(name.split())
+        return "/clients/filter?" + urllib.parse.urlencode({"name": word[: rng.randint(3, max(3, len(word)))]}), None
+    if route == "client_autocomplete":
+        return "/api/clients/autocomplete?" + urllib.parse.urlencode({"q": name[:4]}), None
+    if route == "client_info":
+        return f"/clients/{vat}", None
+    if route == "dashboard":
+        return "/dashboard", None
+    if route == "availability":
+        start = datetime(2025, 1, 6) + timedelta(weeks=rng.randint(0, 52))
+        return f"/api/availability?start={start:%Y-%m-%d}&days=7", None
+
+    vat_client, vat_doctor, date_timestamp = rng.choice(samples["consultations"])
+    consultation = f"/clients/{vat_client}/consultation/{vat_doctor}/{urllib.parse.quote(str(date_timestamp))}"
+    if route == "consultation":
+        return consultation, None
+    if route == "write_soap":
+        return consultation + "/soapS", {"soap_s": f"load test note {rng.random():.6f}"}
+    if route == "write_appointment":
+        # Spread over the partitioned months ahead so earlier runs rarely collide
+        first, days = samples["appointment_days"]
+        day = first + timedelta(days=rng.randrange(days))
+        return f"/client/{vat}/schedule", {
+            "doctor": rng.choice(samples["doctors"]),
+            "date": f"{day:%Y-%m-%d}",
+            "time": f"{rng.randint(9, 16):02d}:00",
+            "description": "load test",
+        }
+    raise ValueError(f"unknown route {route}")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(base_url, samples, duration, concurrency, seed):
+    opener = urllib.request.build_opener(NoRedirect)
+    routes, weights = list(MIX), list(MIX.values())
+    results = {route: {"latencies": [], "errors": 0} for route in routes}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        while time.monotonic() < deadline:
+            route = rng.choices(routes, weights)[0]
+            path, form = build_request(route, samples, rng)
+            data = urllib.parse.urlencode(form).encode() if form is not None else None
+            start = time.perf_counter()
+            try:
+                with opener.open(base_url + path, data=data, timeout=30) as response:
+                    response.read()
+                ok = True
+            except urllib.error.HTTPError as error:
+                ok = 300 <= error.code < 400
+            except OSError:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                results[route]["latencies"].append(elapsed)
+                if not ok:
+                    results[route]["errors"] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+
+    report = {}
+    for route, result in results.items():
+        latencies = sorted(result["latencies"])
+        report[route] = {
+            "requests": len(latencies),
+            "errors": result["errors"],
+            "rps": len(latencies) / duration,
+            "mean_ms": statistics.fmean(latencies) if latencies else 0.0,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+        }
+    return report
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--url", default=os.environ.get("FLASK_DATABASE_URL", "postgres://db:db@postgres/db"),
+                        help="Database used to pick sample clients and consultations.")
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--months-ahead", type=int, default=PARTITION_DEFAULTS["PARTITION_MONTHS_AHEAD"],
+                        help="Months ahead with partitions, as given to flask create-partitions.")
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    args = parser.parse_args()
+
+    samples = load_samples(args.url, args.samples)
+    samples["appointment_days"] = appointment_days(args.months_ahead)
+    routes = run(args.base_url.rstrip("/"), samples, args.duration, args.concurrency, args.seed)
+    report = {
+        "commit": git_commit(),
+        "duration": args.duration,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+        "routes": routes,
+    }
+
+    total = sum(route["requests"] for route in routes.values())
+    print(f"{'route':<22}{'req':>8}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, route in routes.items():
+        print(f"{name:<22}{route['requests']:>8}{route['errors']:>6}{route['rps']:>9.1f}"
+              f"{route['p50_ms']:>10.2f}{route['p95_ms']:>10.2f}{route['p99_ms']:>10.2f}")
+    print(f"{'total':<22}{total:>8}{'':>6}{total / args.duration:>9.1f}")
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Measure page weight and response time per content coding, and static asset caching.
+
+For every page, reports the transferred bytes without compression, with gzip and
+with brotli (when the server offers it), the time of the first request and the
+median/p95 of the following ones. Start the server fresh (or write to the data a
+page shows) to make the first request render its template fragments; the
+following ones are served from the fragment cache.
+
+Usage: python bench/page_weight_bench.py [--base-url URL] [--path PATH ...] [--samples N]
+"""
+import argparse
+import re
+import statistics
+import time
+import urllib.request
+
+DEFAULT_PATHS = ("/clients", "/dashboard")
+ENCODINGS = ("identity", "gzip", "br")
+
+
+def fetch(url, encoding):
+    request = urllib.request.Request(url, headers={"Accept-Encoding": encoding})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=30) as response:
+        body = response.read()
+        headers = response.headers
+    return (time.perf_counter() - start) * 1000, len(body), headers
+
+
+def weigh(url, samples):
+    first, _, _ = fetch(url, "gzip")
+    sizes, codings = {}, {}
+    for encoding in ENCODINGS:
+        _, size, headers = fetch(url, encoding)
+        sizes[encoding] = size
+        codings[encoding] = headers.get("Content-Encoding", "identity")
+    warm = sorted(fetch(url, "gzip")[0] for _ in range(samples))
+    return sizes, codings, first, statistics.median(warm), warm[max(int(len(warm) * 0.95) - 1, 0)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:5000")
+    parser.add_argument("--path", action="append", help="Page to measure, repeatable.")
+    parser.add_argument("--samples", type=int, default=50, help="Requests per page after the first, at least 1.")
+    args = parser.parse_args()
+    base_url = args.base_url.rstrip("/")
+
+    print(f"{'page':<20}{'identity':>10}{'gzip':>10}{'br':>10}{'first ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    stylesheet = None
+    for path in args.path or DEFAULT_PATHS:
+        sizes, codings, first, p50, p95 = weigh(base_url + path, args.samples)
+        columns = "".join(
+            f"{sizes[encoding] if codings[encoding] == encoding else '-':>10}" for encoding in ENCODINGS
+        )
+        print(f"{path:<20}{columns}{first:>10.1f}{p50:>10.1f}{p95:>10.1f}")
+        if stylesheet is None:
+            with urllib.request.urlopen(base_url + path, timeout=30) as response:
+                match = re.search(r'href="([^"]*styles\.css[^"]*)"', response.read().decode("utf-8", "replace"))
+            stylesheet = match.group(1) if match else None
+
+    if stylesheet:
+        _, size, headers = fetch(base_url + stylesheet, "gzip")
+        print(f"\n{stylesheet}: {size} bytes ({headers.get('Content-Encoding', 'identity')}), "
+              f"Cache-Control: {headers.get('Cache-Control')}")
+
+
+if __name__ == "__main__":
+    main()
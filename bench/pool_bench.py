@@ -0,0 +1,49 @@
+"""Compare a connection per request against the shared connection pool.
+
+Usage: python bench/pool_bench.py [--url URL] [--requests N] [--concurrency C]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+from psycopg_pool import ConnectionPool
+
+# Same statement as the /clients page, limited so the benchmark measures connection overhead
+QUERY = "SELECT vat, name, birth_date, street, city, zip, gender FROM client ORDER BY name ASC LIMIT 50;"
+
+
+def run(label, handler, requests, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: handler(), range(requests)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {requests / elapsed:10.1f} req/s  ({elapsed:.2f}s for {requests} requests)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default=os.environ.get("FLASK_DATABASE_URL", "postgres://db:db@postgres/db"))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    def connect_per_request():
+        with psycopg.connect(conninfo=args.url) as conn:
+            conn.execute(QUERY).fetchall()
+
+    with ConnectionPool(conninfo=args.url, min_size=args.concurrency, max_size=args.concurrency, open=True) as pool:
+        pool.wait()
+
+        def pooled():
+            with pool.connection() as conn:
+                conn.execute(QUERY).fetchall()
+
+        run("connect per request", connect_per_request, args.requests, args.concurrency)
+        run("connection pool", pooled, args.requests, args.concurrency)
+        print(pool.get_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Measure the parse/plan time saved per route by server-side prepared statements.
+
+Runs the registered statements of each route from app/queries.py on one
+connection, three ways: unprepared (parsed and planned on every execution),
+prepared (prepare=True, as the pooled connections do) and prepared with binary
+results for the large client list and dashboard result sets, as the app sends
+them. The plan column is the planning time PostgreSQL reports for the route's
+statements, i.e. the work preparing skips on every execution after the first
+few (until the server settles on a generic plan).
+
+Usage: python bench/prepared_bench.py [--url URL] [--samples N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+from availability import AVAILABILITY_DEFAULTS, create_availability  # noqa: E402
+from queries import STATEMENTS  # noqa: E402
+
+ROUTES = {
+    "/clients": ("client.page",),
+    "/clients/<vat>": ("client.summary", "client.timeline"),
+    "/clients/<vat>/consultation/...": (
+        "consultation.soap_notes", "consultation.diagnostics",
+        "consultation.prescriptions", "consultation.assisting_nurse",
+    ),
+    "/dashboard": ("dashboard.consultation_per_grouped_time", "dashboard.diagnostic_per_age_and_sex"),
+    "/api/clients/autocomplete": ("client.autocomplete",),
+    "/client/<vat>/schedule": ("availability.doctors", "availability.free_slots"),
+}
+
+# Statements the app reads in binary
+BINARY = {"client.page", "dashboard.consultation_per_grouped_time", "dashboard.diagnostic_per_age_and_sex"}
+
+MODES = ("unprepared", "prepared", "prepared+binary")
+
+
+def sample_params(conn, samples):
+    rows = conn.execute("""
+        SELECT a.vat_client, c.vat_doctor, c.date_timestamp, left(cl.name, 3)
+        FROM consultation c
+        JOIN appointment a ON a.vat_doctor = c.vat_doctor AND a.date_timestamp = c.date_timestamp
+        JOIN client cl ON cl.vat = a.vat_client
+        ORDER BY random()
+        LIMIT %s;
+    """, (samples,)).fetchall()
+    availability = create_availability(AVAILABILITY_DEFAULTS)
+    return [{
+        "vat": vat, "vat_doctor": vat_doctor, "date_timestamp": date_timestamp,
+        "q": prefix, "pattern": f"%{prefix}%", "limit": 10, "page_size": 50,
+        "first": date_timestamp.date(), "last": date_timestamp.date(),
+        "slots_per_day": availability.slots_per_day, "day_start": availability.day_start, "slot": availability.slot,
+    } for vat, vat_doctor, date_timestamp, prefix in rows]
+
+
+def planning_ms(conn, names, params):
+    total = 0.0
+    for name in names:
+        plan = conn.execute(f"EXPLAIN (SUMMARY, FORMAT JSON) {STATEMENTS[name]}", params).fetchone()[0]
+        total += plan[0]["Planning Time"]
+    return total
+
+
+def run_route(conn, names, samples, mode):
+    conn.prepare_threshold = None if mode == "unprepared" else 5
+    timings = []
+    for params in samples:
+        start = time.perf_counter()
+        for name in names:
+            binary = mode == "prepared+binary" and name in BINARY
+            with conn.cursor(binary=binary) as cur:
+                cur.execute(STATEMENTS[name], params, prepare=mode != "unprepared").fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("FLASK_DATABASE_URL", "postgres://db:db@postgres/db"))
+    parser.add_argument("--samples", type=int, default=500)
+    args = parser.parse_args()
+
+    with psycopg.connect(conninfo=args.url, autocommit=True) as conn:
+        samples = sample_params(conn, args.samples)
+        if not samples:
+            sys.exit("No consultations to benchmark")
+        print(f"{'route':<34}{'plan ms':>9}" + "".join(f"{mode:>17}" for mode in MODES) + f"{'saved':>9}")
+        for route, names in ROUTES.items():
+            plan = planning_ms(conn, names, samples[0])
+            # Warm the caches so every mode reads the same hot pages
+            run_route(conn, names, samples[:10], "unprepared")
+            medians = {mode: run_route(conn, names, samples, mode) for mode in MODES}
+            saved = medians["unprepared"] - medians["prepared+binary"]
+            print(f"{route:<34}{plan:>9.3f}" + "".join(f"{medians[mode]:>14.3f} ms" for mode in MODES)
+                  + f"{saved:>6.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+-- row version of a consultation, bumped by every edit made through the app --
+ALTER TABLE consultation ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0;
@@ -14,3 +14,23 @@ ON consultation_diagnostic(vat_doctor, date_timestamp);
 -- JOIN between consultation and procedure in consultation INDEX --
 CREATE INDEX idx_procedure_in_consultation_vat_doctor_date_timestamp
 ON procedure_in_consultation(vat_doctor, date_timestamp);
+-- Client timeline covering INDEXES (index-only scan of a client's appointments, newest first) --
+CREATE INDEX idx_appointment_client_timeline
+ON appointment(vat_client, date_timestamp, vat_doctor) INCLUDE (description);
+CREATE INDEX idx_prescription_timeline
+ON prescription(vat_doctor, date_timestamp) INCLUDE (id, name, lab, dosage, description);
+-- Keyset pagination of the client list INDEX --
+CREATE INDEX idx_client_name_vat
+ON client(name, vat);
+-- Substring client search (ILIKE '%x%') with trigram GIN INDEXES --
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX idx_client_vat_trgm
+ON client USING GIN ((CAST(vat AS TEXT)) gin_trgm_ops);
+CREATE INDEX idx_client_name_trgm
+ON client USING GIN (name gin_trgm_ops);
+CREATE INDEX idx_client_street_trgm
+ON client USING GIN (street gin_trgm_ops);
+CREATE INDEX idx_client_city_trgm
+ON client USING GIN (city gin_trgm_ops);
+CREATE INDEX idx_client_zip_trgm
+ON client USING GIN (zip gin_trgm_ops);
@@ -0,0 +1,28 @@
+-- version of the nurse, diagnostic_code and medication catalogs cached by the app --
+CREATE TABLE IF NOT EXISTS reference_version(
+version BIGINT NOT NULL
+);
+INSERT INTO reference_version(version)
+SELECT 0
+WHERE NOT EXISTS (SELECT 1 FROM reference_version);
+-- bump the version and notify listeners on any catalog change --
+CREATE OR REPLACE FUNCTION bump_reference_version()
+RETURNS trigger AS $$
+BEGIN
+    UPDATE reference_version SET version = version + 1;
+    PERFORM pg_notify('reference_data', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_nurse_reference_version ON nurse;
+CREATE TRIGGER trg_nurse_reference_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON nurse
+FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+DROP TRIGGER IF EXISTS trg_diagnostic_code_reference_version ON diagnostic_code;
+CREATE TRIGGER trg_diagnostic_code_reference_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON diagnostic_code
+FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
+DROP TRIGGER IF EXISTS trg_medication_reference_version ON medication;
+CREATE TRIGGER trg_medication_reference_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON medication
+FOR EACH STATEMENT EXECUTE FUNCTION bump_reference_version();
@@ -1,16 +1,49 @@
-DROP VIEW IF EXISTS dim_date;
-DROP VIEW IF EXISTS dim_client;
-DROP VIEW IF EXISTS dim_location;
-DROP VIEW IF EXISTS facts_consultations;
--- view for dim_date --
-CREATE VIEW dim_date(date, day, month, year)
-AS (
-SELECT DISTINCT(date_timestamp) AS date, EXTRACT(DAY FROM
-date_timestamp) AS day, EXTRACT(MONTH FROM date_timestamp) AS
-month, EXTRACT(YEAR FROM date_timestamp) AS year
-FROM consultation
-);
--- view for dim_client --
+-- drop the previous analytics objects, whether they were views or tables --
+DO $$
+DECLARE
+    r record;
+BEGIN
+    FOR r IN
+        SELECT c.relname, c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema()
+        AND c.relname IN ('dim_date', 'dim_client', 'dim_location', 'facts_consultations',
+                          'facts_consultations_daily', 'facts_diagnostics_client', 'client_summary')
+    LOOP
+        IF r.relkind = 'v' THEN
+            EXECUTE format('DROP VIEW %I CASCADE', r.relname);
+        ELSIF r.relkind = 'm' THEN
+            EXECUTE format('DROP MATERIALIZED VIEW %I CASCADE', r.relname);
+        ELSE
+            EXECUTE format('DROP TABLE %I CASCADE', r.relname);
+        END IF;
+    END LOOP;
+END $$;
+-- totals of archived months (app/partitioning.py), kept when the analytics tables are rebuilt --
+DO $$
+BEGIN
+    IF to_regclass('facts_consultations_archived') IS NULL THEN
+        CREATE TABLE facts_consultations_archived(year, month, day, total_consultation)
+        AS (
+        SELECT EXTRACT(YEAR FROM date_timestamp), EXTRACT(MONTH FROM date_timestamp),
+        EXTRACT(DAY FROM date_timestamp), COUNT(*)
+        FROM consultation
+        GROUP BY 1, 2, 3
+        ) WITH NO DATA;
+        ALTER TABLE facts_consultations_archived ADD PRIMARY KEY (year, month, day);
+    END IF;
+    IF to_regclass('facts_diagnostics_client_archived') IS NULL THEN
+        CREATE TABLE facts_diagnostics_client_archived(vat, total_diagnostic_codes)
+        AS (
+        SELECT vat, SUM(0::BIGINT)
+        FROM client
+        GROUP BY vat
+        ) WITH NO DATA;
+        ALTER TABLE facts_diagnostics_client_archived ADD PRIMARY KEY (vat);
+    END IF;
+END $$;
+-- view for dim_client (age depends on the current date, so it is not materialized) --
 CREATE VIEW dim_client(vat, gender, age)
 AS (
 SELECT vat, gender, EXTRACT(YEAR FROM AGE(NOW(), birth_date)) AS age
@@ -22,12 +55,20 @@ AS (
 SELECT zip, city
 FROM client
 );
--- view for facts_consultations --
-CREATE VIEW facts_consultations(vat, date, zip, num_diagnostic_codes,
+-- table for dim_date, one row per consultation timestamp --
+CREATE TABLE dim_date(date, day, month, year)
+AS (
+SELECT date_timestamp, EXTRACT(DAY FROM date_timestamp), EXTRACT(MONTH FROM
+date_timestamp), EXTRACT(YEAR FROM date_timestamp)
+FROM consultation
+) WITH NO DATA;
+ALTER TABLE dim_date ADD PRIMARY KEY (date);
+-- table for facts_consultations, one row per consultation --
+CREATE TABLE facts_consultations(vat_doctor, date, vat, zip, num_diagnostic_codes,
 num_procedures)
 AS (
-SELECT a.vat_client, c.date_timestamp, cl.zip, COUNT(cd.id) AS
-num_diagnostic_codes, COUNT(pic.name) as num_procedures
+SELECT c.vat_doctor, c.date_timestamp, a.vat_client, cl.zip, COUNT(cd.id),
+COUNT(pic.name)
 FROM consultation c
 JOIN appointment a
 ON c.vat_doctor = a.vat_doctor
@@ -40,6 +81,435 @@ AND c.date_timestamp = cd.date_timestamp
 LEFT OUTER JOIN procedure_in_consultation pic
 ON cd.vat_doctor = pic.vat_doctor
 AND cd.date_timestamp = pic.date_timestamp
-GROUP BY (a.vat_client, c.date_timestamp, cl.zip)
-ORDER BY a.vat_client, c.date_timestamp
-);
+GROUP BY c.vat_doctor, c.date_timestamp, a.vat_client, cl.zip
+) WITH NO DATA;
+ALTER TABLE facts_consultations ADD PRIMARY KEY (vat_doctor, date);
+CREATE INDEX idx_facts_consultations_date
+ON facts_consultations(date);
+CREATE INDEX idx_facts_consultations_vat
+ON facts_consultations(vat);
+-- pre-aggregated consultations per day, read by the dashboard ROLLUP --
+CREATE TABLE facts_consultations_daily(year, month, day, total_consultation)
+AS (
+SELECT year, month, day, COUNT(*)
+FROM dim_date
+GROUP BY year, month, day
+) WITH NO DATA;
+ALTER TABLE facts_consultations_daily ADD PRIMARY KEY (year, month, day);
+-- pre-aggregated diagnostic codes per client, read by the dashboard CUBE --
+CREATE TABLE facts_diagnostics_client(vat, total_diagnostic_codes)
+AS (
+SELECT vat, SUM(num_diagnostic_codes)
+FROM facts_consultations
+GROUP BY vat
+) WITH NO DATA;
+ALTER TABLE facts_diagnostics_client ADD PRIMARY KEY (vat);
+-- one summary row per client with appointments, read by the client page header --
+CREATE TABLE client_summary(vat, total_appointments, total_consultations, open_appointments,
+first_visit, last_visit)
+AS (
+SELECT a.vat_client, COUNT(*), COUNT(c.vat_doctor), COUNT(*) - COUNT(c.vat_doctor),
+MIN(c.date_timestamp), MAX(c.date_timestamp)
+FROM appointment a
+LEFT OUTER JOIN consultation c
+ON a.vat_doctor = c.vat_doctor
+AND a.date_timestamp = c.date_timestamp
+GROUP BY a.vat_client
+) WITH NO DATA;
+ALTER TABLE client_summary ADD PRIMARY KEY (vat);
+-- aggregate rows are upserted before they are recomputed: the upsert waits for concurrent writers --
+-- of the same key and locks the row, so the recomputation sees their rows and never conflicts --
+-- recompute the aggregates of one day --
+CREATE OR REPLACE FUNCTION refresh_consultations_daily(p_day DATE)
+RETURNS void AS $$
+DECLARE
+    v_year NUMERIC := EXTRACT(YEAR FROM p_day);
+    v_month NUMERIC := EXTRACT(MONTH FROM p_day);
+    v_day NUMERIC := EXTRACT(DAY FROM p_day);
+    v_total NUMERIC;
+BEGIN
+    INSERT INTO facts_consultations_daily AS fcd(year, month, day, total_consultation)
+    VALUES (v_year, v_month, v_day, 0)
+    ON CONFLICT (year, month, day) DO UPDATE SET total_consultation = fcd.total_consultation;
+
+    SELECT SUM(total) INTO v_total
+    FROM (
+        SELECT COUNT(*) AS total
+        FROM facts_consultations
+        WHERE date >= p_day AND date < p_day + 1
+        UNION ALL
+        SELECT total_consultation
+        FROM facts_consultations_archived
+        WHERE (year, month, day) = (v_year, v_month, v_day)
+    ) totals;
+
+    IF v_total > 0 THEN
+        UPDATE facts_consultations_daily SET total_consultation = v_total
+        WHERE (year, month, day) = (v_year, v_month, v_day);
+    ELSE
+        DELETE FROM facts_consultations_daily WHERE (year, month, day) = (v_year, v_month, v_day);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+-- recompute the aggregates of one client --
+CREATE OR REPLACE FUNCTION refresh_diagnostics_client(p_vat client.vat%TYPE)
+RETURNS void AS $$
+DECLARE
+    v_rows BIGINT;
+    v_total NUMERIC;
+BEGIN
+    INSERT INTO facts_diagnostics_client AS fdc(vat, total_diagnostic_codes)
+    VALUES (p_vat, 0)
+    ON CONFLICT (vat) DO UPDATE SET total_diagnostic_codes = fdc.total_diagnostic_codes;
+
+    SELECT COUNT(*), SUM(total) INTO v_rows, v_total
+    FROM (
+        SELECT num_diagnostic_codes AS total
+        FROM facts_consultations
+        WHERE vat = p_vat
+        UNION ALL
+        SELECT total_diagnostic_codes
+        FROM facts_diagnostics_client_archived
+        WHERE vat = p_vat
+    ) totals;
+
+    IF v_rows > 0 THEN
+        UPDATE facts_diagnostics_client SET total_diagnostic_codes = v_total WHERE vat = p_vat;
+    ELSE
+        DELETE FROM facts_diagnostics_client WHERE vat = p_vat;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+-- recompute the summary of one client --
+CREATE OR REPLACE FUNCTION refresh_client_summary(p_vat client.vat%TYPE)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO client_summary AS cs(vat, total_appointments, total_consultations, open_appointments)
+    VALUES (p_vat, 0, 0, 0)
+    ON CONFLICT (vat) DO UPDATE SET total_appointments = cs.total_appointments;
+
+    UPDATE client_summary cs
+    SET total_appointments = s.total_appointments, total_consultations = s.total_consultations,
+    open_appointments = s.open_appointments, first_visit = s.first_visit, last_visit = s.last_visit
+    FROM (
+        SELECT COUNT(*) AS total_appointments, COUNT(c.vat_doctor) AS total_consultations,
+        COUNT(*) - COUNT(c.vat_doctor) AS open_appointments,
+        MIN(c.date_timestamp) AS first_visit, MAX(c.date_timestamp) AS last_visit
+        FROM appointment a
+        LEFT OUTER JOIN consultation c
+        ON a.vat_doctor = c.vat_doctor
+        AND a.date_timestamp = c.date_timestamp
+        WHERE a.vat_client = p_vat
+        GROUP BY a.vat_client
+    ) s
+    WHERE cs.vat = p_vat;
+
+    -- no appointments left: the aggregate has no group
+    IF NOT FOUND THEN
+        DELETE FROM client_summary WHERE vat = p_vat;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+-- recompute the facts of one consultation and the aggregates it belongs to --
+CREATE OR REPLACE FUNCTION refresh_consultation_facts(p_vat_doctor consultation.vat_doctor%TYPE,
+                                                      p_date_timestamp consultation.date_timestamp%TYPE)
+RETURNS void AS $$
+DECLARE
+    old_vat client.vat%TYPE;
+    new_vat client.vat%TYPE;
+BEGIN
+    -- Serialize refreshes of the same consultation; the statements below then see each other's rows
+    PERFORM pg_advisory_xact_lock(hashtextextended(p_vat_doctor::text || '|' || p_date_timestamp::text, 0));
+
+    DELETE FROM facts_consultations
+    WHERE vat_doctor = p_vat_doctor AND date = p_date_timestamp
+    RETURNING vat INTO old_vat;
+
+    INSERT INTO facts_consultations(vat_doctor, date, vat, zip, num_diagnostic_codes, num_procedures)
+    SELECT c.vat_doctor, c.date_timestamp, a.vat_client, cl.zip, COUNT(cd.id), COUNT(pic.name)
+    FROM consultation c
+    JOIN appointment a
+    ON c.vat_doctor = a.vat_doctor
+    AND c.date_timestamp = a.date_timestamp
+    JOIN client cl
+    ON a.vat_client = cl.vat
+    LEFT OUTER JOIN consultation_diagnostic cd
+    ON c.vat_doctor = cd.vat_doctor
+    AND c.date_timestamp = cd.date_timestamp
+    LEFT OUTER JOIN procedure_in_consultation pic
+    ON cd.vat_doctor = pic.vat_doctor
+    AND cd.date_timestamp = pic.date_timestamp
+    WHERE c.vat_doctor = p_vat_doctor AND c.date_timestamp = p_date_timestamp
+    GROUP BY c.vat_doctor, c.date_timestamp, a.vat_client, cl.zip
+    RETURNING vat INTO new_vat;
+
+    IF EXISTS (SELECT 1 FROM consultation WHERE date_timestamp = p_date_timestamp) THEN
+        INSERT INTO dim_date(date, day, month, year)
+        VALUES (p_date_timestamp, EXTRACT(DAY FROM p_date_timestamp),
+                EXTRACT(MONTH FROM p_date_timestamp), EXTRACT(YEAR FROM p_date_timestamp))
+        ON CONFLICT (date) DO NOTHING;
+    ELSE
+        DELETE FROM dim_date WHERE date = p_date_timestamp;
+    END IF;
+
+    PERFORM refresh_consultations_daily(p_date_timestamp::date);
+    IF old_vat IS NOT NULL THEN
+        PERFORM refresh_diagnostics_client(old_vat);
+    END IF;
+    IF new_vat IS NOT NULL AND new_vat IS DISTINCT FROM old_vat THEN
+        PERFORM refresh_diagnostics_client(new_vat);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+-- rebuild every analytics table from scratch --
+CREATE OR REPLACE FUNCTION refresh_analytics()
+RETURNS void AS $$
+BEGIN
+    TRUNCATE dim_date, facts_consultations, facts_consultations_daily, facts_diagnostics_client, client_summary;
+
+    INSERT INTO facts_consultations(vat_doctor, date, vat, zip, num_diagnostic_codes, num_procedures)
+    SELECT c.vat_doctor, c.date_timestamp, a.vat_client, cl.zip, COUNT(cd.id), COUNT(pic.name)
+    FROM consultation c
+    JOIN appointment a
+    ON c.vat_doctor = a.vat_doctor
+    AND c.date_timestamp = a.date_timestamp
+    JOIN client cl
+    ON a.vat_client = cl.vat
+    LEFT OUTER JOIN consultation_diagnostic cd
+    ON c.vat_doctor = cd.vat_doctor
+    AND c.date_timestamp = cd.date_timestamp
+    LEFT OUTER JOIN procedure_in_consultation pic
+    ON cd.vat_doctor = pic.vat_doctor
+    AND cd.date_timestamp = pic.date_timestamp
+    GROUP BY c.vat_doctor, c.date_timestamp, a.vat_client, cl.zip;
+
+    INSERT INTO dim_date(date, day, month, year)
+    SELECT DISTINCT date_timestamp, EXTRACT(DAY FROM date_timestamp),
+    EXTRACT(MONTH FROM date_timestamp), EXTRACT(YEAR FROM date_timestamp)
+    FROM consultation;
+
+    INSERT INTO facts_consultations_daily(year, month, day, total_consultation)
+    SELECT year, month, day, SUM(total)
+    FROM (
+        SELECT dd.year, dd.month, dd.day, COUNT(*) AS total
+        FROM facts_consultations fc
+        JOIN dim_date dd ON fc.date = dd.date
+        GROUP BY dd.year, dd.month, dd.day
+        UNION ALL
+        SELECT year, month, day, total_consultation
+        FROM facts_consultations_archived
+    ) totals
+    GROUP BY year, month, day;
+
+    INSERT INTO facts_diagnostics_client(vat, total_diagnostic_codes)
+    SELECT vat, SUM(total)
+    FROM (
+        SELECT vat, num_diagnostic_codes AS total
+        FROM facts_consultations
+        UNION ALL
+        SELECT vat, total_diagnostic_codes
+        FROM facts_diagnostics_client_archived
+    ) totals
+    GROUP BY vat;
+
+    INSERT INTO client_summary(vat, total_appointments, total_consultations, open_appointments,
+                               first_visit, last_visit)
+    SELECT a.vat_client, COUNT(*), COUNT(c.vat_doctor), COUNT(*) - COUNT(c.vat_doctor),
+    MIN(c.date_timestamp), MAX(c.date_timestamp)
+    FROM appointment a
+    LEFT OUTER JOIN consultation c
+    ON a.vat_doctor = c.vat_doctor
+    AND a.date_timestamp = c.date_timestamp
+    GROUP BY a.vat_client;
+END;
+$$ LANGUAGE plpgsql;
+-- move the totals of an archived date range from the facts into the archived tables --
+CREATE OR REPLACE FUNCTION archive_analytics(p_start DATE, p_end DATE)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO facts_consultations_archived AS fca(year, month, day, total_consultation)
+    SELECT EXTRACT(YEAR FROM date), EXTRACT(MONTH FROM date), EXTRACT(DAY FROM date), COUNT(*)
+    FROM facts_consultations
+    WHERE date >= p_start AND date < p_end
+    GROUP BY 1, 2, 3
+    ON CONFLICT (year, month, day) DO UPDATE
+    SET total_consultation = fca.total_consultation + EXCLUDED.total_consultation;
+
+    INSERT INTO facts_diagnostics_client_archived AS fdca(vat, total_diagnostic_codes)
+    SELECT vat, SUM(num_diagnostic_codes)
+    FROM facts_consultations
+    WHERE date >= p_start AND date < p_end
+    GROUP BY vat
+    ON CONFLICT (vat) DO UPDATE
+    SET total_diagnostic_codes = fdca.total_diagnostic_codes + EXCLUDED.total_diagnostic_codes;
+
+    -- the daily and per-client aggregates already include these totals and stay as they are
+    DELETE FROM facts_consultations WHERE date >= p_start AND date < p_end;
+    DELETE FROM dim_date WHERE date >= p_start AND date < p_end;
+END;
+$$ LANGUAGE plpgsql;
+-- keep the analytics tables in step with every consultation write --
+-- bulk loads SET LOCAL clinic.skip_analytics = on and refresh the analytics once at the end, --
+-- so the triggers below do not recompute aggregates row by row --
+CREATE OR REPLACE FUNCTION refresh_consultation_facts_trigger()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_consultation_facts(OLD.vat_doctor, OLD.date_timestamp);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND (TG_OP = 'INSERT'
+        OR (NEW.vat_doctor, NEW.date_timestamp) IS DISTINCT FROM (OLD.vat_doctor, OLD.date_timestamp)) THEN
+        PERFORM refresh_consultation_facts(NEW.vat_doctor, NEW.date_timestamp);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_consultation_facts ON consultation;
+CREATE TRIGGER trg_consultation_facts
+AFTER INSERT OR UPDATE OF vat_doctor, date_timestamp OR DELETE ON consultation
+FOR EACH ROW
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_consultation_facts_trigger();
+DROP TRIGGER IF EXISTS trg_consultation_diagnostic_facts ON consultation_diagnostic;
+CREATE TRIGGER trg_consultation_diagnostic_facts
+AFTER INSERT OR UPDATE OR DELETE ON consultation_diagnostic
+FOR EACH ROW
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_consultation_facts_trigger();
+DROP TRIGGER IF EXISTS trg_procedure_in_consultation_facts ON procedure_in_consultation;
+CREATE TRIGGER trg_procedure_in_consultation_facts
+AFTER INSERT OR UPDATE OR DELETE ON procedure_in_consultation
+FOR EACH ROW
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_consultation_facts_trigger();
+DROP TRIGGER IF EXISTS trg_appointment_facts ON appointment;
+CREATE TRIGGER trg_appointment_facts
+AFTER UPDATE OF vat_client ON appointment
+FOR EACH ROW
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_consultation_facts_trigger();
+-- keep the client summaries in step with appointment and consultation writes: statement-level --
+-- triggers refresh each client the statement touched once, whatever the number of rows --
+CREATE OR REPLACE FUNCTION refresh_client_summary_trigger()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'appointment' THEN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM refresh_client_summary(vat_client)
+            FROM (SELECT DISTINCT vat_client FROM new_rows ORDER BY vat_client) touched;
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM refresh_client_summary(vat_client)
+            FROM (SELECT DISTINCT vat_client FROM old_rows ORDER BY vat_client) touched;
+        ELSE
+            -- only rows whose client or key changed, not description edits
+            PERFORM refresh_client_summary(vat_client)
+            FROM (
+                SELECT DISTINCT vat_client
+                FROM (
+                    (SELECT vat_client, vat_doctor, date_timestamp FROM new_rows
+                     EXCEPT SELECT vat_client, vat_doctor, date_timestamp FROM old_rows)
+                    UNION ALL
+                    (SELECT vat_client, vat_doctor, date_timestamp FROM old_rows
+                     EXCEPT SELECT vat_client, vat_doctor, date_timestamp FROM new_rows)
+                ) changed
+                ORDER BY vat_client
+            ) touched;
+        END IF;
+    ELSE
+        IF TG_OP = 'INSERT' THEN
+            PERFORM refresh_client_summary(vat_client)
+            FROM (
+                SELECT DISTINCT a.vat_client
+                FROM new_rows n
+                JOIN appointment a ON a.vat_doctor = n.vat_doctor AND a.date_timestamp = n.date_timestamp
+                ORDER BY a.vat_client
+            ) touched;
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM refresh_client_summary(vat_client)
+            FROM (
+                SELECT DISTINCT a.vat_client
+                FROM old_rows o
+                JOIN appointment a ON a.vat_doctor = o.vat_doctor AND a.date_timestamp = o.date_timestamp
+                ORDER BY a.vat_client
+            ) touched;
+        ELSE
+            -- only consultations moved to another appointment, not note edits
+            PERFORM refresh_client_summary(vat_client)
+            FROM (
+                SELECT DISTINCT a.vat_client
+                FROM (
+                    (SELECT vat_doctor, date_timestamp FROM new_rows
+                     EXCEPT SELECT vat_doctor, date_timestamp FROM old_rows)
+                    UNION ALL
+                    (SELECT vat_doctor, date_timestamp FROM old_rows
+                     EXCEPT SELECT vat_doctor, date_timestamp FROM new_rows)
+                ) changed
+                JOIN appointment a ON a.vat_doctor = changed.vat_doctor AND a.date_timestamp = changed.date_timestamp
+                ORDER BY a.vat_client
+            ) touched;
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+-- transition tables need one trigger per event --
+DROP TRIGGER IF EXISTS trg_appointment_client_summary ON appointment;
+DROP TRIGGER IF EXISTS trg_consultation_client_summary ON consultation;
+DROP TRIGGER IF EXISTS trg_appointment_client_summary_insert ON appointment;
+CREATE TRIGGER trg_appointment_client_summary_insert
+AFTER INSERT ON appointment
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_client_summary_trigger();
+DROP TRIGGER IF EXISTS trg_appointment_client_summary_update ON appointment;
+CREATE TRIGGER trg_appointment_client_summary_update
+AFTER UPDATE ON appointment
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_client_summary_trigger();
+DROP TRIGGER IF EXISTS trg_appointment_client_summary_delete ON appointment;
+CREATE TRIGGER trg_appointment_client_summary_delete
+AFTER DELETE ON appointment
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_client_summary_trigger();
+DROP TRIGGER IF EXISTS trg_consultation_client_summary_insert ON consultation;
+CREATE TRIGGER trg_consultation_client_summary_insert
+AFTER INSERT ON consultation
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_client_summary_trigger();
+DROP TRIGGER IF EXISTS trg_consultation_client_summary_update ON consultation;
+CREATE TRIGGER trg_consultation_client_summary_update
+AFTER UPDATE ON consultation
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_client_summary_trigger();
+DROP TRIGGER IF EXISTS trg_consultation_client_summary_delete ON consultation;
+CREATE TRIGGER trg_consultation_client_summary_delete
+AFTER DELETE ON consultation
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_client_summary_trigger();
+-- follow a client's change of address --
+CREATE OR REPLACE FUNCTION refresh_client_zip_trigger()
+RETURNS trigger AS $$
+BEGIN
+    UPDATE facts_consultations SET zip = NEW.zip WHERE vat = NEW.vat;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS trg_client_zip_facts ON client;
+CREATE TRIGGER trg_client_zip_facts
+AFTER UPDATE OF zip ON client
+FOR EACH ROW
+WHEN (current_setting('clinic.skip_analytics', true) IS DISTINCT FROM 'on')
+EXECUTE FUNCTION refresh_client_zip_trigger();
+-- initial load --
+SELECT refresh_analytics();
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+# The tests run without a database; do not wait long for one at import time
+os.environ.setdefault("FLASK_DB_POOL_TIMEOUT", "1")
+
+
+@pytest.fixture
+def clinic():
+    import app as clinic
+
+    return clinic
+
+
+@pytest.fixture
+def client(clinic):
+    return clinic.app.test_client()
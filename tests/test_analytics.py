@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from analytics import MANIFEST, AnalyticsEngine, AnalyticsUnavailable
+
+
+def test_query_without_an_export_is_unavailable(tmp_path):
+    with pytest.raises(AnalyticsUnavailable):
+        AnalyticsEngine(str(tmp_path), max_groups=100).query(["doctor"], ["consultations"])
+
+
+def test_manifest_without_parquet_files_is_unavailable(tmp_path):
+    (tmp_path / MANIFEST).write_text(json.dumps({"exported_at": None, "months": {}}))
+    with pytest.raises(AnalyticsUnavailable):
+        AnalyticsEngine(str(tmp_path), max_groups=100).query(["doctor"], ["consultations"])
+
+
+def test_route_answers_503_without_parquet_files(clinic, client, tmp_path, monkeypatch):
+    (tmp_path / MANIFEST).write_text(json.dumps({"exported_at": None, "months": {}}))
+    monkeypatch.setattr(clinic, "analytics", AnalyticsEngine(str(tmp_path), max_groups=100))
+    monkeypatch.setitem(clinic.app.config, "ANALYTICS_DIR", str(tmp_path))
+    response = client.get("/api/analytics?by=doctor")
+    assert response.status_code == 503
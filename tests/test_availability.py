@@ -0,0 +1,77 @@
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime
+
+from availability import AvailabilityEngine
+
+Doctor = namedtuple("Doctor", "vat name")
+
+DAY = date(2024, 3, 4)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    """Answers the availability queries; `during_load` runs while they are in flight."""
+
+    def __init__(self, free_pairs, during_load=None):
+        self.free_pairs = free_pairs
+        self.during_load = during_load
+        self.loads = 0
+
+    @contextmanager
+    def pipeline(self):
+        self.loads += 1
+        yield
+        if self.during_load:
+            self.during_load()
+
+    def cursor(self, row_factory=None):
+        return self
+
+    def execute(self, statement, params=None, prepare=False):
+        if params is None:
+            return FakeResult([Doctor(1, "Ana")])
+        return FakeResult(self.free_pairs)
+
+
+def new_engine():
+    return AvailabilityEngine("09:00", "12:00", 60, ttl=60)
+
+
+def test_slot_index_on_and_off_the_grid():
+    engine = new_engine()
+    assert engine.slots_per_day == 3
+    assert engine.slot_index(datetime(2024, 3, 4, 9)) == 0
+    assert engine.slot_index(datetime(2024, 3, 4, 11)) == 2
+    assert engine.slot_index(datetime(2024, 3, 4, 9, 30)) is None
+    assert engine.slot_index(datetime(2024, 3, 4, 8)) is None
+    assert engine.slot_index(datetime(2024, 3, 4, 12)) is None
+
+
+def test_free_slots_are_cached_and_booking_clears_the_bit():
+    engine = new_engine()
+    conn = FakeConnection([(1, datetime(2024, 3, 4, 9)), (1, datetime(2024, 3, 4, 10))])
+    assert [slot for slot, _ in engine.free_slots(conn, DAY, 1)] == [datetime(2024, 3, 4, 9), datetime(2024, 3, 4, 10)]
+
+    engine.book(1, datetime(2024, 3, 4, 9))
+    assert [slot for slot, _ in engine.free_slots(conn, DAY, 1)] == [datetime(2024, 3, 4, 10)]
+    assert conn.loads == 1
+
+
+def test_load_started_before_a_booking_is_not_cached():
+    engine = new_engine()
+    booked = datetime(2024, 3, 4, 9)
+    conn = FakeConnection([(1, booked)], during_load=lambda: engine.book(1, booked))
+    engine.free_slots(conn, DAY, 1)
+
+    conn.during_load = None
+    conn.free_pairs = []
+    assert engine.free_slots(conn, DAY, 1) == []
+    assert conn.loads == 2
@@ -0,0 +1,110 @@
+import io
+from contextlib import contextmanager
+from datetime import date, datetime
+
+import psycopg
+import pytest
+
+from bulk_import import IMPORTS, ImportReport, _load_batch, bulk_import, validate_appointment, validate_client
+
+CLIENT = {"vat": " 1 ", "name": "Ana", "birth_date": "1990-01-02", "street": "Main",
+          "city": "Lisbon", "zip": "1000", "gender": "f"}
+
+
+def test_validate_client_normalizes_the_record():
+    assert validate_client(CLIENT) == ("1", "Ana", date(1990, 1, 2), "Main", "Lisbon", "1000", "F")
+
+
+@pytest.mark.parametrize("changes, message", [
+    ({"name": ""}, "missing name"),
+    ({"gender": "X"}, "invalid gender"),
+    ({"birth_date": "02/01/1990"}, "Invalid isoformat"),
+])
+def test_validate_client_rejects(changes, message):
+    with pytest.raises(ValueError, match=message):
+        validate_client({**CLIENT, **changes})
+
+
+def test_validate_appointment():
+    record = {"vat_doctor": 2, "date_timestamp": "2024-03-04T09:00", "vat_client": "1"}
+    assert validate_appointment(record) == ("2", datetime(2024, 3, 4, 9), "1", "")
+    with pytest.raises(ValueError, match="missing vat_client"):
+        validate_appointment({**record, "vat_client": None})
+
+
+class FakeConnection:
+    """Loads batches; the upsert fails while the staged rows hold a line listed in `bad`."""
+
+    broken = False
+
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.transactions = 0
+        self.staged = []
+
+    @contextmanager
+    def transaction(self):
+        self.transactions += 1
+        self.staged = []
+        yield
+
+    def execute(self, statement, params=None):
+        return self
+
+    def commit(self):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @contextmanager
+    def copy(self, statement):
+        yield self
+
+    def write_row(self, row):
+        self.conn.staged.append(row)
+
+    def execute(self, statement, params=None):
+        if self.conn.bad & {row[0] for row in self.conn.staged}:
+            raise psycopg.DataError("value too long")
+        self.rowcount = len(self.conn.staged)
+        return self
+
+
+def test_failing_batch_is_bisected_down_to_the_bad_row():
+    conn, report = FakeConnection(bad={5}), ImportReport(max_rejects=10)
+    batch = [(line, str(line)) for line in range(1, 9)]
+    _load_batch(conn, IMPORTS["clients"], "staging_client", "line, vat", batch, report)
+    assert report.upserted == 7
+    assert report.rejects == [{"line": 5, "reason": "value too long"}]
+    # 8 rows, then halves of 4, 2 and 1 around the bad row: 7 transactions instead of 9 row by row
+    assert conn.transactions == 7
+
+
+def test_broken_connection_stops_the_import():
+    conn, report = FakeConnection(bad={1}), ImportReport(max_rejects=10)
+    conn.broken = True
+    with pytest.raises(psycopg.DataError):
+        _load_batch(conn, IMPORTS["clients"], "staging_client", "line, vat", [(1, "1"), (2, "2")], report)
+
+
+def test_bulk_import_reports_invalid_records():
+    stream = io.StringIO('{"vat": "1"}\nnot json\n')
+    report = bulk_import(FakeConnection(), "clients", stream, "jsonl", batch_size=10, max_rejects=10)
+    assert report.as_dict() == {
+        "read": 2, "upserted": 0, "rejected": 2,
+        "rejects": [{"line": 1, "reason": "missing name, birth_date, street, city, zip, gender"},
+                    {"line": 2, "reason": "malformed record"}],
+    }
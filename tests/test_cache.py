@@ -0,0 +1,34 @@
+from cache import MemoryBackend, QueryCache
+
+
+def new_cache():
+    return QueryCache(MemoryBackend(max_entries=16, ttl=60))
+
+
+def test_etag_changes_when_tag_is_invalidated():
+    cache = new_cache()
+    before = cache.etag("dashboard")
+    assert cache.etag("dashboard") == before
+    cache.invalidate("dashboard")
+    assert cache.etag("dashboard") != before
+
+
+def test_etag_differs_across_processes_at_the_same_version():
+    # Two memory-backed caches stand for two workers, or one worker before and after a restart
+    first, second = new_cache(), new_cache()
+    assert first.version("dashboard") == second.version("dashboard") == 0
+    assert first.etag("dashboard") != second.etag("dashboard")
+
+
+def test_get_or_load_reloads_after_invalidate():
+    cache = new_cache()
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get_or_load("clients", "page", loader) == 1
+    assert cache.get_or_load("clients", "page", loader) == 1
+    cache.invalidate("clients")
+    assert cache.get_or_load("clients", "page", loader) == 2
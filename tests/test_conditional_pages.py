@@ -0,0 +1,17 @@
+from queries import partition_dashboard
+
+
+def test_dashboard_revalidates_compressed_etag(clinic, client, monkeypatch):
+    monkeypatch.setitem(clinic.app.config, "COMPRESS_MIN_SIZE", 0)
+    monkeypatch.setattr(clinic, "load_dashboard", lambda: partition_dashboard(
+        {"consultation_per_grouped_time": [], "diagnostic_per_age_and_sex": []}
+    ))
+    monkeypatch.setattr(clinic, "render_template", lambda template, **context: "<p>dashboard</p>" * 50)
+
+    first = client.get("/dashboard", headers={"Accept-Encoding": "gzip"})
+    assert first.status_code == 200
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert first.headers["ETag"].startswith('W/"dashboard-')
+
+    second = client.get("/dashboard", headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 304
@@ -0,0 +1,45 @@
+import pytest
+
+
+def test_valid_body_becomes_edit_arguments(clinic):
+    edits, error = clinic.consultation_edits({
+        "soap_s": "better",
+        "nurse": 7,
+        "add_diagnostics": ["A01"],
+        "prescriptions": [{"id": 1, "name": "Aspirin", "lab": "Bayer", "dosage": "1g", "description": "daily"}],
+        "version": 3,
+    })
+    assert error is None
+    assert edits == {
+        "soap": {"soap_s": "better"},
+        "nurse": 7,
+        "add_diagnostics": ["A01"],
+        "remove_diagnostics": [],
+        "prescriptions": [{"id": 1, "name": "Aspirin", "lab": "Bayer", "dosage": "1g", "description": "daily"}],
+        "version": 3,
+    }
+
+
+@pytest.mark.parametrize("body, message", [
+    ([], "expected a JSON object"),
+    ({"soap_x": ""}, "unknown fields: soap_x"),
+    ({"soap_s": 1}, "soap_s must be a string"),
+    ({"nurse": True}, "nurse must be an integer or a string"),
+    ({"add_diagnostics": "A01"}, "add_diagnostics must be a list"),
+    ({"remove_diagnostics": [1.5]}, "remove_diagnostics must hold integers or strings"),
+    ({"prescriptions": [{"id": 1}]}, "each prescription needs exactly"),
+    ({"prescriptions": [{"id": 1, "name": "A", "lab": "B", "dosage": 2, "description": ""}]},
+     "prescription id must be an integer or a string"),
+    ({"version": "3"}, "version must be an integer"),
+    ({"version": True}, "version must be an integer"),
+])
+def test_invalid_body_is_rejected(clinic, body, message):
+    edits, error = clinic.consultation_edits(body)
+    assert edits is None
+    assert error.startswith(message)
+
+
+def test_patch_with_invalid_body_answers_400(client):
+    response = client.patch("/api/consultations/1/2024-03-04 09:00", json={"version": "3"})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "version must be an integer"}
@@ -0,0 +1,55 @@
+from contextlib import contextmanager
+
+import pytest
+
+from db import ReplicaRouter, lsn_value
+
+
+@pytest.mark.parametrize("lsn, value", [
+    ("0/0", 0),
+    ("16/B374D848", (0x16 << 32) | 0xB374D848),
+    ("0/FFFFFFFF", 0xFFFFFFFF),
+    (None, None),
+    ("", None),
+    ("16-B374D848", None),
+    ("16/XYZ", None),
+])
+def test_lsn_value(lsn, value):
+    assert lsn_value(lsn) == value
+
+
+def test_lsn_values_order_like_positions():
+    assert lsn_value("1/0") > lsn_value("0/FFFFFFFF")
+
+
+class FakeReplica:
+    """Answers the replica status query with a fixed replay position and lag."""
+
+    def __init__(self, replayed, lag):
+        self.status = (replayed, lag)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        yield self
+
+    def execute(self, statement, params=None, prepare=False):
+        return self
+
+    def fetchone(self):
+        return self.status
+
+
+def replica_router(replayed, lag):
+    return ReplicaRouter("primary", FakeReplica(replayed, lag), max_lag=5, check_seconds=60)
+
+
+def test_reads_go_to_the_replica_once_it_replayed_the_write():
+    router = replica_router("0/200", lag=0.5)
+    assert router.pool("0/100") == router.replica
+    assert not router.use_replica("0/300")
+
+
+def test_lagging_or_missing_replica_falls_back_to_the_primary():
+    assert not replica_router("0/200", lag=10).use_replica()
+    assert not replica_router(None, lag=None).use_replica()
+    assert ReplicaRouter("primary", None, max_lag=5, check_seconds=60).pool() == "primary"
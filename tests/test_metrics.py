@@ -0,0 +1,24 @@
+from metrics import Metrics, one_line
+
+
+def test_render_prometheus_text():
+    metrics = Metrics(slow_query_ms=100, explain=False)
+    metrics.observe_request("GET", "/clients", 200, 0.02)
+    metrics.observe_query('SELECT "x"', rows=3, seconds=0.2)
+    metrics.observe_query('SELECT "x"', rows=0, seconds=0.001)
+
+    lines = metrics.render({"pool_size": 4, "pool_name": "primary", "healthy": True}).splitlines()
+    assert "# TYPE http_request_duration_seconds histogram" in lines
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/clients",status="200",le="0.01"} 0' in lines
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/clients",status="200",le="0.025"} 1' in lines
+    assert 'http_request_duration_seconds_count{method="GET",route="/clients",status="200"} 1' in lines
+    assert 'db_query_duration_seconds_bucket{statement="SELECT \\"x\\"",le="+Inf"} 2' in lines
+    assert 'db_query_rows_total{statement="SELECT \\"x\\""} 3' in lines
+    assert "db_slow_queries_total 1" in lines
+    assert "db_pool_pool_size 4" in lines
+    assert not any(line.startswith(("db_pool_pool_name", "db_pool_healthy")) for line in lines)
+
+
+def test_one_line_collapses_and_truncates():
+    assert one_line("SELECT *\n    FROM client;") == "SELECT * FROM client;"
+    assert len(one_line("SELECT " + "x, " * 100)) == 120
@@ -0,0 +1,43 @@
+from datetime import date, datetime
+
+import partitioning
+from partitioning import add_months, ensure_month_partitions, months_between, partition_name
+
+
+def test_months_between_spans_year_ends():
+    assert list(months_between(date(2023, 11, 15), date(2024, 2, 1))) == [
+        date(2023, 11, 1), date(2023, 12, 1), date(2024, 1, 1), date(2024, 2, 1),
+    ]
+
+
+def test_months_between_single_and_empty():
+    assert list(months_between(date(2024, 3, 4), date(2024, 3, 31))) == [date(2024, 3, 1)]
+    assert list(months_between(date(2024, 3, 4), date(2024, 2, 1))) == []
+
+
+def test_add_months_and_partition_name():
+    assert add_months(date(2024, 12, 1), 1) == date(2025, 1, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+    assert partition_name("appointment", date(2024, 3, 1)) == "appointment_y2024m03"
+
+
+def test_ensure_month_partitions_stays_within_the_horizon(monkeypatch):
+    created = []
+    monkeypatch.setattr(partitioning, "ensure_partitions", lambda conn, first, last: created.append((first, last)))
+    this_month = partitioning.month_start(date.today())
+    next_month = add_months(this_month, 1)
+    days = [
+        datetime.combine(next_month, datetime.min.time()),
+        datetime.combine(this_month, datetime.min.time()),
+        datetime.combine(add_months(this_month, -1), datetime.min.time()),
+        datetime.combine(add_months(this_month, 3), datetime.min.time()),
+    ]
+    assert ensure_month_partitions(None, days, months_ahead=2) == [this_month, next_month]
+    assert created == [(this_month, next_month)]
+
+
+def test_ensure_month_partitions_without_rows_in_the_horizon(monkeypatch):
+    created = []
+    monkeypatch.setattr(partitioning, "ensure_partitions", lambda conn, first, last: created.append((first, last)))
+    assert ensure_month_partitions(None, [date(2000, 1, 1)], months_ahead=2) == []
+    assert created == []
@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+
+import pytest
+
+from queries import ConsultationConflict, edit_consultation, partition_dashboard
+
+
+class FakeConnection:
+    """Records the statements of an edit; the consultation UPDATE returns `row`."""
+
+    def __init__(self, row):
+        self.row = row
+        self.statements = []
+        self.rolled_back = False
+
+    @contextmanager
+    def transaction(self):
+        try:
+            yield
+        except Exception:
+            self.rolled_back = True
+            raise
+
+    @contextmanager
+    def pipeline(self):
+        yield
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None, prepare=False):
+        self.conn.statements.append((statement, params))
+        return self
+
+    def executemany(self, statement, params_seq):
+        self.conn.statements.append((statement, list(params_seq)))
+
+    def fetchone(self):
+        return self.conn.row
+
+
+def test_edit_returns_the_new_version():
+    conn = FakeConnection(row=(4,))
+    assert edit_consultation(conn, "1", "2024-03-04 09:00", soap={"soap_s": "better"}, version=3) == 4
+    statement, params = conn.statements[0]
+    assert "AND version = %(version)s" in statement
+    assert params["version"] == 3 and params["soap_s"] == "better"
+
+
+def test_stale_version_raises_conflict_and_rolls_back():
+    conn = FakeConnection(row=None)
+    with pytest.raises(ConsultationConflict):
+        edit_consultation(conn, "1", "2024-03-04 09:00", nurse="7", add_diagnostics=["3"], version=3)
+    assert conn.rolled_back
+    assert len(conn.statements) == 3
+
+
+def test_unknown_soap_fields_are_ignored():
+    conn = FakeConnection(row=(1,))
+    edit_consultation(conn, "1", "2024-03-04 09:00", soap={"soap_x": "no"})
+    statement, params = conn.statements[0]
+    assert "soap_x" not in statement and "soap_x" not in params
+    assert "AND version" not in statement
+
+
+def test_partition_dashboard_splits_grouping_levels():
+    grand_total = {"year": None, "month": None, "day": None}
+    year = {"year": 2024, "month": None, "day": None}
+    month = {"year": 2024, "month": 3, "day": None}
+    day = {"year": 2024, "month": 3, "day": 4}
+    both = {"age": 30, "gender": "F"}
+    age = {"age": 30, "gender": None}
+    gender = {"age": None, "gender": "F"}
+    everyone = {"age": None, "gender": None}
+
+    sections = partition_dashboard({
+        "consultation_per_grouped_time": [grand_total, year, month, day],
+        "diagnostic_per_age_and_sex": [both, age, gender, everyone],
+    })
+    assert sections == {
+        "yearly": [year], "monthly": [month], "daily": [day],
+        "per_age_and_gender": [both], "per_age": [age], "per_gender": [gender],
+    }
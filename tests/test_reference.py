@@ -0,0 +1,91 @@
+from collections import namedtuple
+from contextlib import contextmanager
+
+import psycopg
+import pytest
+
+from reference import MEDICATIONS_STATEMENT, NURSES_STATEMENT, VERSION_STATEMENT, ReferenceCache, ReferenceData
+
+Row = namedtuple("Row", "vat id name lab", defaults=(None,) * 4)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakePool:
+    """Serves the reference queries, or fails every connection while `down` is set."""
+
+    def __init__(self, version=1):
+        self.version = version
+        self.down = False
+
+    @contextmanager
+    def connection(self):
+        if self.down:
+            raise psycopg.OperationalError("connection refused")
+        yield self
+
+    @contextmanager
+    def pipeline(self):
+        yield
+
+    def cursor(self, row_factory=None):
+        return self
+
+    def execute(self, statement, params=None, prepare=False):
+        if statement == VERSION_STATEMENT:
+            return FakeResult([(self.version,)])
+        if statement == NURSES_STATEMENT:
+            return FakeResult([Row(vat=1)])
+        if statement == MEDICATIONS_STATEMENT:
+            return FakeResult([Row(name="Aspirin", lab="Bayer")])
+        return FakeResult([Row(id=7)])
+
+
+def test_failed_version_check_serves_the_current_snapshot():
+    pool, cache = FakePool(), ReferenceCache(check_seconds=0)
+    loaded = cache.get(pool)
+    pool.down = True
+    assert cache.get(pool) is loaded
+
+
+def test_failure_before_the_first_load_raises():
+    pool, cache = FakePool(), ReferenceCache(check_seconds=0)
+    pool.down = True
+    with pytest.raises(psycopg.OperationalError):
+        cache.get(pool)
+    pool.down = False
+    assert cache.get(pool).nurses == (Row(vat=1),)
+
+
+def test_new_version_replaces_the_snapshot():
+    pool, cache = FakePool(), ReferenceCache(check_seconds=0)
+    loaded = cache.get(pool)
+    assert cache.get(pool) is loaded
+    pool.version = 2
+    assert cache.get(pool).version == 2
+
+
+def medications_snapshot():
+    names = [("Ibuprofen", "Bayer"), ("aspirin", "Bayer"), ("Aspirin", "Pfizer"), ("Aspirin", "Bayer")]
+    return ReferenceData(1, [], [], [Row(name=name, lab=lab) for name, lab in names])
+
+
+def test_search_medications_is_case_insensitive_and_ordered():
+    found = medications_snapshot().search_medications("ASPIRIN")
+    assert found == [("Aspirin", "Bayer"), ("Aspirin", "Pfizer"), ("aspirin", "Bayer")]
+
+
+def test_search_medications_pages_after_a_cursor():
+    data = medications_snapshot()
+    first = data.search_medications("", limit=2)
+    assert first == [("Aspirin", "Bayer"), ("Aspirin", "Pfizer")]
+    assert data.search_medications("", after=first[-1], limit=2) == [("Ibuprofen", "Bayer"), ("aspirin", "Bayer")]